@@ -0,0 +1,140 @@
+"""
+First Divergence - when each discrepancy of a stored run started
+
+Auditors found where a discrepancy came from by bisecting the movement
+sheet by date: cut it at some day, total it, compare with the stock of that
+day, and repeat. first_divergence() does that for every discrepancy of a
+run at once, from the movement rows kept with it (see movements) and the
+month-end stock snapshots stored for the unit (see snapshots).
+
+The balance of a reference at a month end is its opening offset (what the
+atelier's comparison adds to the movement, e.g. the previous stock for
+Mags) plus the total of its movement rows dated up to that day. Every
+balance comes from one np.searchsorted() over the (key, day) stamps of the
+sorted rows and their precomputed running totals, for all discrepancies
+and one month end at a time. A reference agrees with a snapshot when the
+two are within the tolerance the unit's processor matches with
+(MATCH_TOLERANCE, 0 when it has none); it diverges at the first
+movement row with a quantity after the last month end at which it agreed
+('Since'), or at its first such row when no snapshot agreed. Rows without
+a date only count toward the run's total and are never a divergence.
+"""
+
+import numpy as np
+import pandas as pd
+
+from movements import NO_DATE, balances_through, key_positions, movement_timeline, ref_key, rows_through
+from quantities import QTY_SCALE, difference, fixed, largest_positions, to_fixed
+from runs import load_atelier, load_meta, load_movements, run_info
+from snapshots import stored_months, stored_stock
+from stock_delta import atelier_localisations, atelier_stock
+
+
+def _month_end(year: int, month: int) -> int:
+    """Days since the epoch of a month's last day."""
+    return int((np.datetime64(f"{year:04d}-{month:02d}", 'M') + 1).astype('datetime64[D]').astype('int64')) - 1
+
+
+def _month_start(day: int) -> int:
+    return int(np.datetime64(int(day), 'D').astype('datetime64[M]').astype('datetime64[D]').astype('int64'))
+
+
+def _date(day) -> str | None:
+    return None if day == NO_DATE else str(np.datetime64(int(day), 'D'))
+
+
+def stock_checkpoints(unit: str, month, year: int) -> list[tuple[int, pd.DataFrame]]:
+    """(month-end day, stock frame) of the unit's usable snapshots before (month, year), oldest first."""
+    checkpoints = []
+    for snap_year, snap_month in stored_months(unit):
+        if (snap_year, snap_month) >= (int(year), int(month)):
+            continue
+        stored = stored_stock(unit, snap_month, snap_year)
+        if stored is not None:
+            checkpoints.append((_month_end(snap_year, snap_month), stored[0]))
+    return checkpoints
+
+
+def _atelier_stock(positions: pd.DataFrame, args: dict) -> pd.Series | None:
+    """Stock of an atelier per reference key, None when its stock cannot be told apart in the snapshot."""
+    localisations = positions['Localisation'].dropna().unique().tolist() if 'Localisation' in positions.columns else []
+    keys = atelier_localisations(args, localisations)
+    if keys is None:
+        return None
+    stock = atelier_stock(positions, keys)
+    return stock.groupby(stock['Ref'].map(ref_key))['Stock_Qty'].sum()
+
+
+def atelier_divergence(views: dict, index: dict | None, checkpoints: list[tuple[int, pd.Series]],
+                       tolerance: float = 0.0) -> list[dict]:
+    """First divergence of each discrepancy of an atelier, largest |Difference| first."""
+    columns = views['discrepancies']['columns']
+    refs = np.asarray(columns['Ref']).astype(str)
+    count = len(refs)
+    calc = to_fixed(columns['Calc_Mov_Qty'])
+    diff = to_fixed(columns['Difference'])
+
+    since = np.full(count, NO_DATE, dtype='int64')
+    if index is None:
+        first = np.full(count, -1, dtype='int64')
+    else:
+        positions = key_positions(index, refs)
+        timeline = movement_timeline(index)
+        starts, days = np.asarray(index['starts']), np.asarray(index['days'])
+        ends = starts[np.maximum(positions, 0) + 1]
+        # Everything the movement rows do not account for is the comparison's opening offset
+        total = np.where(positions >= 0, timeline['cumulative'][ends] - timeline['cumulative'][starts[np.maximum(positions, 0)]], 0)
+        offset = calc - total
+
+        # Month ends before the month of the atelier's first dated row say nothing of its movement
+        dated = days[days != NO_DATE]
+        opening = _month_start(dated.min()) - 1 if len(dated) else None
+        wanted = pd.Index(refs).map(ref_key)
+        for day, snapshot in checkpoints:
+            if opening is None or day < opening:
+                continue
+            expected = snapshot.reindex(wanted, fill_value=0).to_numpy(dtype='int64')
+            balance = offset + balances_through(index, timeline, positions, day)
+            since = np.where(np.abs(difference(expected, balance)) <= fixed(tolerance), day, since)
+
+        moving = timeline['moving'][rows_through(timeline, positions, since)]
+        first = np.where((positions >= 0) & (moving < ends), moving, -1)
+        # Undated rows come last: a reference whose next row has no date has no divergence date
+        undated = np.append(days == NO_DATE, True)[first]
+        first = np.where(undated, -1, first)
+
+    rows = []
+    for i in largest_positions(np.abs(diff).astype('float64'), count):
+        row = {'Ref': str(refs[i]), 'Difference': int(diff[i]) / QTY_SCALE, 'Since': _date(since[i]),
+               'FirstDivergence': None, 'Sheet': None, 'Row': None}
+        if first[i] >= 0:
+            row.update({'FirstDivergence': _date(index['days'][first[i]]),
+                        'Sheet': str(index['sheets'][index['sheet'][first[i]]]), 'Row': int(index['row'][first[i]])})
+        rows.append(row)
+    return rows
+
+
+def first_divergence(run_id: str, sheet_args: dict, atelier: str | None = None, year: int = 2025,
+                     tolerance: float = 0.0) -> dict:
+    """First divergence date of every discrepancy of a stored run, per atelier or for one atelier.
+
+    `tolerance` is the largest difference the unit's processor counts as a match.
+    """
+    meta = load_meta(run_id)
+    snapshots = stock_checkpoints(meta['unit'], meta['month'], year)
+
+    ateliers = [atelier] if atelier else list(meta['ateliers'])
+    results = {}
+    for name in ateliers:
+        entry = load_atelier(run_id, name, meta)
+        if entry['error']:
+            results[name] = {'error': entry['error'], 'rows': []}
+            continue
+        checkpoints = []
+        for day, positions in snapshots:
+            stock = _atelier_stock(positions, sheet_args.get(name, {}))
+            if stock is not None:
+                checkpoints.append((day, stock))
+        results[name] = {'rows': atelier_divergence(entry['views'], load_movements(run_id, name, meta), checkpoints,
+                                                    tolerance)}
+    return {'run': run_info(run_id, meta), 'checkpoints': [_date(day) for day, _ in snapshots], 'ateliers': results}
@@ -0,0 +1,180 @@
+"""
+Resolved Layouts - sheet/header decisions handed from verify to process
+
+verify_files() already works out, per atelier, which sheet is used and which
+row holds the header. It returns that as a layout stamped with the file's
+fingerprint; process_atelier() trusts the layout (and skips sheet probing and
+header detection) only while the fingerprint still matches the file on disk.
+
+Layouts that processed cleanly are also remembered per (unit, atelier, sheet
+signature). Next month's workbook with the same sheet names and the same
+header row is read straight at the known header row, restricted to the columns
+the unit can use; detection only runs again when that changes. Title rows
+above the header (which name the month) are not compared: a header that moved
+no longer has its labels on the remembered row.
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from storage import load_json, save_json
+from workbook import header_labels, list_sheets, peek_sheet
+
+
+# Rows peeked when resolving a layout; every unit's own header scan stops earlier
+LAYOUT_SCAN_ROWS = 100
+
+LAYOUTS_FILE = 'layouts.json'
+# Sheet signatures kept per atelier (oldest dropped first)
+MAX_SIGNATURES = 12
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _norm_label(value) -> str:
+    return ' '.join(str(value).split()).casefold()
+
+
+def file_fingerprint(path: str) -> str:
+    """Identify a file by location, size and modification time."""
+    st = os.stat(path)
+    return _hash(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}")
+
+
+def build_layout(path: str, sheet: str, header_row, ref_col=None, qty_col=None, date_col=None) -> dict:
+    return {
+        'sheet': sheet,
+        'headerRow': int(header_row) if header_row is not None else None,
+        'refCol': ref_col,
+        'qtyCol': qty_col,
+        'dateCol': date_col,
+        'fingerprint': file_fingerprint(path),
+    }
+
+
+def trusted_layout(layout, path: str, sheet_override=None) -> dict | None:
+    """Return the layout if it can be used as-is for `path`, otherwise None.
+
+    A layout is stale once the file changed, and it does not apply when the
+    user picked a different sheet than the one it was resolved for.
+    """
+    if not isinstance(layout, dict) or layout.get('headerRow') is None or not layout.get('sheet'):
+        return None
+    if sheet_override and sheet_override != layout['sheet']:
+        return None
+    try:
+        if layout.get('fingerprint') != file_fingerprint(path):
+            return None
+    except OSError:
+        return None
+    return layout
+
+
+def layout_usecols(layout: dict | None) -> list[int] | None:
+    """Column positions to read for a trusted layout (None reads every column)."""
+    return layout.get('usecols') if layout else None
+
+
+def column_names(*specs) -> list[str]:
+    """Every string found in the given config values (lists, dicts, tuples, nested)."""
+    names = []
+    stack = list(specs)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            names.append(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set)):
+            stack.extend(value)
+    return names
+
+
+def needed_columns(header_values: list, names: list[str]) -> list[int] | None:
+    """Positions of header cells matching any of `names` (or naming a date).
+
+    Returns None when the selection cannot be read by position without changing
+    labels (a repeated header that read_excel would suffix with .1).
+    """
+    wanted = {_norm_label(n) for n in names}
+    positions = []
+    for i, (raw, label) in enumerate(zip(header_values, header_labels(header_values))):
+        if pd.isna(raw):
+            continue
+        norm = _norm_label(label)
+        if norm in wanted or 'date' in norm:
+            if label != raw:
+                return None
+            positions.append(i)
+    return positions or None
+
+
+def sheet_signature(path: str) -> str:
+    return _hash('\x1f'.join(list_sheets(path)))
+
+
+def _header_hash(raw: pd.DataFrame, header_row: int) -> str | None:
+    """Hash of the header row's cells."""
+    if len(raw) <= header_row:
+        return None
+    row = [None if pd.isna(v) else str(v) for v in raw.iloc[header_row]]
+    while row and row[-1] is None:
+        row.pop()
+    return _hash(json.dumps(row, ensure_ascii=False))
+
+
+def load_memory() -> dict:
+    return load_json(LAYOUTS_FILE, {})
+
+
+def recall_layout(unit: str, atelier: str, path: str, memory: dict | None = None) -> dict | None:
+    """Layout remembered for this atelier if the file's signature and header row still match."""
+    memory = load_memory() if memory is None else memory
+    entry = memory.get(unit, {}).get(atelier, {}).get(sheet_signature(path))
+    if not entry:
+        return None
+
+    header_row = entry['headerRow']
+    raw = peek_sheet(path, entry['sheet'], nrows=header_row + 1)
+    if _header_hash(raw, header_row) != entry.get('headerHash'):
+        return None
+
+    layout = build_layout(path, entry['sheet'], header_row,
+                          entry.get('refCol'), entry.get('qtyCol'), entry.get('dateCol'))
+    layout['usecols'] = entry.get('usecols')
+    layout['remembered'] = True
+    return layout
+
+
+def remember_layouts(unit: str, entries: dict) -> None:
+    """Store {atelier: (path, layout, column names)} under each file's sheet signature."""
+    if not entries:
+        return
+    memory = load_memory()
+    for atelier, (path, layout, names) in entries.items():
+        header_row = layout['headerRow']
+        raw = peek_sheet(path, layout['sheet'], nrows=header_row + 1)
+        header_hash = _header_hash(raw, header_row)
+        if header_hash is None:
+            continue
+
+        signatures = memory.setdefault(unit, {}).setdefault(atelier, {})
+        signature = sheet_signature(path)
+        signatures.pop(signature, None)
+        signatures[signature] = {
+            'sheet': layout['sheet'],
+            'headerRow': header_row,
+            'headerHash': header_hash,
+            'usecols': needed_columns(raw.iloc[header_row].tolist(), names),
+            'refCol': layout.get('refCol'),
+            'qtyCol': layout.get('qtyCol'),
+            'dateCol': layout.get('dateCol'),
+        }
+        while len(signatures) > MAX_SIGNATURES:
+            signatures.pop(next(iter(signatures)))
+    save_json(LAYOUTS_FILE, memory)
@@ -0,0 +1,213 @@
+"""
+Movement Ledger - movement rows kept in SQLite, so months are queried, not re-parsed
+
+Every run parses the movement workbooks again, although most of a
+workbook's rows were already read the month before. When the ledger is
+used, each ingested workbook is normalized once into rows of (unit,
+atelier, ref, date, fixed-point qty, row hash) in LEDGER_FILE, indexed on (unit, atelier, ref, date). Movement up to any
+month is then one indexed aggregate query. Rows without a date (sheets
+with no date column) count in every month, as a workbook run counts
+them; rows whose date cannot be read are left out, as processors filter
+them out.
+
+A row is identified by its hash over (unit, atelier, ref, date, qty) and
+its occurrence among identical rows, not by its row number: next month's
+workbook repeats this month's rows, possibly shifted, and re-ingesting it
+only inserts the rows not already present. Which sources (workbooks, by
+full path) hold each row is kept in row_sources. Ingesting a source again
+replaces its links in one transaction, and a row is deleted only once no
+ingested source still holds it, so a corrected workbook drops its removed
+rows without losing those a later workbook repeats. A file whose
+fingerprint was already ingested at its path is skipped unread.
+
+The ledger reads a movement sheet as a whole. Ateliers that read several
+sheets, or filter movement rows by localisation, are processed from their
+workbooks as before.
+"""
+
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+from layouts import LAYOUT_SCAN_ROWS, file_fingerprint, trusted_layout
+from quantities import read_quantities
+from sheet_cache import read_sheet
+from storage import data_path
+from workbook import peek_sheet, resolve_sheet
+
+
+LEDGER_FILE = 'ledger.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS movements (
+    unit TEXT NOT NULL,
+    atelier TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    date TEXT,
+    qty INTEGER NOT NULL,
+    row_hash INTEGER NOT NULL,
+    UNIQUE (unit, atelier, row_hash)
+);
+CREATE INDEX IF NOT EXISTS movements_by_ref ON movements (unit, atelier, ref, date);
+CREATE TABLE IF NOT EXISTS row_sources (
+    unit TEXT NOT NULL,
+    atelier TEXT NOT NULL,
+    path TEXT NOT NULL,
+    row_hash INTEGER NOT NULL,
+    PRIMARY KEY (unit, atelier, path, row_hash)
+);
+CREATE INDEX IF NOT EXISTS row_sources_by_row ON row_sources (unit, atelier, row_hash);
+CREATE TABLE IF NOT EXISTS sources (
+    unit TEXT NOT NULL,
+    atelier TEXT NOT NULL,
+    path TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (unit, atelier, path)
+);
+"""
+
+
+def connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(data_path(LEDGER_FILE))
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _norm(value) -> str:
+    return ' '.join(str(value).split()).casefold()
+
+
+def _find_col(columns, candidates) -> object | None:
+    """First candidate naming a column, compared as written and then ignoring case and spacing."""
+    labels = {_norm(col): col for col in columns}
+    for name in candidates:
+        if name in columns:
+            return name
+        if _norm(name) in labels:
+            return labels[_norm(name)]
+    return None
+
+
+def movement_rows(processor, atelier: str, path: str, layout: dict | None = None) -> tuple[pd.DataFrame, int]:
+    """Movement rows of an atelier's workbook as 'Ref', 'Date', 'Qty' (fixed-point), and the unreadable quantity count."""
+    args = getattr(processor, 'sheet_args', {}).get(atelier)
+    if args is None:
+        raise ValueError(f"Unknown atelier: {atelier}")
+    if os.path.splitext(path)[1].lower() == '.csv':
+        raise ValueError("CSV movement files are not kept in the ledger")
+    if 'mov localisation cols' in args:
+        raise ValueError("Movement filtered by localisation is not kept in the ledger")
+    sheets = args.get('sheet_name')
+    sheets = list(sheets) if isinstance(sheets, (list, tuple)) else [sheets]
+    if any(isinstance(s, (list, tuple)) for s in sheets):
+        raise ValueError("Ateliers reading several movement sheets are not kept in the ledger")
+
+    layout = trusted_layout(layout, path)
+    if layout:
+        sheet, header_idx = layout['sheet'], layout['headerRow']
+    else:
+        sheet = resolve_sheet(path, sheets)
+        if sheet is None:
+            raise ValueError(f"Could not find sheet {sheets}")
+        header_idx = processor.find_mov_header(atelier, peek_sheet(path, sheet, nrows=LAYOUT_SCAN_ROWS))
+    mov = read_sheet(path, sheet_name=sheet, header=header_idx if header_idx is not None else 0)
+
+    names = getattr(processor, 'mov_possible_col_names', {})
+    mov_cols = args.get('mov cols')
+    if isinstance(mov_cols, (list, tuple)) and len(mov_cols) == 2 and all(isinstance(c, str) for c in mov_cols):
+        ref_col, qty_col = _find_col(mov.columns, [mov_cols[0]]), _find_col(mov.columns, [mov_cols[1]])
+    else:
+        ref_col = _find_col(mov.columns, [c for c in [(layout or {}).get('refCol')] if c] + names.get('ref', []))
+        qty_col = _find_col(mov.columns, [c for c in [(layout or {}).get('qtyCol')] if c] + names.get('quantity', []))
+    date_col = _find_col(mov.columns, [c for c in [(layout or {}).get('dateCol')] if c] + names.get('date', []))
+    if ref_col is None or qty_col is None:
+        raise ValueError(f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}")
+
+    refs = mov[ref_col].astype('string').str.strip().str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    qty, unreadable = read_quantities(mov[qty_col])
+    dates = pd.to_datetime(mov[date_col], errors='coerce') if date_col is not None else pd.Series(pd.NaT, index=mov.index)
+    rows = pd.DataFrame({'Ref': refs, 'Date': dates.dt.strftime('%Y-%m-%d'), 'Qty': qty})
+    keep = rows['Ref'].notna() & (rows['Ref'] != '')
+    if date_col is not None:
+        keep &= dates.notna()
+    return rows[keep].reset_index(drop=True), int(unreadable[keep].sum())
+
+
+def _row_hashes(rows: pd.DataFrame) -> np.ndarray:
+    """Signed 64-bit row identities within an atelier; identical rows are told apart by their occurrence."""
+    keyed = rows[['Ref', 'Date', 'Qty']].astype({'Ref': 'object', 'Date': 'object'}).fillna({'Date': ''})
+    keyed['Occurrence'] = keyed.groupby(['Ref', 'Date', 'Qty'], sort=False).cumcount()
+    return pd.util.hash_pandas_object(keyed, index=False).to_numpy().view('int64')
+
+
+def ingested(unit: str, atelier: str, path: str) -> bool:
+    """Whether this exact file was already ingested at its path for the atelier."""
+    with closing(connect()) as conn, conn:
+        found = conn.execute('SELECT 1 FROM sources WHERE unit = ? AND atelier = ? AND path = ? AND fingerprint = ?',
+                             (unit, atelier, os.path.abspath(path), file_fingerprint(path))).fetchone()
+    return found is not None
+
+
+def ingest(unit: str, atelier: str, path: str, rows: pd.DataFrame) -> tuple[int, int]:
+    """Make `rows` the rows of this source; returns how many rows the ledger gained and lost.
+
+    Rows not already present are inserted. A row the source no longer has
+    is deleted only when no other ingested source still holds it.
+    """
+    hashes = _row_hashes(rows).tolist()
+    source = os.path.abspath(path)
+    records = zip([unit] * len(rows), [atelier] * len(rows), rows['Ref'].astype(str).tolist(),
+                  rows['Date'].astype(object).where(rows['Date'].notna(), None).tolist(),
+                  rows['Qty'].astype('int64').tolist(), hashes)
+    with closing(connect()) as conn, conn:
+        dropped = {h for (h,) in conn.execute('SELECT row_hash FROM row_sources WHERE unit = ? AND atelier = ? AND path = ?',
+                                              (unit, atelier, source))}.difference(hashes)
+        conn.execute('DELETE FROM row_sources WHERE unit = ? AND atelier = ? AND path = ?', (unit, atelier, source))
+
+        before = conn.total_changes
+        conn.executemany('INSERT OR IGNORE INTO movements (unit, atelier, ref, date, qty, row_hash) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', records)
+        inserted = conn.total_changes - before
+        conn.executemany('INSERT OR IGNORE INTO row_sources (unit, atelier, path, row_hash) VALUES (?, ?, ?, ?)',
+                         ((unit, atelier, source, h) for h in hashes))
+
+        before = conn.total_changes
+        conn.executemany('DELETE FROM movements WHERE unit = ? AND atelier = ? AND row_hash = ? AND NOT EXISTS '
+                         '(SELECT 1 FROM row_sources WHERE unit = ? AND atelier = ? AND row_hash = ?)',
+                         ((unit, atelier, h, unit, atelier, h) for h in dropped))
+        removed = conn.total_changes - before
+        conn.execute('INSERT OR REPLACE INTO sources (unit, atelier, path, fingerprint) VALUES (?, ?, ?, ?)',
+                     (unit, atelier, source, file_fingerprint(path)))
+    return inserted, removed
+
+
+def _month_start(month, year: int) -> str:
+    return f"{int(year):04d}-{int(month):02d}-01"
+
+
+def _month_end(month, year: int) -> str:
+    """First day after the month."""
+    m = int(month)
+    return _month_start(1, int(year) + 1) if m == 12 else _month_start(m + 1, year)
+
+
+def movement_totals(unit: str, atelier: str, month, year: int, only_month: bool = False) -> pd.DataFrame:
+    """Movement per reference ('Ref', 'Calc_Mov_Qty') dated up to the end of the month, or within it.
+
+    Undated rows count either way, as they do when the workbook is processed.
+    """
+    query = 'SELECT ref, SUM(qty) FROM movements WHERE unit = ? AND atelier = ? AND (date IS NULL OR (date < ?'
+    params = [unit, atelier, _month_end(month, year)]
+    if only_month:
+        query += ' AND date >= ?'
+        params.append(_month_start(month, year))
+    query += '))'
+    with closing(connect()) as conn, conn:
+        totals = conn.execute(query + ' GROUP BY ref', params).fetchall()
+    return pd.DataFrame({
+        'Ref': pd.Series([ref for ref, _ in totals], dtype='string'),
+        'Calc_Mov_Qty': np.array([qty for _, qty in totals], dtype='int64'),
+    })
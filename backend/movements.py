@@ -0,0 +1,159 @@
+"""
+Movement Drill-down - the movement rows behind each reference of a run
+
+Processors reduce a movement sheet to one total per reference, and the rows
+behind a discrepancy could only be found again by opening the workbook and
+filtering it by hand. Each processor now also hands back the rows it summed
+(movement_detail(): reference, date, fixed-point quantity, sheet and row
+number) under its result's '_movements' key, and retain_run() stores them
+with the run in the layout movement_index() builds: the rows sorted by
+reference key, then date, sheet and row, next to the sorted distinct keys
+and the offset of each key's first row. reference_history() finds a
+reference with one binary search and slices its rows, so with the arrays
+memory-mapped a lookup reads a few pages whatever the size of the run.
+
+Keys are references with runs of whitespace collapsed and lowercased
+(ref_key), the way run_diff compares references across runs.
+"""
+
+import numpy as np
+import pandas as pd
+
+from quantities import QTY_SCALE
+
+
+# 'days' of a row without a readable date
+NO_DATE = np.iinfo('int32').min
+
+MOVEMENT_ARRAYS = ('keys', 'starts', 'days', 'qty', 'sheet', 'row', 'sheets')
+
+
+def ref_key(ref) -> str:
+    return ' '.join(str(ref).split()).lower()
+
+
+def movement_detail(mov: pd.DataFrame, ref_col, qty_col, date_col, sheet, first_row: int) -> pd.DataFrame:
+    """Movement rows as summed per reference: 'Ref', 'Date', 'Qty' (fixed-point), 'Sheet', 'Row'.
+
+    `mov` must still be indexed by position in the sheet as read, its
+    quantities already in fixed-point; first_row is the sheet row number of
+    position 0 (header row + 2 when read with a header).
+    """
+    if date_col is not None:
+        dates = pd.to_datetime(mov[date_col], errors='coerce')
+    else:
+        dates = pd.Series(pd.NaT, index=mov.index, dtype='datetime64[ns]')
+    detail = pd.DataFrame({
+        'Ref': mov[ref_col].astype('string'),
+        'Date': dates,
+        'Qty': mov[qty_col].astype('int64'),
+        'Sheet': str(sheet),
+        'Row': mov.index.to_numpy(dtype='int64') + first_row,
+    })
+    return detail[detail['Ref'].notna()].reset_index(drop=True)
+
+
+def concat_movements(parts: list) -> pd.DataFrame | None:
+    """One frame of several parts' movement rows; a single part is kept as is (so ateliers sharing it store it once)."""
+    parts = [part for part in parts if part is not None]
+    if len(parts) <= 1:
+        return parts[0] if parts else None
+    return pd.concat(parts, ignore_index=True)
+
+
+def movement_index(detail: pd.DataFrame) -> dict:
+    """Arrays of the sorted layout of an atelier's movement rows."""
+    ref_codes, refs = pd.factorize(detail['Ref'])
+    key_codes, keys = pd.factorize(np.array([ref_key(ref) for ref in refs], dtype=object), sort=True)
+    row_keys = key_codes[ref_codes] if len(ref_codes) else np.array([], dtype='int64')
+    sheet_codes, sheets = pd.factorize(detail['Sheet'])
+
+    dated = detail['Date'].notna().to_numpy()
+    days = np.full(len(detail), NO_DATE, dtype='int32')
+    days[dated] = detail['Date'].to_numpy()[dated].astype('datetime64[D]').astype('int64')
+    rows = detail['Row'].to_numpy(dtype='int32')
+    # Undated rows come after the dated ones of their reference
+    order = np.lexsort((rows, sheet_codes, np.where(dated, days, np.iinfo('int32').max), row_keys))
+
+    return {
+        'keys': np.array(keys, dtype=str) if len(keys) else np.array([], dtype='U1'),
+        'starts': np.searchsorted(row_keys[order], np.arange(len(keys) + 1)).astype('int64'),
+        'days': days[order],
+        'qty': detail['Qty'].to_numpy(dtype='int64')[order],
+        'sheet': sheet_codes.astype('int16')[order],
+        'row': rows[order],
+        'sheets': np.array(sheets, dtype=str) if len(sheets) else np.array([], dtype='U1'),
+    }
+
+
+def _span(index: dict, ref) -> tuple[int, int]:
+    """Positions [start, end) of a reference's rows."""
+    key = ref_key(ref)
+    keys = index['keys']
+    pos = int(np.searchsorted(keys, key))
+    if pos == len(keys) or str(keys[pos]) != key:
+        return 0, 0
+    return int(index['starts'][pos]), int(index['starts'][pos + 1])
+
+
+def reference_history(index: dict, ref) -> dict:
+    """A reference's movement rows in date order, with the running total of their quantities."""
+    start, end = _span(index, ref)
+    qty = np.asarray(index['qty'][start:end])
+    cumulative = np.cumsum(qty)
+    days = np.asarray(index['days'][start:end])
+    rows = [{
+        'Date': None if day == NO_DATE else str(np.datetime64(int(day), 'D')),
+        'Qty': int(q) / QTY_SCALE,
+        'Cumulative': int(total) / QTY_SCALE,
+        'Sheet': str(index['sheets'][sheet]),
+        'Row': int(row),
+    } for day, q, total, sheet, row in zip(days, qty, cumulative, index['sheet'][start:end], index['row'][start:end])]
+    return {'ref': ref, 'rows': rows, 'total': int(qty.sum()) / QTY_SCALE}
+
+
+def key_positions(index: dict, refs) -> np.ndarray:
+    """Position of each reference's key among the index's keys, -1 for a reference without movement rows."""
+    keys = np.asarray(index['keys'])
+    wanted = np.array([ref_key(ref) for ref in refs], dtype=str) if len(refs) else np.array([], dtype='U1')
+    if not len(keys):
+        return np.full(len(wanted), -1, dtype='int64')
+    pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+    return np.where(keys[pos] == wanted, pos, -1)
+
+
+def movement_timeline(index: dict) -> dict:
+    """Running totals of the sorted rows, searchable by (key, day).
+
+    'stamps' orders every row by key then day (undated rows last) as one
+    int64, so np.searchsorted() finds the rows of any number of keys up to
+    any number of days at once; 'cumulative' holds the running total before
+    each row (and the grand total), and 'moving' the first row at or after
+    each one whose quantity is not zero (the row count when there is none).
+    """
+    starts = np.asarray(index['starts'])
+    days = np.asarray(index['days']).astype('int64')
+    row_keys = np.repeat(np.arange(len(starts) - 1, dtype='int64'), np.diff(starts))
+    ordinal = np.where(days == NO_DATE, 1 << 32, days - NO_DATE)
+    qty = np.asarray(index['qty'])
+    moving = np.append(np.where(qty != 0, np.arange(len(qty)), len(qty)), len(qty))
+    return {
+        'stamps': (row_keys << 33) | ordinal,
+        'cumulative': np.concatenate([[0], np.cumsum(qty)]).astype('int64'),
+        'moving': np.minimum.accumulate(moving[::-1])[::-1],
+    }
+
+
+def rows_through(timeline: dict, positions: np.ndarray, days) -> np.ndarray:
+    """Per key position (-1 for none), the first row after the key's rows dated up to `days`."""
+    days = np.broadcast_to(np.asarray(days, dtype='int64'), positions.shape)
+    stamps = (np.maximum(positions, 0) << 33) | (days - NO_DATE)
+    return np.searchsorted(timeline['stamps'], stamps, side='right')
+
+
+def balances_through(index: dict, timeline: dict, positions: np.ndarray, days) -> np.ndarray:
+    """Per key position (-1 for none), the total of the key's rows dated up to `days`."""
+    starts = np.asarray(index['starts'])
+    first = starts[np.maximum(positions, 0)]
+    total = timeline['cumulative'][rows_through(timeline, positions, days)] - timeline['cumulative'][first]
+    return np.where(positions >= 0, total, 0)
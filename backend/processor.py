@@ -6,9 +6,24 @@ Routes processing requests to unit-specific processors
 import sys
 import json
 import os
+import time
 import traceback
+import numpy as np
 import pandas as pd
 
+from divergence import first_divergence
+from ledger import ingest, ingested, movement_rows, movement_totals
+from layouts import (LAYOUT_SCAN_ROWS, build_layout, column_names, file_fingerprint, load_memory, recall_layout,
+                     remember_layouts, trusted_layout)
+from run_diff import diff_runs
+from runs import (edit_results, list_runs, load_meta, query_results, reference_movements, replace_atelier, restore_run,
+                  retain_run, run_exists)
+from sheet_cache import cache_sheets
+from snapshots import stock_snapshot, stored_stock
+from quantities import comparison_summary, difference, fixed, join_quantities, largest_positions, merge_summaries, quantity_records
+from stock_delta import atelier_localisations, atelier_stock, cross_check, delta_records, month_before, stock_delta
+from workbook import header_labels, list_sheets, peek_sheet, resolve_sheet
+
 # Fix Windows console encoding for Unicode
 if sys.platform == 'win32':
     import io
@@ -21,6 +36,35 @@ def log_debug(msg):
     print(f"[DEBUG] {msg}", file=sys.stderr)
 
 
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None when it cannot be read"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                            ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                            ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                            ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                            ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return None
+            return counters.PeakWorkingSetSize / (1024 * 1024)
+
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except Exception:
+        return None
+
+
 # Unit module mapping
 UNIT_MODULES = {
     'Fath1': 'processor_fath1',
@@ -73,6 +117,90 @@ def get_mov_col_names(unit):
     })
 
 
+def _expected_sheets(sheet_args, atelier):
+    expected_sheet = sheet_args.get(atelier, {}).get('sheet_name', '')
+    if isinstance(expected_sheet, (list, tuple)):
+        return list(expected_sheet)
+    if expected_sheet not in (None, ''):
+        return [expected_sheet]
+    return []
+
+
+def resolve_layout(unit, atelier, file_path, memory=None):
+    """Layout for a movement workbook: remembered from an earlier month, else detected from a peek"""
+    processor = get_unit_processor(unit)
+    find_mov_header = getattr(processor, 'find_mov_header', None)
+    if find_mov_header is None or os.path.splitext(file_path)[1].lower() == '.csv':
+        return None
+    
+    layout = recall_layout(unit, atelier, file_path, memory)
+    if layout:
+        return layout
+    
+    sheet = resolve_sheet(file_path, _expected_sheets(get_sheet_args(unit), atelier))
+    if sheet is None:
+        return None
+    return build_layout(file_path, sheet, find_mov_header(atelier, peek_sheet(file_path, sheet, nrows=LAYOUT_SCAN_ROWS)))
+
+
+def attach_layouts(unit, matched_files):
+    """Give every movement file a layout unless it already carries one that is still valid"""
+    memory = load_memory()
+    attached = {}
+    for atelier, file_info in matched_files.items():
+        attached[atelier] = file_info
+        if not isinstance(file_info, dict) or not file_info.get('path'):
+            continue
+        if trusted_layout(file_info.get('layout'), file_info['path']):
+            continue
+        try:
+            layout = resolve_layout(unit, atelier, file_info['path'], memory)
+        except Exception as e:
+            log_debug(f"No layout for {atelier}: {str(e)}")
+            layout = None
+        if layout:
+            attached[atelier] = {**file_info, 'layout': layout}
+    return attached
+
+
+def run_inputs(stock_file, matched_files):
+    """Paths and fingerprints of a run's files, with the layout each movement file was read with"""
+    def describe(path, layout=None):
+        entry = {'path': path, 'fingerprint': file_fingerprint(path) if path and os.path.exists(path) else None}
+        if layout:
+            entry['layout'] = layout
+        return entry
+
+    stock_files = stock_file if isinstance(stock_file, dict) else {'path': stock_file}
+    inputs = {'stock': describe(stock_files.get('path'))}
+    if stock_files.get('prevPath'):
+        inputs['prevStock'] = describe(stock_files['prevPath'])
+    inputs['ateliers'] = {atelier: describe(file_info.get('path'), file_info.get('layout'))
+                          for atelier, file_info in matched_files.items() if isinstance(file_info, dict)}
+    return inputs
+
+
+def remember_processed_layouts(unit, matched_files, results, overrides=None):
+    """Remember the layouts of ateliers that processed without error"""
+    processor = get_unit_processor(unit)
+    sheet_args = get_sheet_args(unit)
+    entries = {}
+    for atelier, file_info in matched_files.items():
+        result = results.get(atelier) if isinstance(results, dict) else None
+        if not isinstance(file_info, dict) or not isinstance(result, dict) or result.get('error'):
+            continue
+        atelier_overrides = (overrides or {}).get(atelier) or {}
+        layout = trusted_layout(file_info.get('layout'), file_info['path'], sheet_override=atelier_overrides.get('sheetName'))
+        if layout:
+            names = column_names(getattr(processor, 'mov_possible_col_names', {}), sheet_args.get(atelier, {}),
+                                 atelier_overrides.get('refCol'), atelier_overrides.get('qtyCol'))
+            entries[atelier] = (file_info['path'], layout, names)
+    try:
+        remember_layouts(unit, entries)
+    except Exception as e:
+        log_debug(f"Could not save layouts: {str(e)}")
+
+
 def match_files_to_ateliers(unit, files):
     """Match uploaded files to ateliers based on keywords"""
     ateliers = get_ateliers(unit)
@@ -113,6 +241,9 @@ def verify_files(unit, matched_files):
     
     sheet_args = get_sheet_args(unit)
     mov_col_names = get_mov_col_names(unit)
+    # The unit's own header rule, so the resolved layout matches what process would find
+    find_mov_header = getattr(get_unit_processor(unit), 'find_mov_header', None)
+    memory = load_memory()
     
     verification_results = {}
     
@@ -131,7 +262,8 @@ def verify_files(unit, matched_files):
             'expectedSheet': '',
             'detectedRefCol': None,
             'detectedQtyCol': None,
-            'detectedDateCol': None
+            'detectedDateCol': None,
+            'layout': None
         }
         
         try:
@@ -139,36 +271,27 @@ def verify_files(unit, matched_files):
             if atelier in sheet_args:
                 result['expectedSheet'] = sheet_args[atelier].get('sheet_name', '')
             
-            # Read Excel file and get available sheets
-            xl = pd.ExcelFile(file_path)
-            result['availableSheets'] = xl.sheet_names
+            # List sheets from the workbook index (no sheet is parsed)
+            sheet_names = list_sheets(file_path)
+            result['availableSheets'] = sheet_names
             
             # Check if expected sheet exists
-            expected_sheet = result['expectedSheet']
-            expected_candidates = []
-            if isinstance(expected_sheet, (list, tuple)):
-                expected_candidates = list(expected_sheet)
-            elif expected_sheet not in (None, ''):
-                expected_candidates = [expected_sheet]
-
-            sheet_found = False
-            first_found_sheet = None
-            for candidate in expected_candidates:
-                if candidate in xl.sheet_names:
-                    sheet_found = True
-                    first_found_sheet = candidate
-                    break
+            expected_candidates = _expected_sheets(sheet_args, atelier)
+
+            first_found_sheet = resolve_sheet(file_path, expected_candidates)
+            sheet_found = first_found_sheet is not None
             
             if not sheet_found and expected_candidates:
                 result['valid'] = False
                 result['errors'].append(f"Sheet '{expected_candidates[0]}' not found")
             
             # Try to read the sheet (use expected or first available)
-            sheet_to_read = first_found_sheet if sheet_found else (xl.sheet_names[0] if xl.sheet_names else None)
+            sheet_to_read = first_found_sheet if sheet_found else (sheet_names[0] if sheet_names else None)
             
             if sheet_to_read:
-                # Read to find columns
-                temp_df = pd.read_excel(file_path, sheet_name=sheet_to_read, header=None, nrows=20)
+                # Peek at the top of the sheet only; nothing below it is parsed
+                scan_df = peek_sheet(file_path, sheet_to_read, nrows=LAYOUT_SCAN_ROWS)
+                temp_df = scan_df.head(20)
                 
                 # Try to find header row
                 header_idx = 0
@@ -178,28 +301,28 @@ def verify_files(unit, matched_files):
                         header_idx = idx
                         break
                 
-                # Read with proper header
-                df = pd.read_excel(file_path, sheet_name=sheet_to_read, header=header_idx)
-                result['availableColumns'] = [str(col) for col in df.columns.tolist()]
+                # Column labels as read_excel(header=header_idx) would name them
+                columns = header_labels(temp_df.iloc[header_idx].tolist()) if len(temp_df) else []
+                result['availableColumns'] = [str(col) for col in columns]
                 
                 # Check for required columns
                 found_ref = None
                 for col_name in mov_col_names.get('ref', []):
-                    if col_name in df.columns:
+                    if col_name in columns:
                         found_ref = col_name
                         break
                 result['detectedRefCol'] = found_ref
                 
                 found_qty = None
                 for col_name in mov_col_names.get('quantity', []):
-                    if col_name in df.columns:
+                    if col_name in columns:
                         found_qty = col_name
                         break
                 result['detectedQtyCol'] = found_qty
                 
                 found_date = None
                 for col_name in mov_col_names.get('date', []):
-                    if col_name in df.columns:
+                    if col_name in columns:
                         found_date = col_name
                         break
                 result['detectedDateCol'] = found_date
@@ -211,6 +334,17 @@ def verify_files(unit, matched_files):
                 if not found_qty:
                     result['valid'] = False
                     result['errors'].append("Quantity column not found")
+                
+                # Hand the resolved sheet/header row to process (trusted while the file is unchanged)
+                if sheet_found and find_mov_header is not None:
+                    # A layout remembered from an earlier month skips detection altogether
+                    layout = recall_layout(unit, atelier, file_path, memory)
+                    if layout is None or layout['sheet'] != sheet_to_read:
+                        layout = build_layout(
+                            file_path, sheet_to_read, find_mov_header(atelier, scan_df),
+                            ref_col=found_ref, qty_col=found_qty, date_col=found_date
+                        )
+                    result['layout'] = layout
             
         except Exception as e:
             result['valid'] = False
@@ -223,7 +357,7 @@ def verify_files(unit, matched_files):
 
 
 def process_files(unit, stock_file, matched_files, month):
-    """Process files using the unit-specific processor"""
+    """Process files using the unit-specific processor; matched files already carry their layouts (attach_layouts)"""
     log_debug(f"Processing unit: {unit}")
     log_debug(f"Stock file: {stock_file}")
     log_debug(f"Matched files: {json.dumps(list(matched_files.keys()))}")
@@ -231,12 +365,43 @@ def process_files(unit, stock_file, matched_files, month):
     
     processor = get_unit_processor(unit)
     results = processor.process_all(stock_file, matched_files, month)
+    remember_processed_layouts(unit, matched_files, results)
     
     return results
 
 
+def unit_summary(results):
+    """Summary of a whole unit, from the summaries its ateliers computed with their comparison"""
+    return merge_summaries(data.get('_summary') for atelier, data in results.items()
+                           if not atelier.startswith('_') and isinstance(data, dict))
+
+
+def take_movements(results):
+    """Remove the movement rows ('_movements') each atelier hands back, as {atelier: frame}, for the retained run"""
+    return {atelier: data.pop('_movements') for atelier, data in results.items()
+            if not atelier.startswith('_') and isinstance(data, dict) and data.get('_movements') is not None}
+
+
+def keep_top_discrepancies(results, top_k):
+    """Keep only each atelier's top_k discrepancies by |Difference|, largest first.
+
+    Used once the run is retained: the other rows (and the matches) are
+    fetched from it when needed. 'partial' gives the full row counts.
+    """
+    for atelier, data in results.items():
+        if atelier.startswith('_') or not isinstance(data, dict) or data.get('error'):
+            continue
+        rows = data.get('discrepancies') or []
+        magnitude = np.abs(np.array([row.get('Difference') or 0 for row in rows], dtype='float64'))
+        top = largest_positions(magnitude, top_k)
+        data['partial'] = {'matches': len(data.get('matches') or []), 'discrepancies': len(rows)}
+        data['matches'] = []
+        data['discrepancies'] = [rows[i] for i in top]
+    return results
+
+
 def process_files_with_overrides(unit, stock_file, matched_files, month, overrides):
-    """Process files with custom sheet/column overrides"""
+    """Process files with custom sheet/column overrides; matched files already carry their layouts (attach_layouts)"""
     log_debug(f"Processing unit with overrides: {unit}")
     log_debug(f"Overrides: {json.dumps(overrides)}")
     
@@ -251,9 +416,166 @@ def process_files_with_overrides(unit, stock_file, matched_files, month, overrid
         log_debug("Processor doesn't support overrides, using regular processing")
         results = processor.process_all(stock_file, matched_files, month)
     
+    remember_processed_layouts(unit, matched_files, results, overrides)
+    return results
+
+
+def process_run_atelier(run_id, atelier, stock_file=None, mov_file=None, overrides=None):
+    """Process one atelier of a retained run again and put its new result in the run.
+
+    Only that atelier's movement file is read: the unit's stock index is
+    retained on disk by its processor (stock_index.retained_index) and
+    sheets already parsed come from the sheet cache. The stock and movement
+    files default to those the run was made with.
+    """
+    meta = load_meta(run_id)
+    unit, month = meta['unit'], meta['month']
+    inputs = meta.get('inputs') or {}
+    if not stock_file:
+        stock_file = {'path': (inputs.get('stock') or {}).get('path')}
+        if inputs.get('prevStock'):
+            stock_file['prevPath'] = inputs['prevStock']['path']
+    if not mov_file:
+        recorded = (inputs.get('ateliers') or {}).get(atelier)
+        if not recorded:
+            raise ValueError(f"No movement file recorded for atelier: {atelier}")
+        mov_file = {key: recorded[key] for key in ('path', 'layout') if recorded.get(key)}
+    log_debug(f"Processing atelier {atelier} of run {run_id} again")
+    
+    started = time.perf_counter()
+    matched_files = attach_layouts(unit, {atelier: mov_file})
+    if overrides:
+        results = process_files_with_overrides(unit, stock_file, matched_files, month, {atelier: overrides})
+    else:
+        results = process_files(unit, stock_file, matched_files, month)
+    movements = take_movements(results)
+    result = results.get(atelier) or {'error': results.get('_error') or f'Atelier was not processed: {atelier}',
+                                      'matches': [], 'discrepancies': []}
+    
+    patched = replace_atelier(run_id, atelier, result, movements=movements.get(atelier),
+                              inputs=run_inputs(stock_file, matched_files)['ateliers'].get(atelier),
+                              timings={'reprocess': round(time.perf_counter() - started, 3)})
+    return {'atelier': atelier, 'result': result, 'summary': patched['summary']}
+
+
+def stock_delta_files(unit, stock_file, month, year, prev_stock_file=None, prev_month=None, prev_year=None,
+                      matched_files=None):
+    """Stock change between an earlier month and `month`, cross-checked against the month's movement files"""
+    log_debug(f"Stock delta for unit: {unit} ({prev_month}-{prev_year} -> {month}-{year})")
+    
+    processor = get_unit_processor(unit)
+    if not hasattr(processor, 'stock_positions'):
+        raise ValueError(f"Stock deltas are not supported for unit: {unit}")
+    
+    current, unparsed = stock_snapshot(unit, month, year, stock_file['path'], processor.stock_positions)
+    prev_path = (prev_stock_file or {}).get('path')
+    if prev_path:
+        prev = stock_snapshot(unit, prev_month, prev_year, prev_path, processor.stock_positions)
+    else:
+        prev = stored_stock(unit, prev_month, prev_year)
+        if prev is None:
+            raise ValueError(f"No stock stored for {unit} {prev_month}-{prev_year}: select that month's stock file")
+    prev_stock, prev_unparsed = prev
+    
+    delta = stock_delta(prev_stock, current)
+    result = {'deltas': delta_records(delta), 'unparsedQuantities': unparsed + prev_unparsed}
+    if matched_files:
+        matched_files = attach_layouts(unit, matched_files)
+        result['crossCheck'] = cross_check(unit, processor, delta, {**stock_file, 'prevMonth': prev_month, 'prevYear': prev_year},
+                                           matched_files, month, year)
+    return result
+
+
+def ledger_ingest_files(unit, matched_files):
+    """Add the movement rows of matched workbooks to the ledger; files already ingested are skipped"""
+    processor = get_unit_processor(unit)
+    matched_files = attach_layouts(unit, matched_files)
+    ingestion = {}
+    for atelier, file_info in matched_files.items():
+        try:
+            if ingested(unit, atelier, file_info['path']):
+                ingestion[atelier] = {'rows': 0, 'inserted': 0, 'removed': 0, 'unchanged': True}
+                continue
+            rows, unreadable = movement_rows(processor, atelier, file_info['path'], file_info.get('layout'))
+            inserted, removed = ingest(unit, atelier, file_info['path'], rows)
+            ingestion[atelier] = {'rows': len(rows), 'inserted': inserted, 'removed': removed, 'unchanged': False,
+                                  'unparsedQuantities': unreadable}
+            log_debug(f"Ledger {atelier}: {inserted} rows inserted, {removed} removed, of {len(rows)}")
+        except Exception as e:
+            log_debug(f"Could not ingest {atelier}: {str(e)}")
+            ingestion[atelier] = {'error': str(e)}
+    return ingestion
+
+
+def process_from_ledger(unit, stock_file, ateliers, month, year):
+    """Reconcile ateliers against the movement ledger instead of their workbooks"""
+    log_debug(f"Processing unit from ledger: {unit}")
+    
+    processor = get_unit_processor(unit)
+    if not hasattr(processor, 'stock_positions'):
+        raise ValueError(f"Ledger processing is not supported for unit: {unit}")
+    try:
+        positions, unparsed = stock_snapshot(unit, month, year, stock_file['path'], processor.stock_positions)
+    except Exception as e:
+        return {'_error': f'Failed to load stock file: {str(e)}'}
+    
+    # Units whose expected stock starts from the opening stock add only the month's movement to it
+    from_opening = getattr(processor, 'CALC_INCLUDES_OPENING_STOCK', False)
+    tolerance = fixed(getattr(processor, 'MATCH_TOLERANCE', 0.0))
+    opening = None
+    if from_opening:
+        opening = stored_stock(unit, *month_before(month, year))
+        if opening is None:
+            return {'_error': f"No stock stored for {unit} {'-'.join(map(str, month_before(month, year)))}"}
+    
+    localisations = positions['Localisation'].dropna().unique().tolist() if 'Localisation' in positions.columns else []
+    sheet_args = get_sheet_args(unit)
+    results = {}
+    for atelier in ateliers:
+        keys = atelier_localisations(sheet_args.get(atelier, {}), localisations)
+        if keys is None:
+            results[atelier] = {'error': 'Stock cannot be split the way this atelier reads it', 'matches': [], 'discrepancies': []}
+            continue
+        
+        mov_agg = movement_totals(unit, atelier, month, year, only_month=from_opening)
+        if from_opening:
+            mov_agg = join_quantities(atelier_stock(opening[0], keys).rename(columns={'Stock_Qty': 'Prev_Stock_Qty'}), mov_agg)
+            mov_agg['Calc_Mov_Qty'] += mov_agg.pop('Prev_Stock_Qty')
+        
+        comparison_df = join_quantities(atelier_stock(positions, keys), mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
+        
+        discrepancies = comparison_df[comparison_df['Difference'].abs() > tolerance].sort_values(by='Difference', ascending=False)
+        matches = comparison_df[comparison_df['Difference'].abs() <= tolerance]
+        results[atelier] = {
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': unparsed + (opening[1] if from_opening else 0)
+        }
     return results
 
 
+def prefetch_file(unit, file_path, atelier=None):
+    """Parse a dropped workbook into the sheet cache ahead of Process.
+
+    A stock file caches every sheet; a movement file caches the sheets its
+    atelier may read. CSV files are read directly and are not cached.
+    """
+    if os.path.splitext(file_path)[1].lower() == '.csv':
+        return []
+    if atelier is None:
+        return cache_sheets(file_path)
+    
+    candidates = _expected_sheets(get_sheet_args(unit), atelier)
+    names = set(column_names(candidates))
+    sheets = [s for s in list_sheets(file_path) if s in names]
+    resolved = resolve_sheet(file_path, candidates)
+    if resolved is not None and resolved not in sheets:
+        sheets.append(resolved)
+    return cache_sheets(file_path, sheets)
+
+
 def export_results(results, output_dir):
     """Export results to CSV files"""
     
@@ -335,11 +657,107 @@ def main():
             month = request.get('month')
             overrides = request.get('overrides')
             
+            # Layouts are resolved up front so the run records what each file was read with
+            started = time.perf_counter()
+            matched_files = attach_layouts(unit, matched_files)
             if overrides:
                 results = process_files_with_overrides(unit, stock_file, matched_files, month, overrides)
             else:
                 results = process_files(unit, stock_file, matched_files, month)
+            movements = take_movements(results)
+            results['_summary'] = unit_summary(results)
+            timings = {'process': round(time.perf_counter() - started, 3)}
             response = {'success': True, 'results': results}
+            try:
+                response['runId'] = retain_run(unit, month, results, inputs=run_inputs(stock_file, matched_files),
+                                               timings=timings, movements=movements)
+            except Exception as e:
+                log_debug(f"Could not retain run: {str(e)}")
+            
+            # First look: only the largest discrepancies, the rest stay in the retained run
+            top_k = request.get('topK')
+            if top_k and 'runId' in response:
+                keep_top_discrepancies(results, int(top_k))
+            peak = peak_rss_mb()
+            if peak is not None:
+                log_debug(f"Peak memory: {peak:.0f} MB")
+        
+        elif action == 'process_atelier':
+            run_id = request.get('runId')
+            processed = process_run_atelier(run_id, request.get('atelier'), stock_file=request.get('stockFile'),
+                                            mov_file=request.get('matchedFile'), overrides=request.get('overrides'))
+            top_k = request.get('topK')
+            if top_k:
+                keep_top_discrepancies({processed['atelier']: processed['result']}, int(top_k))
+            response = {'success': True, 'runId': run_id, **processed}
+        
+        elif action == 'stock_delta':
+            month = request.get('month')
+            year = int(request.get('year') or 2025)
+            prev_month, prev_year = month_before(month, year)
+            if request.get('prevMonth'):
+                prev_month, prev_year = f"{int(request['prevMonth']):02d}", int(request.get('prevYear') or year)
+            
+            result = stock_delta_files(request.get('unit'), request.get('stockFile'), month, year,
+                                       prev_stock_file=request.get('prevStockFile'), prev_month=prev_month,
+                                       prev_year=prev_year, matched_files=request.get('matchedFiles'))
+            response = {'success': True, **result}
+        
+        elif action == 'ledger_ingest':
+            ingestion = ledger_ingest_files(request.get('unit'), request.get('matchedFiles', {}))
+            response = {'success': True, 'ingestion': ingestion}
+        
+        elif action == 'ledger_process':
+            unit = request.get('unit')
+            ateliers = request.get('ateliers') or list(request.get('matchedFiles') or get_ateliers(unit))
+            results = process_from_ledger(unit, request.get('stockFile'), ateliers, request.get('month'),
+                                          int(request.get('year') or 2025))
+            results['_summary'] = unit_summary(results)
+            response = {'success': True, 'results': results}
+        
+        elif action == 'query_results' and not run_exists(request.get('runId')):
+            # Pruned or stored by an older version: the renderer drops its run id
+            response = {'success': False, 'error': f"Run not found: {request.get('runId')}", 'runMissing': True}
+        
+        elif action == 'query_results':
+            page = query_results(request.get('runId'), request.get('atelier'), request.get('view', 'discrepancies'),
+                                 search=request.get('search') or '', sort=request.get('sortColumn'),
+                                 direction=request.get('sortDirection', 'asc'), offset=request.get('offset', 0),
+                                 limit=request.get('limit', 200), prefix=bool(request.get('prefix')))
+            response = {'success': True, **page}
+        
+        elif action == 'list_runs':
+            response = {'success': True, 'runs': list_runs(request.get('unit'))}
+        
+        elif action == 'restore_run':
+            run_id = request.get('runId')
+            restored = restore_run(run_id, top_k=request.get('topK'))
+            response = {'success': True, 'runId': run_id, **restored}
+        
+        elif action == 'diff_runs':
+            diff = diff_runs(request.get('baseRunId'), request.get('runId'), atelier=request.get('atelier'))
+            response = {'success': True, **diff}
+        
+        elif action == 'first_divergence':
+            run_id = request.get('runId')
+            unit = load_meta(run_id)['unit']
+            divergence = first_divergence(run_id, get_sheet_args(unit), atelier=request.get('atelier'),
+                                          year=int(request.get('year') or 2025),
+                                          tolerance=getattr(get_unit_processor(unit), 'MATCH_TOLERANCE', 0.0))
+            response = {'success': True, **divergence}
+        
+        elif action == 'reference_movements':
+            history = reference_movements(request.get('runId'), request.get('atelier'), request.get('ref'))
+            response = {'success': True, **history}
+        
+        elif action == 'edit_results':
+            edited = edit_results(request.get('runId'), request.get('atelier'), request.get('view'),
+                                  remove=request.get('remove'), rename=request.get('rename'))
+            response = {'success': True, **edited}
+        
+        elif action == 'prefetch':
+            cached = prefetch_file(request.get('unit'), request.get('path'), request.get('atelier'))
+            response = {'success': True, 'cachedSheets': cached}
         
         elif action == 'export':
             results = request.get('results', {})
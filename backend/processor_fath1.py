@@ -6,6 +6,14 @@ import pandas as pd
 import os
 import re
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, join_quantities, quantity_records, read_quantities
+from read_plan import run_plan, shared_value
+from sheet_cache import read_sheet
+from stock_index import as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_unreadable
+from workbook import list_sheets, resolve_sheet
+
 
 # Sheet arguments configuration
 sheet_args = {
@@ -29,6 +37,8 @@ sheet_args = {
     'mov-com': {'sheet_name': 'MOV', 'localisation': ['MAGASIN COMMERCIAL']}
 }
 
+stock_columns = ['REFERENCE', 'LOCALISATION', 'QUANTITE']
+
 mov_possible_col_names = {
     'date': ['Date', 'DATE', 'date'],
     'ref': ['Référence\nFournisseur', 'REFERENCE', 'reference', 'Référence', 'Référence\n'],
@@ -45,8 +55,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
     """Load and prepare stock data from Fath1"""
     # Try to read Excel and find appropriate sheet
     try:
-        xl = pd.ExcelFile(stock_file_path)
-        available_sheets = xl.sheet_names
+        available_sheets = list_sheets(stock_file_path)
         
         # Try to find a sheet with STOCK in the name
         sheet_to_use = None
@@ -59,7 +68,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         if sheet_to_use is None:
             sheet_to_use = available_sheets[0]
         
-        stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=None)
+        stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=None)
     except Exception as e:
         raise ValueError(f"Could not read stock file: {stock_file_path} - {str(e)}")
     
@@ -67,7 +76,10 @@ def load_stock(stock_file_path, stock_sheet_name=None):
     
     # Find the row with the MOST non-empty values (this should be your header row)
     header_idx = stock.notna().sum(axis=1).idxmax()
-    stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
+    del stock
+    # Only the columns the reconciliation reads are parsed
+    stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=header_idx,
+                       usecols=lambda col: col in stock_columns)
     
     # Clean object columns
     object_columns = stock.select_dtypes(include=['object']).columns
@@ -80,135 +92,143 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         stock['REFERENCE'] = stock['REFERENCE'].astype('string')
         stock['REFERENCE'] = stock['REFERENCE'].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
     
-    # Convert quantity
+    # Convert quantity to fixed-point, flagging cells that are not numbers
     if 'QUANTITE' in stock.columns:
-        stock['QUANTITE'] = pd.to_numeric(stock['QUANTITE'], errors='coerce')
+        stock['QUANTITE'], stock[UNREADABLE_COL] = read_quantities(stock['QUANTITE'])
     
-    return stock
+    return as_categories(stock, [c for c in ('REFERENCE', 'LOCALISATION') if c in stock.columns])
 
 
-def process_atelier(atelier_key, stock_df, mov_file_path, month):
-    """Process a single atelier and return matches/discrepancies"""
+def stock_positions(stock_file_path):
+    """Stock per (localisation, reference) for stock deltas, and its unreadable quantity count"""
+    return index_positions(build_stock_index(load_stock(stock_file_path), 'LOCALISATION', 'REFERENCE', 'QUANTITE'))
+
+
+def _stock_index(stock_file_path):
+    """Stock indexed by localisation"""
+    return build_stock_index(load_stock(stock_file_path), 'LOCALISATION', 'REFERENCE', 'QUANTITE')
+
+
+def find_mov_header(atelier_key, raw):
+    """Return the header row (first row naming a date column) of a header=None frame, or None"""
+    for idx, row in raw.iterrows():
+        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
+        if any(name in row_values for name in mov_possible_col_names['date']):
+            return idx
+    return None
+
+
+def _mov_sheet_header(atelier_key, mov_file_path, sheet_candidates, layout, shared=None):
+    """Sheet and header row of the movement file, trusting a verified layout when it still matches the file"""
+    if layout:
+        return layout['sheet'], layout['headerRow']
     
-    if atelier_key not in sheet_args:
-        return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
+    sheet_name = resolve_sheet(mov_file_path, sheet_candidates)
+    if sheet_name is None:
+        return None, None
     
-    args = sheet_args[atelier_key]
+    # Scan for header row containing a date column
+    header_idx = shared_value(
+        shared, ('header', sheet_name),
+        lambda: find_mov_header(atelier_key, read_sheet(mov_file_path, sheet_name=sheet_name, header=None))
+    )
+    return sheet_name, header_idx
+
+
+def _movement_agg(mov_file_path, sheet_name, header_idx, usecols, ref_col=None, qty_col=None):
+    """Movement quantity per reference for one sheet, as (mov_agg, movement rows, unreadable quantity count, error)"""
+    if header_idx is not None:
+        mov = read_sheet(mov_file_path, sheet_name=sheet_name, header=header_idx, usecols=usecols)
+    else:
+        mov = read_sheet(mov_file_path, sheet_name=sheet_name)
     
-    try:
-        # Read Movement File - scan for header row containing a date column
-        temp_df = pd.read_excel(mov_file_path, sheet_name=args['sheet_name'], header=None)
-        header_idx = 0
-        found_header = False
-        
-        for idx, row in temp_df.iterrows():
-            row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-            if any(name in row_values for name in mov_possible_col_names['date']):
-                header_idx = idx
-                found_header = True
+    # Use custom columns or find automatically
+    if not ref_col:
+        for name in mov_possible_col_names['ref']:
+            if name in mov.columns:
+                ref_col = name
                 break
-        
-        if found_header:
-            mov = pd.read_excel(mov_file_path, sheet_name=args['sheet_name'], header=header_idx)
-        else:
-            mov = pd.read_excel(mov_file_path, sheet_name=args['sheet_name'])
-        
-        # Find Columns
-        found_cols = {}
-        for col_type, possible_names in mov_possible_col_names.items():
-            for name in possible_names:
-                if name in mov.columns:
-                    found_cols[col_type] = name
-                    break
-        
-        if 'ref' not in found_cols or 'quantity' not in found_cols:
-            return {
-                'error': f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        ref_col = found_cols['ref']
-        qty_col = found_cols['quantity']
-        
-        # Clean Movement Data
-        object_columns_mov = mov.select_dtypes(include=['object']).columns
-        for col in object_columns_mov:
+    
+    if not qty_col:
+        for name in mov_possible_col_names['quantity']:
+            if name in mov.columns:
+                qty_col = name
+                break
+    
+    if not ref_col or not qty_col:
+        return None, None, 0, f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}"
+    date_col = next((name for name in mov_possible_col_names['date'] if name in mov.columns), None)
+    
+    # Clean Movement Data
+    object_columns_mov = mov.select_dtypes(include=['object']).columns
+    for col in object_columns_mov:
+        if col != date_col:
             mov[col] = mov[col].astype(str).str.strip()
-        
-        mov[ref_col] = mov[ref_col].astype('string')
-        mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce')
-        
-        # Group Movement
-        mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-        mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-        
-        # Filter Stock by localisation
-        localisations = args['localisation']
-        stock_filtered = stock_df[stock_df['LOCALISATION'].isin(localisations)].copy()
-        
-        # Group Stock
-        stock_agg = stock_filtered.groupby('REFERENCE')['QUANTITE'].sum().reset_index()
-        stock_agg.rename(columns={'REFERENCE': 'Ref', 'QUANTITE': 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
-        
-        # Comparison
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
-        
-        # Results
-        discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
-        matches = comparison_df[comparison_df['Difference'] == 0]
-        
-        return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
-        }
-        
-    except Exception as e:
-        return {'error': str(e), 'matches': [], 'discrepancies': []}
+    
+    mov[ref_col] = mov[ref_col].astype('string')
+    mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    mov[qty_col], unreadable = read_quantities(mov[qty_col])
+    
+    # Group Movement, keeping the rows for drill-down
+    movements = movement_detail(mov, ref_col, qty_col, date_col, sheet_name, (header_idx or 0) + 2)
+    mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
+    mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
+    
+    return mov_agg, movements, int(unreadable.sum()), None
 
 
-def process_all(stock_file, matched_files, month):
-    """Process all matched files for Fath1"""
-    results = {}
+def _compare(atelier_key, stock_index, mov_agg, mov_unreadable=0, movements=None):
+    """Compare the atelier's stock (looked up by localisation) with its movement aggregate"""
+    localisations = sheet_args[atelier_key]['localisation']
+    stock_agg = stock_aggregate(stock_index, localisations)
     
-    # Load stock once
-    try:
-        stock_df = load_stock(stock_file['path'])
-    except Exception as e:
-        return {'_error': f'Failed to load stock file: {str(e)}'}
+    # Comparison
+    comparison_df = join_quantities(stock_agg, mov_agg)
+    comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
     
-    # Process each atelier
-    for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_df, mov_file['path'], month)
+    # Results
+    discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
+    matches = comparison_df[comparison_df['Difference'] == 0]
     
-    return results
+    return {
+        'matches': quantity_records(matches),
+        'discrepancies': quantity_records(discrepancies),
+        '_summary': comparison_summary(matches, discrepancies),
+        'unparsedQuantities': stock_unreadable(stock_index, localisations) + mov_unreadable,
+        '_movements': movements
+    }
+
+
+def process_atelier(atelier_key, stock_index, mov_file_path, month, layout=None, shared=None):
+    """Process a single atelier and return matches/discrepancies"""
+    return process_atelier_with_overrides(atelier_key, stock_index, mov_file_path, month, {}, layout=layout, shared=shared)
+
+
+def process_all(stock_file, matched_files, month):
+    """Process all matched files for Fath1"""
+    return process_all_with_overrides(stock_file, matched_files, month, None)
 
 
 def process_all_with_overrides(stock_file, matched_files, month, overrides):
     """Process all matched files for Fath1 with custom overrides"""
-    results = {}
-    
-    # Load stock once
+    # Load stock once and index it by localisation
     try:
-        stock_df = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
     
-    # Process each atelier with overrides
-    for atelier_key, mov_file in matched_files.items():
+    # Process the ateliers grouped by the movement sheet they read, parsing each sheet once
+    def process(atelier_key, mov_file, shared):
         atelier_overrides = overrides.get(atelier_key, {}) if overrides else {}
-        results[atelier_key] = process_atelier_with_overrides(
-            atelier_key, stock_df, mov_file['path'], month, atelier_overrides
+        return process_atelier_with_overrides(
+            atelier_key, stock_index, mov_file['path'], month, atelier_overrides,
+            layout=mov_file.get('layout'), shared=shared
         )
     
-    return results
+    return run_plan(sheet_args, matched_files, process, overrides)
 
 
-def process_atelier_with_overrides(atelier_key, stock_df, mov_file_path, month, overrides):
+def process_atelier_with_overrides(atelier_key, stock_index, mov_file_path, month, overrides, layout=None, shared=None):
     """Process a single atelier with custom sheet/column overrides"""
     
     if atelier_key not in sheet_args:
@@ -217,86 +237,25 @@ def process_atelier_with_overrides(atelier_key, stock_df, mov_file_path, month,
     args = sheet_args[atelier_key]
     
     # Apply overrides
-    sheet_name = overrides.get('sheetName') or args['sheet_name']
+    requested_sheet = overrides.get('sheetName') or args['sheet_name']
     custom_ref_col = overrides.get('refCol')
     custom_qty_col = overrides.get('qtyCol')
     
     try:
-        # Read Movement File - scan for header row containing a date column
-        temp_df = pd.read_excel(mov_file_path, sheet_name=sheet_name, header=None)
-        header_idx = 0
-        found_header = False
-        
-        for idx, row in temp_df.iterrows():
-            row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-            if any(name in row_values for name in mov_possible_col_names['date']):
-                header_idx = idx
-                found_header = True
-                break
-        
-        if found_header:
-            mov = pd.read_excel(mov_file_path, sheet_name=sheet_name, header=header_idx)
-        else:
-            mov = pd.read_excel(mov_file_path, sheet_name=sheet_name)
-        
-        # Use custom columns or find automatically
-        ref_col = custom_ref_col
-        qty_col = custom_qty_col
-        
-        if not ref_col:
-            for name in mov_possible_col_names['ref']:
-                if name in mov.columns:
-                    ref_col = name
-                    break
-        
-        if not qty_col:
-            for name in mov_possible_col_names['quantity']:
-                if name in mov.columns:
-                    qty_col = name
-                    break
-        
-        if not ref_col or not qty_col:
-            return {
-                'error': f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        # Clean Movement Data
-        object_columns_mov = mov.select_dtypes(include=['object']).columns
-        for col in object_columns_mov:
-            mov[col] = mov[col].astype(str).str.strip()
-        
-        mov[ref_col] = mov[ref_col].astype('string')
-        mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce')
-        
-        # Group Movement
-        mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-        mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-        
-        # Filter Stock by localisation
-        localisations = args['localisation']
-        stock_filtered = stock_df[stock_df['LOCALISATION'].isin(localisations)].copy()
-        
-        # Group Stock
-        stock_agg = stock_filtered.groupby('REFERENCE')['QUANTITE'].sum().reset_index()
-        stock_agg.rename(columns={'REFERENCE': 'Ref', 'QUANTITE': 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
-        
-        # Comparison
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
-        
-        # Results
-        discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
-        matches = comparison_df[comparison_df['Difference'] == 0]
+        layout = trusted_layout(layout, mov_file_path, sheet_override=overrides.get('sheetName'))
+        sheet_name, header_idx = _mov_sheet_header(atelier_key, mov_file_path, requested_sheet, layout, shared)
+        if sheet_name is None:
+            return {'error': f"Could not find sheet '{requested_sheet}'", 'matches': [], 'discrepancies': []}
+        
+        usecols = layout_usecols(layout)
+        mov_agg, movements, mov_unreadable, error = shared_value(
+            shared, ('mov', sheet_name, header_idx, tuple(usecols) if usecols else None, custom_ref_col, custom_qty_col),
+            lambda: _movement_agg(mov_file_path, sheet_name, header_idx, usecols, custom_ref_col, custom_qty_col)
+        )
+        if error:
+            return {'error': error, 'matches': [], 'discrepancies': []}
         
-        return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
-        }
+        return _compare(atelier_key, stock_index, mov_agg, mov_unreadable, movements)
         
     except Exception as e:
         return {'error': str(e), 'matches': [], 'discrepancies': []}
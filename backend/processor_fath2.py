@@ -6,6 +6,14 @@ import pandas as pd
 import os
 import re
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, join_quantities, quantity_records, read_quantities
+from read_plan import run_plan, shared_value
+from sheet_cache import read_sheet
+from stock_index import as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_unreadable
+from workbook import list_sheets, resolve_sheet
+
 
 # Sheet arguments configuration
 sheet_args = {
@@ -21,6 +29,8 @@ sheet_args = {
     'tissu': {'sheet_name': ['MOUVEMENT 2024'], 'localisation': ['ATT- TISSU']},
 }
 
+stock_columns = ['REFERENCE', 'LOCALISATION', 'QUANTITE']
+
 mov_possible_col_names = {
     'date': ['Date', 'DATE', 'date'],
     'ref': ['Row Labels', 'Référence\nFournisseur', 'REFERENCE', 'reference', 'Référence', 'REF', 'REF PRODUIT'],
@@ -37,8 +47,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
     """Load and prepare stock data from Fath2"""
     # Find appropriate sheet
     try:
-        xl = pd.ExcelFile(stock_file_path)
-        available_sheets = xl.sheet_names
+        available_sheets = list_sheets(stock_file_path)
         
         # Try MOV first, then STOCK, then first sheet
         sheet_to_use = None
@@ -56,7 +65,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         raise ValueError(f"Could not read stock file: {stock_file_path} - {str(e)}")
     
     # Scan for header row containing a date column
-    temp_stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=None)
+    temp_stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=None)
     header_idx = 0
     found_header = False
     
@@ -68,20 +77,17 @@ def load_stock(stock_file_path, stock_sheet_name=None):
             break
     
     if found_header:
-        stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
+        stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
     else:
-        stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=0)
+        stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=0)
     
     stock = stock.dropna(how="all")
+    # Keep only the columns the reconciliation reads
+    stock = stock[[col for col in stock_columns if col in stock.columns]]
     
-    # Ensure types for Quantity and Date
+    # Ensure types for Quantity
     if 'QUANTITE' in stock.columns:
-        stock['QUANTITE'] = pd.to_numeric(stock['QUANTITE'], errors='coerce').fillna(0.0)
-        stock['QUANTITE'] = stock['QUANTITE'].round(2)
-    
-    date_cols = [col for col in stock.columns if 'date' in col.lower()]
-    for col in date_cols:
-        stock[col] = pd.to_datetime(stock[col], errors='coerce')
+        stock['QUANTITE'], stock[UNREADABLE_COL] = read_quantities(stock['QUANTITE'])
     
     object_columns = stock.select_dtypes(include=['object']).columns
     for col in object_columns:
@@ -91,10 +97,78 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         stock['REFERENCE'] = stock['REFERENCE'].astype('string')
         stock['REFERENCE'] = stock['REFERENCE'].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
     
-    return stock
+    return as_categories(stock, [c for c in ('REFERENCE', 'LOCALISATION') if c in stock.columns])
+
+
+def stock_positions(stock_file_path):
+    """Stock per (localisation, reference) for stock deltas, and its unreadable quantity count"""
+    return index_positions(build_stock_index(load_stock(stock_file_path), 'LOCALISATION', 'REFERENCE', 'QUANTITE'))
+
+
+def _stock_index(stock_file_path):
+    """Stock indexed by localisation"""
+    return build_stock_index(load_stock(stock_file_path), 'LOCALISATION', 'REFERENCE', 'QUANTITE')
+
+
+def find_mov_header(atelier_key, raw):
+    """Return the header row (first row naming a date column) of a header=None frame, or None"""
+    for idx, row in raw.iterrows():
+        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
+        if any(name in row_values for name in mov_possible_col_names['date']):
+            return idx
+    return None
+
+
+def _movement_agg(mov_file_path, used_sheet, header_idx, usecols, month):
+    """Movement quantity per reference for one sheet, as (mov_agg, movement rows, unreadable quantity count, error)"""
+    if header_idx is not None:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx, usecols=usecols)
+    else:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet)
+    
+    # Find Columns
+    found_cols = {}
+    for col_type, possible_names in mov_possible_col_names.items():
+        for name in possible_names:
+            if name in mov.columns:
+                found_cols[col_type] = name
+                break
+    
+    if 'ref' not in found_cols or 'quantity' not in found_cols:
+        return None, None, 0, f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}"
+    
+    ref_col = found_cols['ref']
+    qty_col = found_cols['quantity']
+    date_col = found_cols.get('date')
+    
+    # Filter by Date if available
+    if date_col:
+        mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
+        target_month = int(month)
+        target_year = 2025
+        
+        mask = (mov[date_col].dt.year < target_year) | \
+               ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
+        mov = mov[mask]
+    
+    # Clean Movement Data
+    object_columns_mov = mov.select_dtypes(include=['object']).columns
+    for col in object_columns_mov:
+        mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
+    
+    mov[ref_col] = mov[ref_col].astype('string')
+    mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    
+    # Group Movement, keeping the rows for drill-down
+    mov[qty_col], unreadable = read_quantities(mov[qty_col])
+    movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, (header_idx or 0) + 2)
+    mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
+    mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
+    
+    return mov_agg, movements, int(unreadable.sum()), None
 
 
-def process_atelier(atelier_key, stock_df, mov_file_path, month):
+def process_atelier(atelier_key, stock_index, mov_file_path, month, layout=None, shared=None):
     """Process a single atelier and return matches/discrepancies"""
     
     if atelier_key not in sheet_args:
@@ -103,111 +177,56 @@ def process_atelier(atelier_key, stock_df, mov_file_path, month):
     args = sheet_args[atelier_key]
     
     try:
-        # Handle multiple possible sheet names
-        possible_sheets = args['sheet_name']
-        if isinstance(possible_sheets, str):
-            possible_sheets = [possible_sheets]
-        
-        mov = None
-        used_sheet = None
-        
-        for sheet in possible_sheets:
-            try:
-                # Read Movement File - scan for header row
-                temp_df = pd.read_excel(mov_file_path, sheet_name=sheet, header=None)
-                header_idx = 0
-                found_header = False
-                
-                for idx, row in temp_df.iterrows():
-                    row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-                    if any(name in row_values for name in mov_possible_col_names['date']):
-                        header_idx = idx
-                        found_header = True
-                        break
-                
-                if found_header:
-                    mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx)
-                else:
-                    mov = pd.read_excel(mov_file_path, sheet_name=sheet)
-                
-                used_sheet = sheet
-                break
-            except ValueError:
-                continue
-            except Exception as e:
-                continue
-        
-        if mov is None:
-            return {
-                'error': f"Could not find any of the sheets {possible_sheets}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        # Find Columns
-        found_cols = {}
-        for col_type, possible_names in mov_possible_col_names.items():
-            for name in possible_names:
-                if name in mov.columns:
-                    found_cols[col_type] = name
-                    break
-        
-        if 'ref' not in found_cols or 'quantity' not in found_cols:
-            return {
-                'error': f"Could not find ref or quantity columns. Available: {mov.columns.tolist()}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        ref_col = found_cols['ref']
-        qty_col = found_cols['quantity']
-        
-        # Filter by Date if available
-        if 'date' in found_cols:
-            date_col = found_cols['date']
-            mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
-            target_month = int(month)
-            target_year = 2025
+        layout = trusted_layout(layout, mov_file_path)
+        if layout:
+            # Sheet and header row were resolved by verify for this exact file
+            used_sheet, header_idx = layout['sheet'], layout['headerRow']
+        else:
+            # Handle multiple possible sheet names
+            possible_sheets = args['sheet_name']
+            if isinstance(possible_sheets, str):
+                possible_sheets = [possible_sheets]
             
-            mask = (mov[date_col].dt.year < target_year) | \
-                   ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
-            mov = mov[mask]
-        
-        # Clean Movement Data
-        object_columns_mov = mov.select_dtypes(include=['object']).columns
-        for col in object_columns_mov:
-            mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
-        
-        mov[ref_col] = mov[ref_col].astype('string')
-        mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-        
-        # Group Movement
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0)
-        mov[qty_col] = mov[qty_col].round(2)
-        mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-        mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-        
-        # Filter Stock by localisation
-        localisations = args['localisation']
-        stock_filtered = stock_df[stock_df['LOCALISATION'].isin(localisations)].copy()
-        
-        # Group Stock
-        stock_agg = stock_filtered.groupby('REFERENCE')['QUANTITE'].sum().reset_index()
-        stock_agg.rename(columns={'REFERENCE': 'Ref', 'QUANTITE': 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+            # Resolve the sheet from the workbook index before parsing anything
+            used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+            if used_sheet is None:
+                return {
+                    'error': f"Could not find any of the sheets {possible_sheets}",
+                    'matches': [],
+                    'discrepancies': []
+                }
+            
+            # Read Movement File - scan for header row
+            header_idx = shared_value(
+                shared, ('header', used_sheet),
+                lambda: find_mov_header(atelier_key, read_sheet(mov_file_path, sheet_name=used_sheet, header=None))
+            )
+        
+        usecols = layout_usecols(layout)
+        mov_agg, movements, mov_unreadable, error = shared_value(
+            shared, ('mov', used_sheet, header_idx, tuple(usecols) if usecols else None),
+            lambda: _movement_agg(mov_file_path, used_sheet, header_idx, usecols, month)
+        )
+        if error:
+            return {'error': error, 'matches': [], 'discrepancies': []}
+        
+        # Stock of the atelier's localisations
+        stock_agg = stock_aggregate(stock_index, args['localisation'])
         
         # Comparison
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+        comparison_df = join_quantities(stock_agg, mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
         
         # Results
         discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
         matches = comparison_df[comparison_df['Difference'] == 0]
         
         return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': stock_unreadable(stock_index, args['localisation']) + mov_unreadable,
+            '_movements': movements
         }
         
     except Exception as e:
@@ -216,16 +235,13 @@ def process_atelier(atelier_key, stock_df, mov_file_path, month):
 
 def process_all(stock_file, matched_files, month):
     """Process all matched files for Fath2"""
-    results = {}
-    
-    # Load stock once
+    # Load stock once and index it by localisation
     try:
-        stock_df = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
     
-    # Process each atelier
-    for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_df, mov_file['path'], month)
-    
-    return results
+    # Process the ateliers grouped by the movement sheet they read, parsing each sheet once
+    return run_plan(sheet_args, matched_files, lambda atelier_key, mov_file, shared: process_atelier(
+        atelier_key, stock_index, mov_file['path'], month, layout=mov_file.get('layout'), shared=shared
+    ))
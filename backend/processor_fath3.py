@@ -11,6 +11,17 @@ import os
 import re
 import pandas as pd
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, fixed, join_quantities, quantity_records, read_quantities
+from sheet_cache import read_sheet
+from stock_index import (as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_keys,
+                         stock_unreadable)
+from workbook import peek_sheet, resolve_sheet
+
+
+# Largest |Difference| still counted as a match
+MATCH_TOLERANCE = 0.02
 
 # Sheet arguments configuration
 sheet_args = {
@@ -75,7 +86,10 @@ def _find_column(df: pd.DataFrame, candidates: list[str]) -> str | None:
 
 
 def _detect_header_row(excel_path: str, sheet_name, must_contain: list[str], max_rows: int = 80) -> int:
-    tmp = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+    return _header_row_in(peek_sheet(excel_path, sheet_name, nrows=max_rows), must_contain, max_rows)
+
+
+def _header_row_in(tmp: pd.DataFrame, must_contain: list[str], max_rows: int = 80) -> int:
     scan_rows = min(max_rows, len(tmp))
     for idx in range(scan_rows):
         row = tmp.iloc[idx]
@@ -91,6 +105,15 @@ def _detect_header_row(excel_path: str, sheet_name, must_contain: list[str], max
     return 0
 
 
+def _header_must_contain(atelier_key: str) -> list[str]:
+    return sheet_args.get(atelier_key, {}).get('header_must_contain') or ['Date', 'LOCALITATION', 'PRODOUITE', 'Q ST PV']
+
+
+def find_mov_header(atelier_key: str, raw: pd.DataFrame) -> int:
+    """Header row of a movement sheet, given its top rows read with header=None."""
+    return _header_row_in(raw, _header_must_contain(atelier_key))
+
+
 def _coerce_date(series: pd.Series) -> pd.Series:
     if series is None:
         return series
@@ -114,21 +137,13 @@ def _normalize_ref(series: pd.Series) -> pd.Series:
     return s.str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
 
 
-def _coerce_qty(series: pd.Series) -> pd.Series:
-    s_str = series.astype('string')
-    s_str = s_str.str.replace('\u00A0', ' ', regex=False)
-    s_str = s_str.str.replace(' ', '', regex=False)
-    s_str = s_str.str.replace(',', '.', regex=False)
-    return pd.to_numeric(s_str, errors='coerce').fillna(0.0)
-
-
 def load_stock(stock_file_path: str, stock_sheet_name: str = 'STOCKS') -> tuple[pd.DataFrame, str, str, str]:
     header_idx = _detect_header_row(
         stock_file_path,
         stock_sheet_name,
         must_contain=['RF', 'S REEL', 'LOCALISATION'],
     )
-    stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
+    stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
     stock = stock.dropna(how='all')
 
     stock_ref_col = _find_column(stock, stock_possible_col_names['ref'])
@@ -140,45 +155,50 @@ def load_stock(stock_file_path: str, stock_sheet_name: str = 'STOCKS') -> tuple[
             f"Stock file is missing required columns. Found ref={stock_ref_col}, qty={stock_qty_col}, loc={stock_loc_col}. "
             f"Available: {stock.columns.tolist()}"
         )
+    stock = stock[list(dict.fromkeys([stock_ref_col, stock_qty_col, stock_loc_col]))]
 
     for col in stock.select_dtypes(include=['object']).columns:
         stock[col] = stock[col].astype('string').str.strip()
 
     stock[stock_ref_col] = _normalize_ref(stock[stock_ref_col])
-    stock[stock_qty_col] = _coerce_qty(stock[stock_qty_col]).round(4)
+    stock[stock_qty_col], stock[UNREADABLE_COL] = read_quantities(stock[stock_qty_col])
 
     # Drop rows missing key fields
     stock = stock.dropna(subset=[stock_ref_col, stock_loc_col])
     stock = stock[stock[stock_ref_col].astype('string').str.strip() != '']
     stock = stock[stock[stock_loc_col].astype('string').str.strip() != '']
 
-    return stock, stock_ref_col, stock_qty_col, stock_loc_col
+    return as_categories(stock, [stock_ref_col, stock_loc_col]), stock_ref_col, stock_qty_col, stock_loc_col
 
 
-def _read_mov(mov_file_path: str, possible_sheets: list, header_must_contain: list[str]) -> tuple[pd.DataFrame, object]:
-    mov = None
-    used_sheet = None
+def stock_positions(stock_file_path: str) -> tuple[pd.DataFrame, int]:
+    """Stock per (localisation, reference) for stock deltas, and its unreadable quantity count"""
+    return index_positions(_stock_index(stock_file_path))
 
-    for sheet in possible_sheets:
-        try:
-            header_idx = _detect_header_row(mov_file_path, sheet, must_contain=header_must_contain)
-            mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx)
-            used_sheet = sheet
-            break
-        except ValueError:
-            continue
-        except Exception:
-            continue
 
-    if mov is None:
-        raise ValueError(f"Could not read any of sheets {possible_sheets} from {mov_file_path}")
+def _stock_index(stock_file_path: str) -> dict:
+    """Stock of the STOCKS sheet indexed by localisation"""
+    stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file_path, stock_sheet_name='STOCKS')
+    return build_stock_index(stock_df, stock_loc_col, stock_ref_col, stock_qty_col)
 
+
+def _read_mov(mov_file_path: str, possible_sheets: list, header_must_contain: list[str],
+              layout: dict | None = None) -> tuple[pd.DataFrame, object, int]:
+    if layout:
+        used_sheet, header_idx = layout['sheet'], layout['headerRow']
+    else:
+        used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+        if used_sheet is None:
+            raise ValueError(f"Could not read any of sheets {possible_sheets} from {mov_file_path}")
+        header_idx = _detect_header_row(mov_file_path, used_sheet, must_contain=header_must_contain)
+
+    mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx, usecols=layout_usecols(layout))
     mov = mov.dropna(how='all')
-    return mov, used_sheet
+    return mov, used_sheet, header_idx
 
 
-def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str, stock_qty_col: str, stock_loc_col: str,
-                   mov_file_path: str, month: str, overrides: dict | None = None) -> dict:
+def process_atelier(atelier_key: str, stock_index: dict, mov_file_path: str, month: str, overrides: dict | None = None,
+                   layout: dict | None = None) -> dict:
     if atelier_key not in sheet_args:
         return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
 
@@ -195,10 +215,11 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
     if sheet_override:
         possible_sheets = [sheet_override]
 
-    header_must_contain = args.get('header_must_contain') or ['Date', 'LOCALITATION', 'PRODOUITE', 'Q ST PV']
+    header_must_contain = _header_must_contain(atelier_key)
+    layout = trusted_layout(layout, mov_file_path, sheet_override=sheet_override)
 
     try:
-        mov, _ = _read_mov(mov_file_path, possible_sheets, header_must_contain)
+        mov, used_sheet, header_idx = _read_mov(mov_file_path, possible_sheets, header_must_contain, layout)
 
         # Resolve columns
         mov_cols_override = args.get('mov cols')
@@ -240,7 +261,7 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
         mov = mov[mask]
 
         mov[ref_col] = _normalize_ref(mov[ref_col])
-        mov[qty_col] = _coerce_qty(mov[qty_col])
+        mov[qty_col], mov[UNREADABLE_COL] = read_quantities(mov[qty_col])
 
         # Localisation selection
         exclude_locs = [str(x).strip() for x in (args.get('exclude_localisations') or []) if str(x).strip()]
@@ -249,15 +270,12 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
         if include_locs:
             include_locs = [str(x).strip() for x in include_locs if str(x).strip()]
         else:
-            include_locs = sorted(stock_df[stock_loc_col].astype('string').str.strip().unique().tolist())
+            include_locs = sorted(stock_keys(stock_index))
 
         if exclude_locs:
             exclude_set = set(exclude_locs)
             include_locs = [l for l in include_locs if l not in exclude_set]
 
-        # Filter stock
-        stock_filtered = stock_df[stock_df[stock_loc_col].astype('string').str.strip().isin(include_locs)].copy()
-
         # Filter movement (if it has a localisation column)
         if not no_loc_col:
             if exclude_locs:
@@ -267,23 +285,24 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
             mov_filtered = mov.copy()
 
         # Aggregate
-        stock_agg = stock_filtered.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
-        stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+        stock_agg = stock_aggregate(stock_index, include_locs)
 
+        movements = movement_detail(mov_filtered, ref_col, qty_col, mov_date_col, used_sheet, header_idx + 2)
         mov_agg = mov_filtered.groupby(ref_col)[qty_col].sum().reset_index()
         mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
 
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = (comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']).round(2)
+        comparison_df = join_quantities(stock_agg, mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
 
-        discrepancies = comparison_df[comparison_df['Difference'].abs() > 0.02].sort_values(by='Difference', ascending=False)
-        matches = comparison_df[comparison_df['Difference'].abs() <= 0.02]
+        discrepancies = comparison_df[comparison_df['Difference'].abs() > fixed(MATCH_TOLERANCE)].sort_values(by='Difference', ascending=False)
+        matches = comparison_df[comparison_df['Difference'].abs() <= fixed(MATCH_TOLERANCE)]
 
         return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': stock_unreadable(stock_index, include_locs) + int(mov_filtered[UNREADABLE_COL].sum()),
+            '_movements': movements
         }
 
     except Exception as e:
@@ -293,20 +312,18 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
 def process_all(stock_file, matched_files, month):
     results = {}
     try:
-        stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file['path'], stock_sheet_name='STOCKS')
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
 
     for atelier_key, mov_file in matched_files.items():
         results[atelier_key] = process_atelier(
             atelier_key,
-            stock_df,
-            stock_ref_col,
-            stock_qty_col,
-            stock_loc_col,
+            stock_index,
             mov_file['path'],
             month,
             overrides=None,
+            layout=mov_file.get('layout'),
         )
 
     return results
@@ -315,7 +332,7 @@ def process_all(stock_file, matched_files, month):
 def process_all_with_overrides(stock_file, matched_files, month, overrides):
     results = {}
     try:
-        stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file['path'], stock_sheet_name='STOCKS')
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
 
@@ -323,13 +340,11 @@ def process_all_with_overrides(stock_file, matched_files, month, overrides):
         atelier_overrides = overrides.get(atelier_key, {}) if overrides else {}
         results[atelier_key] = process_atelier(
             atelier_key,
-            stock_df,
-            stock_ref_col,
-            stock_qty_col,
-            stock_loc_col,
+            stock_index,
             mov_file['path'],
             month,
             overrides=atelier_overrides,
+            layout=mov_file.get('layout'),
         )
 
     return results
@@ -6,6 +6,14 @@ import pandas as pd
 import os
 import re
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, join_quantities, quantity_records, read_quantities
+from read_plan import run_plan, shared_value
+from sheet_cache import read_sheet
+from stock_index import as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_unreadable
+from workbook import list_sheets, resolve_sheet
+
 
 # Sheet arguments configuration
 sheet_args = {
@@ -40,8 +48,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
     """Load and prepare stock data from Fath5"""
     # Find appropriate sheet
     try:
-        xl = pd.ExcelFile(stock_file_path)
-        available_sheets = xl.sheet_names
+        available_sheets = list_sheets(stock_file_path)
         
         # Try MOUV first, then STOCK, then first sheet
         sheet_to_use = None
@@ -59,7 +66,7 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         raise ValueError(f"Could not read stock file: {stock_file_path} - {str(e)}")
     
     # Scan for header row containing a date column
-    temp_stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=None)
+    temp_stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=None)
     header_idx = 0
     found_header = False
     
@@ -71,20 +78,19 @@ def load_stock(stock_file_path, stock_sheet_name=None):
             break
     
     if found_header:
-        stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
+        stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
     else:
-        stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=0)
+        stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=0)
     
     stock = stock.dropna(how="all")
+    # Keep only the columns the reconciliation reads: localisation, reference and quantity
+    stock = stock[[col for col in stock.columns
+                   if col == 'LOCALISATION' or 'REF' in str(col).upper() or 'QUANT' in str(col).upper()]]
     
-    # Ensure types for Quantity and Date
-    if 'QUANTITE' in stock.columns:
-        stock['QUANTITE'] = pd.to_numeric(stock['QUANTITE'], errors='coerce').fillna(0.0)
-        stock['QUANTITE'] = stock['QUANTITE'].round(2)
-    
-    date_cols = [col for col in stock.columns if 'date' in col.lower()]
-    for col in date_cols:
-        stock[col] = pd.to_datetime(stock[col], errors='coerce')
+    # Quantity as fixed-point, flagging cells that are not numbers
+    qty_col = _stock_qty_col(stock)
+    if qty_col:
+        stock[qty_col], stock[UNREADABLE_COL] = read_quantities(stock[qty_col])
     
     object_columns = stock.select_dtypes(include=['object']).columns
     for col in object_columns:
@@ -103,10 +109,112 @@ def load_stock(stock_file_path, stock_sheet_name=None):
         # Rename to standard REFERENCE for consistency
         stock.rename(columns={ref_col_name: 'REFERENCE'}, inplace=True)
     
-    return stock
+    return as_categories(stock, [c for c in ('REFERENCE', 'LOCALISATION') if c in stock.columns])
+
+
+def find_mov_header(atelier_key, raw):
+    """Return the header row (first row naming a date column) of a header=None frame, or None"""
+    for idx, row in raw.iterrows():
+        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
+        if any(name in row_values for name in mov_possible_col_names['date']):
+            return idx
+    return None
+
+
+def _movement_agg(mov_file_path, used_sheet, header_idx, usecols, mov_cols_override, month):
+    """Movement quantity per reference for one sheet, as (mov_agg, movement rows, unreadable quantity count, error)"""
+    if header_idx is not None:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx, usecols=usecols)
+    else:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet)
+    
+    # Find Columns with optional override
+    found_cols = {}
+    for col_type, possible_names in mov_possible_col_names.items():
+        for name in possible_names:
+            if name in mov.columns:
+                found_cols[col_type] = name
+                break
+    
+    # Handle column override from args
+    override_ref = None
+    override_qty = None
+    
+    if isinstance(mov_cols_override, (list, tuple)) and len(mov_cols_override) == 2:
+        override_ref, override_qty = mov_cols_override
+        if override_ref == -1:
+            override_ref = None
+        if override_qty == -1:
+            override_qty = None
+    
+    # Determine final ref/qty column names
+    if override_ref is not None:
+        ref_col = override_ref
+    elif 'ref' in found_cols:
+        ref_col = found_cols['ref']
+    else:
+        return None, None, 0, f"Could not find ref column. Available: {mov.columns.tolist()}"
+    
+    if override_qty is not None:
+        qty_col = override_qty
+    elif 'quantity' in found_cols:
+        qty_col = found_cols['quantity']
+    else:
+        return None, None, 0, f"Could not find quantity column. Available: {mov.columns.tolist()}"
+    
+    # Filter by Date if available
+    date_col = found_cols.get('date')
+    if date_col:
+        mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
+        target_month = int(month)
+        target_year = 2025
+        
+        mask = (mov[date_col].dt.year < target_year) | \
+               ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
+        mov = mov[mask]
+    
+    # Clean Movement Data
+    object_columns_mov = mov.select_dtypes(include=['object']).columns
+    for col in object_columns_mov:
+        mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
+    
+    mov[ref_col] = mov[ref_col].astype('string')
+    mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    
+    # Group Movement, keeping the rows for drill-down
+    mov[qty_col], unreadable = read_quantities(mov[qty_col])
+    movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, (header_idx or 0) + 2)
+    mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
+    mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
+    
+    return mov_agg, movements, int(unreadable.sum()), None
+
+
+def _stock_qty_col(stock_df):
+    """Stock quantity column: QUANTITE, else the first column naming a quantity"""
+    if 'QUANTITE' in stock_df.columns:
+        return 'QUANTITE'
+    candidates = stock_df.columns[stock_df.columns.str.contains('QUANT', case=False)]
+    return candidates[0] if len(candidates) else None
 
 
-def process_atelier(atelier_key, stock_df, mov_file_path, month):
+def stock_positions(stock_file_path):
+    """Stock per (localisation, reference) for stock deltas, and its unreadable quantity count"""
+    stock_df = load_stock(stock_file_path)
+    qty_stock_col = _stock_qty_col(stock_df)
+    if not qty_stock_col:
+        raise KeyError(f"Could not find quantity column in stock. Available: {stock_df.columns.tolist()}")
+    return index_positions(build_stock_index(stock_df, 'LOCALISATION', 'REFERENCE', qty_stock_col))
+
+
+def _stock_index(stock_file_path):
+    """Stock indexed by localisation, None when the stock has no quantity column"""
+    stock_df = load_stock(stock_file_path)
+    qty_stock_col = _stock_qty_col(stock_df)
+    return build_stock_index(stock_df, 'LOCALISATION', 'REFERENCE', qty_stock_col) if qty_stock_col else None
+
+
+def process_atelier(atelier_key, stock_index, mov_file_path, month, layout=None, shared=None):
     """Process a single atelier and return matches/discrepancies"""
     
     if atelier_key not in sheet_args:
@@ -115,141 +223,60 @@ def process_atelier(atelier_key, stock_df, mov_file_path, month):
     args = sheet_args[atelier_key]
     
     try:
-        # Handle multiple possible sheet names
-        possible_sheets = args['sheet_name']
-        if isinstance(possible_sheets, str):
-            possible_sheets = [possible_sheets]
-        
-        mov = None
-        used_sheet = None
-        
-        for sheet in possible_sheets:
-            try:
-                # Read Movement File - scan for header row
-                temp_df = pd.read_excel(mov_file_path, sheet_name=sheet, header=None)
-                header_idx = 0
-                found_header = False
-                
-                for idx, row in temp_df.iterrows():
-                    row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-                    if any(name in row_values for name in mov_possible_col_names['date']):
-                        header_idx = idx
-                        found_header = True
-                        break
-                
-                if found_header:
-                    mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx)
-                else:
-                    mov = pd.read_excel(mov_file_path, sheet_name=sheet)
-                
-                used_sheet = sheet
-                break
-            except ValueError:
-                continue
-            except Exception as e:
-                continue
-        
-        if mov is None:
-            return {
-                'error': f"Could not find any of the sheets {possible_sheets}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        # Find Columns with optional override
-        found_cols = {}
-        for col_type, possible_names in mov_possible_col_names.items():
-            for name in possible_names:
-                if name in mov.columns:
-                    found_cols[col_type] = name
-                    break
-        
-        # Handle column override from args
-        mov_cols_override = args.get('mov cols')
-        override_ref = None
-        override_qty = None
-        
-        if isinstance(mov_cols_override, (list, tuple)) and len(mov_cols_override) == 2:
-            override_ref, override_qty = mov_cols_override
-            if override_ref == -1:
-                override_ref = None
-            if override_qty == -1:
-                override_qty = None
-        
-        # Determine final ref/qty column names
-        if override_ref is not None:
-            ref_col = override_ref
-        elif 'ref' in found_cols:
-            ref_col = found_cols['ref']
-        else:
-            return {
-                'error': f"Could not find ref column. Available: {mov.columns.tolist()}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        if override_qty is not None:
-            qty_col = override_qty
-        elif 'quantity' in found_cols:
-            qty_col = found_cols['quantity']
+        layout = trusted_layout(layout, mov_file_path)
+        if layout:
+            # Sheet and header row were resolved by verify for this exact file
+            used_sheet, header_idx = layout['sheet'], layout['headerRow']
         else:
-            return {
-                'error': f"Could not find quantity column. Available: {mov.columns.tolist()}",
-                'matches': [],
-                'discrepancies': []
-            }
-        
-        # Filter by Date if available
-        if 'date' in found_cols:
-            date_col = found_cols['date']
-            mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
-            target_month = int(month)
-            target_year = 2025
+            # Handle multiple possible sheet names
+            possible_sheets = args['sheet_name']
+            if isinstance(possible_sheets, str):
+                possible_sheets = [possible_sheets]
             
-            mask = (mov[date_col].dt.year < target_year) | \
-                   ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
-            mov = mov[mask]
-        
-        # Clean Movement Data
-        object_columns_mov = mov.select_dtypes(include=['object']).columns
-        for col in object_columns_mov:
-            mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
-        
-        mov[ref_col] = mov[ref_col].astype('string')
-        mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-        
-        # Group Movement
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0)
-        mov[qty_col] = mov[qty_col].round(2)
-        mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-        mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-        
-        # Filter Stock by localisation
-        localisations = args['localisation']
-        stock_filtered = stock_df[stock_df['LOCALISATION'].isin(localisations)].copy()
+            # Resolve the sheet from the workbook index before parsing anything
+            used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+            if used_sheet is None:
+                return {
+                    'error': f"Could not find any of the sheets {possible_sheets}",
+                    'matches': [],
+                    'discrepancies': []
+                }
+            
+            # Read Movement File - scan for header row
+            header_idx = shared_value(
+                shared, ('header', used_sheet),
+                lambda: find_mov_header(atelier_key, read_sheet(mov_file_path, sheet_name=used_sheet, header=None))
+            )
         
-        # Group Stock
-        qty_stock_col = 'QUANTITE' if 'QUANTITE' in stock_df.columns else stock_df.columns[stock_df.columns.str.contains('QUANT', case=False)][0] if any(stock_df.columns.str.contains('QUANT', case=False)) else None
+        usecols = layout_usecols(layout)
+        mov_cols_override = args.get('mov cols')
+        mov_agg, movements, mov_unreadable, error = shared_value(
+            shared, ('mov', used_sheet, header_idx, tuple(usecols) if usecols else None, repr(mov_cols_override)),
+            lambda: _movement_agg(mov_file_path, used_sheet, header_idx, usecols, mov_cols_override, month)
+        )
+        if error:
+            return {'error': error, 'matches': [], 'discrepancies': []}
         
-        if qty_stock_col is None:
+        # Stock of the atelier's localisations (no index when the stock has no quantity column)
+        if stock_index is None:
             return {'error': 'Could not find quantity column in stock', 'matches': [], 'discrepancies': []}
         
-        stock_agg = stock_filtered.groupby('REFERENCE')[qty_stock_col].sum().reset_index()
-        stock_agg.rename(columns={'REFERENCE': 'Ref', qty_stock_col: 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+        stock_agg = stock_aggregate(stock_index, args['localisation'])
         
         # Comparison
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+        comparison_df = join_quantities(stock_agg, mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
         
         # Results
         discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
         matches = comparison_df[comparison_df['Difference'] == 0]
         
         return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': stock_unreadable(stock_index, args['localisation']) + mov_unreadable,
+            '_movements': movements
         }
         
     except Exception as e:
@@ -258,16 +285,13 @@ def process_atelier(atelier_key, stock_df, mov_file_path, month):
 
 def process_all(stock_file, matched_files, month):
     """Process all matched files for Fath5"""
-    results = {}
-    
-    # Load stock once
+    # Load stock once and index it by localisation
     try:
-        stock_df = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
     
-    # Process each atelier
-    for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_df, mov_file['path'], month)
-    
-    return results
+    # Process the ateliers grouped by the movement sheet they read, parsing each sheet once
+    return run_plan(sheet_args, matched_files, lambda atelier_key, mov_file, shared: process_atelier(
+        atelier_key, stock_index, mov_file['path'], month, layout=mov_file.get('layout'), shared=shared
+    ))
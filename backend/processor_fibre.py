@@ -10,6 +10,14 @@ import pandas as pd
 import os
 import re
 
+from layouts import layout_usecols, trusted_layout
+from movements import concat_movements, movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, join_quantities, largest_difference_records, merge_summaries, quantity_records, read_quantities
+from read_plan import run_plan, shared_value
+from sheet_cache import read_sheet
+from stock_index import as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_unreadable
+from workbook import resolve_sheet
+
 
 # Sheet arguments configuration
 sheet_args = {
@@ -65,26 +73,38 @@ def is_tuple_localisations(localisations):
     return any(isinstance(item, tuple) and len(item) == 2 for item in localisations)
 
 
-def filter_stock_by_localisation(stock_df, localisations_spec, local_col, localisation_col):
-    """Filter stock by localisation (supports tuple-based filtering)"""
+def build_localisation_index(stock_df, local_col, localisation_col, ref_col, qty_col):
+    """Stock aggregates by LOCAL, by (LOCAL, LOCALISATION) when the stock has it, and overall"""
+    return {
+        'local': build_stock_index(stock_df, local_col, ref_col, qty_col),
+        'pair': build_stock_index(stock_df, [local_col, localisation_col], ref_col, qty_col) if localisation_col else None,
+        'all': build_stock_index(stock_df, [], ref_col, qty_col),
+    }
+
+
+def _localisation_keys(stock_index, localisations_spec):
+    """Index and keys a job's localisations are looked up under (supports tuple-based keys)"""
     localisations = normalize_to_list(localisations_spec)
     if not localisations:
-        return stock_df.copy()
+        return stock_index['all'], [None]
 
     if is_tuple_localisations(localisations):
-        if not localisation_col:
+        if stock_index['pair'] is None:
             raise KeyError("LOCALISATION column required for tuple-based localisation filtering")
-        mask = pd.Series(False, index=stock_df.index)
-        for local_value, localisation_value in localisations:
-            mask = mask | (
-                (stock_df[local_col].astype("string") == str(local_value))
-                & (stock_df[localisation_col].astype("string") == str(localisation_value))
-            )
-        return stock_df[mask].copy()
+        return stock_index['pair'], [(str(local), str(loc)) for local, loc in localisations]
+
+    # Default: single-column LOCAL lookup
+    return stock_index['local'], [str(x) for x in localisations]
+
 
-    # Default: single-column LOCAL filtering
-    localisations_str = [str(x) for x in localisations]
-    return stock_df[stock_df[local_col].isin(localisations_str)].copy()
+def localisation_stock(stock_index, localisations_spec):
+    """Stock aggregate ('Ref', 'Stock_Qty') of a job's localisations"""
+    return stock_aggregate(*_localisation_keys(stock_index, localisations_spec))
+
+
+def localisation_unreadable(stock_index, localisations_spec):
+    """Stock cells of a job's localisations whose quantity could not be read"""
+    return stock_unreadable(*_localisation_keys(stock_index, localisations_spec))
 
 
 def build_jobs_from_args(args):
@@ -139,7 +159,7 @@ def build_jobs_from_args(args):
 def load_stock(stock_file_path, stock_sheet_name='STOCKS GLOBALE'):
     """Load and prepare stock data from Fibre"""
     # Scan for header row containing a date column
-    temp_stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=None)
+    temp_stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=None)
     header_idx = 0
     found_header = False
 
@@ -151,9 +171,9 @@ def load_stock(stock_file_path, stock_sheet_name='STOCKS GLOBALE'):
             break
 
     if found_header:
-        stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
+        stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
     else:
-        stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=0)
+        stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=0)
 
     stock = stock.dropna(how="all")
 
@@ -169,10 +189,10 @@ def load_stock(stock_file_path, stock_sheet_name='STOCKS GLOBALE'):
         raise KeyError(f"Stock file is missing reference column. Available: {stock.columns.tolist()}")
     if not stock_qty_col:
         raise KeyError(f"Stock file is missing quantity column. Available: {stock.columns.tolist()}")
+    stock = stock[list(dict.fromkeys(c for c in (stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col) if c))]
 
     # Ensure types
-    stock[stock_qty_col] = pd.to_numeric(stock[stock_qty_col], errors='coerce').fillna(0.0)
-    stock[stock_qty_col] = stock[stock_qty_col].round(2)
+    stock[stock_qty_col], stock[UNREADABLE_COL] = read_quantities(stock[stock_qty_col])
 
     object_columns = stock.select_dtypes(include=['object']).columns
     for col in object_columns:
@@ -181,16 +201,110 @@ def load_stock(stock_file_path, stock_sheet_name='STOCKS GLOBALE'):
     stock[stock_ref_col] = stock[stock_ref_col].astype('string')
     stock[stock_ref_col] = stock[stock_ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
 
+    as_categories(stock, [stock_local_col, stock_localisation_col, stock_ref_col])
     return stock, stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col
 
 
-def process_atelier(atelier_key, stock_df, stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col, mov_file_path, month):
+def stock_positions(stock_file_path):
+    """Stock per (LOCAL, reference) for stock deltas, and its unreadable quantity count"""
+    stock_df, stock_local_col, _, stock_ref_col, stock_qty_col = load_stock(stock_file_path)
+    return index_positions(build_stock_index(stock_df, stock_local_col, stock_ref_col, stock_qty_col))
+
+
+def _stock_index(stock_file_path):
+    """Stock of the global stock sheet indexed by LOCAL (see build_localisation_index)"""
+    stock_df, stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col = load_stock(stock_file_path)
+    return build_localisation_index(stock_df, stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col)
+
+
+def find_mov_header(atelier_key, raw):
+    """Return the header row (first row naming a date column) of a header=None frame, or None"""
+    for idx, row in raw.iterrows():
+        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
+        if any(name in row_values for name in mov_possible_col_names['date']):
+            return idx
+    return None
+
+
+def _movement_agg(mov_file_path, used_sheet, header_idx, usecols, mov_cols_override, month):
+    """Movement quantity per reference for one sheet, as (mov_agg, movement rows, unreadable quantity count, error)"""
+    if header_idx is not None:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx, usecols=usecols)
+    else:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet)
+
+    # Find Columns
+    found_cols = {}
+    mov_cols_norm = {_norm_col_name(c): c for c in mov.columns}
+    for col_type, possible_names in mov_possible_col_names.items():
+        for name in possible_names:
+            candidate_norm = _norm_col_name(name)
+            if candidate_norm in mov_cols_norm:
+                found_cols[col_type] = mov_cols_norm[candidate_norm]
+                break
+
+    override_ref = None
+    override_qty = None
+
+    if isinstance(mov_cols_override, (list, tuple)) and len(mov_cols_override) == 2:
+        override_ref, override_qty = mov_cols_override
+
+        if override_ref == -1:
+            override_ref = None
+        if override_qty == -1:
+            override_qty = None
+
+    # Determine final column names
+    if override_ref is not None and _norm_col_name(override_ref) in mov_cols_norm:
+        ref_col = mov_cols_norm[_norm_col_name(override_ref)]
+    elif 'ref' in found_cols:
+        ref_col = found_cols['ref']
+    else:
+        return None, None, 0, f"Could not find ref column. Available: {mov.columns.tolist()}"
+
+    if override_qty is not None and _norm_col_name(override_qty) in mov_cols_norm:
+        qty_col = mov_cols_norm[_norm_col_name(override_qty)]
+    elif 'quantity' in found_cols:
+        qty_col = found_cols['quantity']
+    else:
+        return None, None, 0, f"Could not find quantity column. Available: {mov.columns.tolist()}"
+
+    # Filter by Date
+    date_col = found_cols.get('date')
+    if date_col:
+        mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
+        target_month = int(month)
+        target_year = 2025
+
+        mask = (mov[date_col].dt.year < target_year) | \
+               ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
+        mov = mov[mask]
+
+    # Clean Movement Data
+    object_columns = mov.select_dtypes(include=['object']).columns
+    for col in object_columns:
+        mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
+
+    mov[ref_col] = mov[ref_col].astype('string')
+    mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    mov[qty_col], unreadable = read_quantities(mov[qty_col])
+
+    # Aggregate Movement, keeping the rows for drill-down
+    movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, (header_idx or 0) + 2)
+    mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
+    mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
+
+    return mov_agg, movements, int(unreadable.sum()), None
+
+
+def process_atelier(atelier_key, stock_index, mov_file_path, month, layout=None, shared=None):
     """Process a single atelier and return matches/discrepancies"""
 
     if atelier_key not in sheet_args:
         return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
 
     args = sheet_args[atelier_key]
+    layout = trusted_layout(layout, mov_file_path)
 
     try:
         jobs = build_jobs_from_args(args)
@@ -199,6 +313,9 @@ def process_atelier(atelier_key, stock_df, stock_local_col, stock_localisation_c
 
     all_matches = []
     all_discrepancies = []
+    summaries = []
+    movement_parts = {}
+    unparsed = 0
 
     for job_idx, job in enumerate(jobs):
         possible_sheets = job["possible_sheets"]
@@ -206,141 +323,66 @@ def process_atelier(atelier_key, stock_df, stock_local_col, stock_localisation_c
         mov_cols_override = job.get("mov_cols")
 
         try:
-            mov = None
-            used_sheet = None
-
-            for sheet in possible_sheets:
-                try:
-                    temp_df = pd.read_excel(mov_file_path, sheet_name=sheet, header=None)
-                    header_idx = 0
-                    found_header = False
-
-                    for idx, row in temp_df.iterrows():
-                        row_values = [str(val).strip() for val in row.values if pd.notna(val)]
-                        if any(name in row_values for name in mov_possible_col_names['date']):
-                            header_idx = idx
-                            found_header = True
-                            break
-
-                    if found_header:
-                        mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx)
-                    else:
-                        mov = pd.read_excel(mov_file_path, sheet_name=sheet)
-
-                    used_sheet = sheet
-                    break
-                except ValueError:
-                    continue
-                except Exception:
-                    continue
-
-            if mov is None:
-                continue
-
-            # Find Columns
-            found_cols = {}
-            mov_cols_norm = {_norm_col_name(c): c for c in mov.columns}
-            for col_type, possible_names in mov_possible_col_names.items():
-                for name in possible_names:
-                    candidate_norm = _norm_col_name(name)
-                    if candidate_norm in mov_cols_norm:
-                        found_cols[col_type] = mov_cols_norm[candidate_norm]
-                        break
-
-            override_ref = None
-            override_qty = None
-
-            if isinstance(mov_cols_override, (list, tuple)) and len(mov_cols_override) == 2:
-                override_ref, override_qty = mov_cols_override
-
-                if override_ref == -1:
-                    override_ref = None
-                if override_qty == -1:
-                    override_qty = None
-
-            # Determine final column names
-            if override_ref is not None and _norm_col_name(override_ref) in mov_cols_norm:
-                ref_col = mov_cols_norm[_norm_col_name(override_ref)]
-            elif 'ref' in found_cols:
-                ref_col = found_cols['ref']
-            else:
+            used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+            if used_sheet is None:
                 continue
 
-            if override_qty is not None and _norm_col_name(override_qty) in mov_cols_norm:
-                qty_col = mov_cols_norm[_norm_col_name(override_qty)]
-            elif 'quantity' in found_cols:
-                qty_col = found_cols['quantity']
+            job_layout = layout if layout and layout['sheet'] == used_sheet else None
+            if job_layout:
+                header_idx = job_layout['headerRow']
             else:
+                header_idx = shared_value(
+                    shared, ('header', used_sheet),
+                    lambda: find_mov_header(atelier_key, read_sheet(mov_file_path, sheet_name=used_sheet, header=None))
+                )
+
+            usecols = layout_usecols(job_layout)
+            mov_agg, movements, mov_unreadable, error = shared_value(
+                shared, ('mov', used_sheet, header_idx, tuple(usecols) if usecols else None, repr(mov_cols_override)),
+                lambda: _movement_agg(mov_file_path, used_sheet, header_idx, usecols, mov_cols_override, month)
+            )
+            if error:
                 continue
 
-            # Filter by Date
-            if 'date' in found_cols:
-                date_col = found_cols['date']
-                mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
-                target_month = int(month)
-                target_year = 2025
-
-                mask = (mov[date_col].dt.year < target_year) | \
-                       ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
-                mov = mov[mask]
-
-            # Clean Movement Data
-            object_columns = mov.select_dtypes(include=['object']).columns
-            for col in object_columns:
-                mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
-
-            mov[ref_col] = mov[ref_col].astype('string')
-            mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-            mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0)
-            mov[qty_col] = mov[qty_col].round(2)
-
-            # Aggregate Movement
-            mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-            mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-            mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-
-            # Filter Stock by localisation
-            stock_filtered = filter_stock_by_localisation(stock_df, localisations_spec, stock_local_col, stock_localisation_col)
-
-            # Aggregate Stock
-            stock_agg = stock_filtered.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
-            stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
-            stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+            # Stock of the job's localisations
+            stock_agg = localisation_stock(stock_index, localisations_spec)
 
             # Comparison
-            comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-            comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+            comparison_df = join_quantities(stock_agg, mov_agg)
+            comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
 
             discrepancies = comparison_df[comparison_df['Difference'] != 0]
             matches = comparison_df[comparison_df['Difference'] == 0]
 
-            all_matches.extend(matches.to_dict('records'))
-            all_discrepancies.extend(discrepancies.to_dict('records'))
+            all_matches.extend(quantity_records(matches))
+            all_discrepancies.append(discrepancies)
+            summaries.append(comparison_summary(matches, discrepancies))
+            unparsed += localisation_unreadable(stock_index, localisations_spec) + mov_unreadable
+            # Jobs reading the same sheet share its movement rows
+            movement_parts[id(movements)] = movements
 
         except Exception as e:
             continue
 
     return {
         'matches': all_matches,
-        'discrepancies': sorted(all_discrepancies, key=lambda x: abs(x.get('Difference', 0)), reverse=True)
+        'discrepancies': largest_difference_records(all_discrepancies),
+        '_summary': merge_summaries(summaries),
+        'unparsedQuantities': unparsed,
+        '_movements': concat_movements(list(movement_parts.values()))
     }
 
 
 def process_all(stock_file, matched_files, month):
     """Process all matched files for Fibre"""
-    results = {}
-
     # Load stock once
     try:
-        stock_df, stock_local_col, stock_localisation_col, stock_ref_col, stock_qty_col = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
 
-    # Process each atelier
-    for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(
-            atelier_key, stock_df, stock_local_col, stock_localisation_col,
-            stock_ref_col, stock_qty_col, mov_file['path'], month
-        )
-
-    return results
+    # Process the ateliers grouped by the movement sheet they read, parsing each sheet once
+    return run_plan(sheet_args, matched_files, lambda atelier_key, mov_file, shared: process_atelier(
+        atelier_key, stock_index, mov_file['path'], month,
+        layout=mov_file.get('layout'), shared=shared
+    ))
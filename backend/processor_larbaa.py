@@ -10,6 +10,14 @@ import pandas as pd
 import os
 import re
 
+from layouts import layout_usecols, trusted_layout
+from movements import concat_movements, movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, join_quantities, largest_difference_records, merge_summaries, quantity_records, read_quantities
+from read_plan import run_plan, shared_value
+from sheet_cache import read_sheet
+from stock_index import build_stock_index, index_positions
+from workbook import list_sheets, peek_sheet, resolve_sheet
+
 
 # Sheet arguments configuration
 sheet_args = {
@@ -164,13 +172,22 @@ def find_header_row(temp_df, possible_col_names):
     return header_idx, found_header
 
 
+def find_mov_header(atelier_key, raw):
+    """Return the movement header row of a header=None frame, or None when no row qualifies"""
+    header_idx, found_header = find_header_row(raw, mov_possible_col_names)
+    return header_idx if found_header else None
+
+
 def read_stock_from_sheets(stock_file, sheet_names, quantity_cols=None):
     """Read and combine stock data from multiple sheets in the stock file."""
     all_stock_data = []
+    available_sheets = set(list_sheets(stock_file))
     
     for idx, sheet_name in enumerate(sheet_names):
+        if sheet_name not in available_sheets:
+            continue
         try:
-            temp_df = pd.read_excel(stock_file, sheet_name=sheet_name, header=None)
+            temp_df = peek_sheet(stock_file, sheet_name, nrows=50)
             header_idx = 0
             found_header = False
             
@@ -183,7 +200,7 @@ def read_stock_from_sheets(stock_file, sheet_names, quantity_cols=None):
                     found_header = True
                     break
             
-            df = pd.read_excel(stock_file, sheet_name=sheet_name, header=header_idx)
+            df = read_sheet(stock_file, sheet_name=sheet_name, header=header_idx)
             df = df.dropna(how="all")
             
             # Find reference and quantity columns
@@ -216,12 +233,12 @@ def read_stock_from_sheets(stock_file, sheet_names, quantity_cols=None):
             df[ref_col] = df[ref_col].str.strip()
             df[ref_col] = df[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
             
-            df[qty_col] = pd.to_numeric(df[qty_col], errors='coerce').fillna(0.0)
-            df[qty_col] = df[qty_col].round(2)
+            df[qty_col], unreadable = read_quantities(df[qty_col])
             
             df_clean = df[[ref_col, qty_col]].copy()
             df_clean.columns = ['REFERENCE', 'QUANTITE']
             df_clean['SOURCE_SHEET'] = sheet_name
+            df_clean[UNREADABLE_COL] = unreadable
             
             all_stock_data.append(df_clean)
             
@@ -232,10 +249,87 @@ def read_stock_from_sheets(stock_file, sheet_names, quantity_cols=None):
         combined = pd.concat(all_stock_data, ignore_index=True)
         return combined
     else:
-        return pd.DataFrame(columns=['REFERENCE', 'QUANTITE', 'SOURCE_SHEET'])
+        return pd.DataFrame(columns=['REFERENCE', 'QUANTITE', 'SOURCE_SHEET', UNREADABLE_COL])
+
+
+def stock_positions(stock_file_path):
+    """Stock per (stock sheet, reference) for stock deltas, and its unreadable quantity count"""
+    frames = []
+    read = set()
+    for args in sheet_args.values():
+        stock_sheets = args['stock_sheet']['sheets']
+        quantity_cols = args['stock_sheet'].get('quantity')
+        groups = stock_sheets if stock_sheets and isinstance(stock_sheets[0], list) else [stock_sheets]
+        for idx, group in enumerate(groups):
+            sheets = [s for s in group if s not in read]
+            if not sheets:
+                continue
+            read.update(sheets)
+            if len(groups) > 1:
+                pair_cols = quantity_cols[idx] if quantity_cols is not None and idx < len(quantity_cols) else None
+                frames.append(read_stock_from_sheets(stock_file_path, sheets, [pair_cols] if pair_cols else None))
+            else:
+                frames.append(read_stock_from_sheets(stock_file_path, sheets, quantity_cols))
+    stock = pd.concat(frames, ignore_index=True)
+    return index_positions(build_stock_index(stock, 'SOURCE_SHEET', 'REFERENCE', 'QUANTITE'))
 
 
-def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
+def _movement_agg(mov_file_path, used_sheet, header_idx, usecols, month):
+    """Movement quantity per reference for one sheet, as (mov_agg, movement rows, unreadable quantity count, error)"""
+    if header_idx is not None:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx, usecols=usecols)
+    else:
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet)
+    
+    # Find columns
+    found_cols = {}
+    for col_type, possible_names in mov_possible_col_names.items():
+        for name in possible_names:
+            if name in mov.columns:
+                found_cols[col_type] = name
+                break
+    
+    if 'date' not in found_cols:
+        for col in mov.columns:
+            if 'date' in str(col).lower():
+                found_cols['date'] = col
+                break
+    
+    if 'ref' not in found_cols or 'quantity' not in found_cols:
+        return None, None, 0, f'Missing columns. Available: {mov.columns.tolist()}'
+    
+    ref_col = found_cols['ref']
+    qty_col = found_cols['quantity']
+    date_col = found_cols.get('date')
+    
+    # Filter by date
+    if date_col:
+        parse_dates_normalized_eu(mov, date_col)
+        target_month = int(month)
+        target_year = 2025
+        
+        mask = (mov[date_col].dt.year < target_year) | \
+               ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
+        mov = mov[mask]
+    
+    # Clean
+    object_columns = mov.select_dtypes(include=['object']).columns
+    for col in object_columns:
+        mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
+    
+    mov[ref_col] = mov[ref_col].astype('string')
+    mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    mov[qty_col], unreadable = read_quantities(mov[qty_col])
+    
+    # Aggregate, keeping the rows for drill-down
+    movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, (header_idx or 0) + 2)
+    mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
+    mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
+    
+    return mov_agg, movements, int(unreadable.sum()), None
+
+
+def process_atelier(atelier_key, stock_file_path, mov_file_path, month, layout=None, shared=None):
     """Process a single atelier and return matches/discrepancies"""
     
     if atelier_key not in sheet_args:
@@ -268,6 +362,9 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
             
             all_discrepancies = []
             all_matches = []
+            summaries = []
+            movement_parts = []
+            unparsed = 0
             
             for pair_idx, (mov_sheet_group, stock_sheet_group) in enumerate(zip(possible_sheets, stock_sheets)):
                 pair_quantity_cols = None
@@ -282,15 +379,18 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                 
                 # Read and stack movement sheets
                 mov_data_list = []
+                available_mov_sheets = set(list_sheets(mov_file_path))
                 for mov_sheet_name in mov_sheet_group:
+                    if mov_sheet_name not in available_mov_sheets:
+                        continue
                     try:
-                        temp_df = pd.read_excel(mov_file_path, sheet_name=mov_sheet_name, header=None)
+                        temp_df = peek_sheet(mov_file_path, mov_sheet_name, nrows=50)
                         header_idx, found_header = find_header_row(temp_df, mov_possible_col_names)
                         
                         if found_header:
-                            mov_single = pd.read_excel(mov_file_path, sheet_name=mov_sheet_name, header=header_idx)
+                            mov_single = read_sheet(mov_file_path, sheet_name=mov_sheet_name, header=header_idx)
                         else:
-                            mov_single = pd.read_excel(mov_file_path, sheet_name=mov_sheet_name)
+                            mov_single = read_sheet(mov_file_path, sheet_name=mov_sheet_name)
                         
                         # Find columns
                         found_cols = {}
@@ -311,10 +411,10 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                         
                         ref_col = found_cols['ref']
                         qty_col = found_cols['quantity']
+                        date_col = found_cols.get('date')
                         
                         # Filter by date
-                        if 'date' in found_cols:
-                            date_col = found_cols['date']
+                        if date_col:
                             parse_dates_normalized_eu(mov_single, date_col)
                             target_month = int(month)
                             target_year = 2025
@@ -326,7 +426,11 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                         # Clean
                         mov_single[ref_col] = mov_single[ref_col].astype('string').str.strip()
                         mov_single[ref_col] = mov_single[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-                        mov_single[qty_col] = pd.to_numeric(mov_single[qty_col], errors='coerce').fillna(0.0)
+                        mov_single[qty_col], unreadable = read_quantities(mov_single[qty_col])
+                        unparsed += int(unreadable.sum())
+                        
+                        first_row = (header_idx if found_header else 0) + 2
+                        movement_parts.append(movement_detail(mov_single, ref_col, qty_col, date_col, mov_sheet_name, first_row))
                         
                         mov_clean = mov_single[[ref_col, qty_col]].copy()
                         mov_clean.columns = ['Ref', 'Qty']
@@ -341,26 +445,29 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                 mov_combined = pd.concat(mov_data_list, ignore_index=True)
                 mov_agg = mov_combined.groupby('Ref')['Qty'].sum().reset_index()
                 mov_agg.rename(columns={'Qty': 'Calc_Mov_Qty'}, inplace=True)
-                mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
                 
                 # Stock aggregation
                 stock_agg = stock_df.groupby('REFERENCE')['QUANTITE'].sum().reset_index()
                 stock_agg.rename(columns={'REFERENCE': 'Ref', 'QUANTITE': 'Stock_Qty'}, inplace=True)
-                stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
                 
                 # Compare
-                comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-                comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+                comparison_df = join_quantities(stock_agg, mov_agg)
+                comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
                 
                 discrepancies = comparison_df[comparison_df['Difference'] != 0]
                 matches = comparison_df[comparison_df['Difference'] == 0]
                 
-                all_discrepancies.extend(discrepancies.to_dict('records'))
-                all_matches.extend(matches.to_dict('records'))
+                all_discrepancies.append(discrepancies)
+                all_matches.extend(quantity_records(matches))
+                summaries.append(comparison_summary(matches, discrepancies))
+                unparsed += int(stock_df[UNREADABLE_COL].sum())
             
             return {
                 'matches': all_matches,
-                'discrepancies': sorted(all_discrepancies, key=lambda x: abs(x.get('Difference', 0)), reverse=True)
+                'discrepancies': largest_difference_records(all_discrepancies),
+                '_summary': merge_summaries(summaries),
+                'unparsedQuantities': unparsed,
+                '_movements': concat_movements(movement_parts)
             }
         
         else:
@@ -372,88 +479,43 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                 return {'error': 'Could not read stock sheets', 'matches': [], 'discrepancies': []}
             
             # Read movement
-            mov = None
-            used_sheet = None
-            
-            for sheet in possible_sheets:
-                try:
-                    temp_df = pd.read_excel(mov_file_path, sheet_name=sheet, header=None)
-                    header_idx, found_header = find_header_row(temp_df, mov_possible_col_names)
-                    
-                    if found_header:
-                        mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx)
-                    else:
-                        mov = pd.read_excel(mov_file_path, sheet_name=sheet)
-                    
-                    used_sheet = sheet
-                    break
-                except ValueError:
-                    continue
-                except Exception:
-                    continue
-            
-            if mov is None:
-                return {'error': f'Could not find sheets {possible_sheets}', 'matches': [], 'discrepancies': []}
-            
-            # Find columns
-            found_cols = {}
-            for col_type, possible_names in mov_possible_col_names.items():
-                for name in possible_names:
-                    if name in mov.columns:
-                        found_cols[col_type] = name
-                        break
-            
-            if 'date' not in found_cols:
-                for col in mov.columns:
-                    if 'date' in str(col).lower():
-                        found_cols['date'] = col
-                        break
-            
-            if 'ref' not in found_cols or 'quantity' not in found_cols:
-                return {'error': f'Missing columns. Available: {mov.columns.tolist()}', 'matches': [], 'discrepancies': []}
-            
-            ref_col = found_cols['ref']
-            qty_col = found_cols['quantity']
-            
-            # Filter by date
-            if 'date' in found_cols:
-                date_col = found_cols['date']
-                parse_dates_normalized_eu(mov, date_col)
-                target_month = int(month)
-                target_year = 2025
+            layout = trusted_layout(layout, mov_file_path)
+            if layout:
+                used_sheet, header_idx = layout['sheet'], layout['headerRow']
+            else:
+                used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+                if used_sheet is None:
+                    return {'error': f'Could not find sheets {possible_sheets}', 'matches': [], 'discrepancies': []}
                 
-                mask = (mov[date_col].dt.year < target_year) | \
-                       ((mov[date_col].dt.year == target_year) & (mov[date_col].dt.month <= target_month))
-                mov = mov[mask]
+                header_idx = shared_value(
+                    shared, ('header', used_sheet),
+                    lambda: find_mov_header(atelier_key, peek_sheet(mov_file_path, used_sheet, nrows=50))
+                )
             
-            # Clean
-            object_columns = mov.select_dtypes(include=['object']).columns
-            for col in object_columns:
-                mov[col] = mov[col].apply(lambda x: str(x).strip() if pd.notna(x) else x)
-            
-            mov[ref_col] = mov[ref_col].astype('string')
-            mov[ref_col] = mov[ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-            mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0)
-            
-            # Aggregate
-            mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
-            mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-            mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
+            usecols = layout_usecols(layout)
+            mov_agg, movements, mov_unreadable, error = shared_value(
+                shared, ('mov', used_sheet, header_idx, tuple(usecols) if usecols else None),
+                lambda: _movement_agg(mov_file_path, used_sheet, header_idx, usecols, month)
+            )
+            if error:
+                return {'error': error, 'matches': [], 'discrepancies': []}
             
             stock_agg = stock_df.groupby('REFERENCE')['QUANTITE'].sum().reset_index()
             stock_agg.rename(columns={'REFERENCE': 'Ref', 'QUANTITE': 'Stock_Qty'}, inplace=True)
-            stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
             
             # Compare
-            comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-            comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+            comparison_df = join_quantities(stock_agg, mov_agg)
+            comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
             
             discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
             matches = comparison_df[comparison_df['Difference'] == 0]
             
             return {
-                'matches': matches.to_dict('records'),
-                'discrepancies': discrepancies.to_dict('records')
+                'matches': quantity_records(matches),
+                'discrepancies': quantity_records(discrepancies),
+                '_summary': comparison_summary(matches, discrepancies),
+                'unparsedQuantities': int(stock_df[UNREADABLE_COL].sum()) + mov_unreadable,
+                '_movements': movements
             }
         
     except Exception as e:
@@ -462,10 +524,7 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
 
 def process_all(stock_file, matched_files, month):
     """Process all matched files for Larbaa"""
-    results = {}
-    
-    # Process each atelier
-    for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_file['path'], mov_file['path'], month)
-    
-    return results
+    # Process the ateliers grouped by the movement sheet they read, parsing each sheet once
+    return run_plan(sheet_args, matched_files, lambda atelier_key, mov_file, shared: process_atelier(
+        atelier_key, stock_file['path'], mov_file['path'], month, layout=mov_file.get('layout'), shared=shared
+    ))
@@ -13,6 +13,21 @@ import os
 import re
 import pandas as pd
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, fixed, join_quantities, quantity_records, read_quantities
+from sheet_cache import read_sheet
+from snapshots import stock_snapshot, stored_stock
+from workbook import list_sheets, peek_sheet, resolve_sheet
+
+
+UNIT = 'Mags'
+
+# Calc_Mov_Qty already includes the opening stock (see module docstring)
+CALC_INCLUDES_OPENING_STOCK = True
+
+# Largest |Difference| still counted as a match
+MATCH_TOLERANCE = 0.02
 
 sheet_args = {
     'magz': {
@@ -44,22 +59,18 @@ def _normalize_ref(series: pd.Series) -> pd.Series:
 
 
 def _read_excel_with_sheet_fallback(excel_path: str, sheet_candidates: list, header: int | None = None) -> tuple[pd.DataFrame, object]:
-    last_error = None
-    for sheet in sheet_candidates:
-        try:
-            df = pd.read_excel(excel_path, sheet_name=sheet, header=header)
-            return df, sheet
-        except ValueError as e:
-            last_error = e
-            continue
-        except Exception as e:
-            last_error = e
-            continue
-    raise RuntimeError(f"Could not read any of sheets {sheet_candidates} from {excel_path}. Last error: {last_error}")
+    sheet = resolve_sheet(excel_path, sheet_candidates)
+    if sheet is None:
+        raise RuntimeError(f"Could not read any of sheets {sheet_candidates} from {excel_path}. Available: {list_sheets(excel_path)}")
+    df = read_sheet(excel_path, sheet_name=sheet, header=header)
+    return df, sheet
 
 
 def _find_header_row(excel_path: str, sheet_name, possible_names: list[str], max_scan_rows: int = 50) -> int:
-    temp_df = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+    return _header_row_in(peek_sheet(excel_path, sheet_name, nrows=max_scan_rows), possible_names, max_scan_rows)
+
+
+def _header_row_in(temp_df: pd.DataFrame, possible_names: list[str], max_scan_rows: int = 50) -> int:
     scan_rows = min(max_scan_rows, len(temp_df))
     for idx in range(scan_rows):
         row_values = [str(val).strip() for val in temp_df.iloc[idx].values if pd.notna(val)]
@@ -68,6 +79,11 @@ def _find_header_row(excel_path: str, sheet_name, possible_names: list[str], max
     return 0
 
 
+def find_mov_header(atelier_key: str, raw: pd.DataFrame) -> int:
+    """Header row of a movement sheet, given its top rows read with header=None."""
+    return _header_row_in(raw, mov_possible_col_names['date'])
+
+
 def _infer_year_from_stock_filename(path: str) -> int | None:
     name = os.path.basename(path)
     # Matches: STOCK 11-2025.xlsx, STOCK 11-2025 (1).xlsx, etc.
@@ -107,7 +123,9 @@ def _find_neighbor_stock_file(current_stock_path: str, month: str, year: int) ->
 def load_stock(stock_path: str) -> tuple[pd.DataFrame, str, str]:
     sheet_candidates = ['MOUV', 'MOV', 'MAG', 0]
 
-    tmp, sheet_used = _read_excel_with_sheet_fallback(stock_path, sheet_candidates, header=None)
+    sheet_used = resolve_sheet(stock_path, sheet_candidates)
+    if sheet_used is None:
+        raise RuntimeError(f"Could not read any of sheets {sheet_candidates} from {stock_path}. Available: {list_sheets(stock_path)}")
     header_candidates = mov_possible_col_names['ref'] + mov_possible_col_names['quantity']
     header_idx = 0
     try:
@@ -130,17 +148,45 @@ def load_stock(stock_path: str) -> tuple[pd.DataFrame, str, str]:
 
     ref_col = found_cols['ref']
     qty_col = found_cols['quantity']
+    stock = stock[list(dict.fromkeys([ref_col, qty_col]))]
 
     for col in stock.select_dtypes(include=['object']).columns:
         stock[col] = stock[col].astype('string').str.strip()
 
     stock[ref_col] = _normalize_ref(stock[ref_col])
-    stock[qty_col] = pd.to_numeric(stock[qty_col], errors='coerce').fillna(0.0).round(2)
+    stock[qty_col], stock[UNREADABLE_COL] = read_quantities(stock[qty_col])
 
     return stock, ref_col, qty_col
 
 
-def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, month: str, overrides: dict | None = None) -> dict:
+def _stock_totals(stock_path: str) -> tuple[pd.DataFrame, int]:
+    """Stock quantity per reference (columns Ref, Qty) and the number of unreadable quantities"""
+    stock, ref_col, qty_col = load_stock(stock_path)
+    totals = stock.groupby(ref_col)[qty_col].sum().reset_index()
+    totals.columns = ['Ref', 'Qty']
+    return totals, int(stock[UNREADABLE_COL].sum())
+
+
+def stock_positions(stock_path: str) -> tuple[pd.DataFrame, int]:
+    """Stock per reference for stock deltas (Mags stock has no localisations), and its unreadable quantity count"""
+    return _stock_totals(stock_path)
+
+
+def _prev_stock(stock_file_path: str, prev_path: str | None, month: str, year: int) -> tuple[pd.DataFrame, int] | None:
+    """Opening stock for (month, year): the stored snapshot of that month, else the file given or found next to the current stock"""
+    if prev_path:
+        return stock_snapshot(UNIT, month, year, prev_path, _stock_totals) if os.path.exists(prev_path) else None
+    stored = stored_stock(UNIT, month, year)
+    if stored is not None:
+        return stored
+    prev_path = _find_neighbor_stock_file(stock_file_path, month, year)
+    if prev_path and os.path.exists(prev_path):
+        return stock_snapshot(UNIT, month, year, prev_path, _stock_totals)
+    return None
+
+
+def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, month: str, overrides: dict | None = None,
+                   layout: dict | None = None) -> dict:
     if atelier_key not in sheet_args:
         return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
 
@@ -162,40 +208,35 @@ def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, mont
         possible_sheets = [sheet_override]
 
     try:
-        # Current stock
-        stock, stock_ref_col, stock_qty_col = load_stock(stock_file_path)
-
-        # Previous stock (opening inventory)
+        # Current stock, kept as this month's snapshot
         year = _infer_year_from_stock_filename(stock_file_path) or 2025
+        stock_agg, unparsed = stock_snapshot(UNIT, month, year, stock_file_path, _stock_totals)
+        stock_agg = stock_agg.rename(columns={'Qty': 'Stock_Qty'})
+
+        # Previous stock (opening inventory): the month before unless another earlier month is asked for
         prev_month, prev_year = prev_month_year(month, year)
-        prev_stock_path = prev_stock_explicit_path or _find_neighbor_stock_file(stock_file_path, prev_month, prev_year)
-
-        prev_stock_agg = pd.DataFrame(columns=['Ref', 'Prev_Stock_Qty'])
-        if prev_stock_path and os.path.exists(prev_stock_path):
-            prev_stock, prev_ref_col, prev_qty_col = load_stock(prev_stock_path)
-            prev_stock_agg = prev_stock.groupby(prev_ref_col)[prev_qty_col].sum().reset_index()
-            prev_stock_agg.rename(columns={prev_ref_col: 'Ref', prev_qty_col: 'Prev_Stock_Qty'}, inplace=True)
-            prev_stock_agg['Prev_Stock_Qty'] = prev_stock_agg['Prev_Stock_Qty'].round(2)
+        if isinstance(stock_file, dict) and stock_file.get('prevMonth'):
+            prev_month, prev_year = f"{int(stock_file['prevMonth']):02d}", int(stock_file.get('prevYear') or year)
+        prev = _prev_stock(stock_file_path, prev_stock_explicit_path, prev_month, prev_year)
+        if prev is not None:
+            prev_stock_agg, prev_unparsed = prev
+            prev_stock_agg = prev_stock_agg.rename(columns={'Qty': 'Prev_Stock_Qty'})
+            unparsed += prev_unparsed
         else:
             prev_stock_agg = pd.DataFrame({'Ref': [], 'Prev_Stock_Qty': []})
 
         # Movement
-        mov = None
-        used_sheet = None
-        for sheet in possible_sheets:
-            try:
-                temp_df = pd.read_excel(mov_file_path, sheet_name=sheet, header=None)
-                header_idx = _find_header_row(mov_file_path, sheet, mov_possible_col_names['date'])
-                mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx if header_idx else None)
-                used_sheet = sheet
-                break
-            except ValueError:
-                continue
-            except Exception:
-                continue
+        layout = trusted_layout(layout, mov_file_path, sheet_override=sheet_override)
+        if layout:
+            used_sheet, header_idx = layout['sheet'], layout['headerRow']
+        else:
+            used_sheet = resolve_sheet(mov_file_path, possible_sheets)
+            if used_sheet is None:
+                return {'error': f"Could not read any of sheets {possible_sheets} in movement file", 'matches': [], 'discrepancies': []}
 
-        if mov is None:
-            return {'error': f"Could not read any of sheets {possible_sheets} in movement file", 'matches': [], 'discrepancies': []}
+            header_idx = _find_header_row(mov_file_path, used_sheet, mov_possible_col_names['date'])
+        mov = read_sheet(mov_file_path, sheet_name=used_sheet, header=header_idx if header_idx else None,
+                            usecols=layout_usecols(layout))
 
         found_cols = {}
         for col_type, possible_names in mov_possible_col_names.items():
@@ -211,8 +252,8 @@ def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, mont
             return {'error': f"Could not find ref/quantity columns. Available: {mov.columns.tolist()}", 'matches': [], 'discrepancies': []}
 
         # Filter by Date: keep ONLY the target month for this unit.
-        if 'date' in found_cols:
-            date_col = found_cols['date']
+        date_col = found_cols.get('date')
+        if date_col:
             mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
             target_month = int(month)
             target_year = year
@@ -223,27 +264,26 @@ def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, mont
             mov[col] = mov[col].astype('string').str.strip()
 
         mov[ref_col] = _normalize_ref(mov[ref_col])
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0).round(2)
+        mov[qty_col], unreadable = read_quantities(mov[qty_col])
+        unparsed += int(unreadable.sum())
+        movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, header_idx + 2 if header_idx else 1)
 
         mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
         mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
-
-        stock_agg = stock.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
-        stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
 
-        expected_agg = pd.merge(prev_stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        expected_agg['Expected_End_Qty'] = (expected_agg.get('Prev_Stock_Qty', 0) + expected_agg.get('Calc_Mov_Qty', 0)).round(2)
+        expected_agg = join_quantities(prev_stock_agg, mov_agg)
+        expected_agg['Expected_End_Qty'] = expected_agg.get('Prev_Stock_Qty', 0) + expected_agg.get('Calc_Mov_Qty', 0)
 
-        comparison_df = pd.merge(stock_agg, expected_agg[['Ref', 'Expected_End_Qty']], on='Ref', how='outer').fillna(0)
+        comparison_df = join_quantities(stock_agg, expected_agg[['Ref', 'Expected_End_Qty']])
         comparison_df.rename(columns={'Expected_End_Qty': 'Calc_Mov_Qty'}, inplace=True)
-        comparison_df['Difference'] = (comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']).round(2)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
 
-        discrepancies = comparison_df[comparison_df['Difference'].abs() > 0.02].sort_values(by='Difference', ascending=False)
-        matches = comparison_df[comparison_df['Difference'].abs() <= 0.02]
+        discrepancies = comparison_df[comparison_df['Difference'].abs() > fixed(MATCH_TOLERANCE)].sort_values(by='Difference', ascending=False)
+        matches = comparison_df[comparison_df['Difference'].abs() <= fixed(MATCH_TOLERANCE)]
 
-        return {'matches': matches.to_dict('records'), 'discrepancies': discrepancies.to_dict('records')}
+        return {'matches': quantity_records(matches), 'discrepancies': quantity_records(discrepancies),
+                '_summary': comparison_summary(matches, discrepancies), 'unparsedQuantities': unparsed,
+                '_movements': movements}
 
     except Exception as e:
         return {'error': str(e), 'matches': [], 'discrepancies': []}
@@ -252,7 +292,8 @@ def process_atelier(atelier_key: str, stock_file: dict, mov_file_path: str, mont
 def process_all(stock_file, matched_files, month):
     results = {}
     for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_file, mov_file['path'], month, overrides=None)
+        results[atelier_key] = process_atelier(atelier_key, stock_file, mov_file['path'], month, overrides=None,
+                                               layout=mov_file.get('layout'))
     return results
 
 
@@ -260,5 +301,6 @@ def process_all_with_overrides(stock_file, matched_files, month, overrides):
     results = {}
     for atelier_key, mov_file in matched_files.items():
         atelier_overrides = overrides.get(atelier_key, {}) if overrides else {}
-        results[atelier_key] = process_atelier(atelier_key, stock_file, mov_file['path'], month, overrides=atelier_overrides)
+        results[atelier_key] = process_atelier(atelier_key, stock_file, mov_file['path'], month, overrides=atelier_overrides,
+                                               layout=mov_file.get('layout'))
     return results
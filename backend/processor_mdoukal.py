@@ -2,6 +2,16 @@
 
 import pandas as pd
 
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import UNREADABLE_COL, comparison_summary, difference, fixed, join_quantities, quantity_records, read_quantities
+from sheet_cache import read_sheet
+from stock_index import as_categories, build_stock_index, index_positions, retained_index, stock_aggregate, stock_unreadable
+from workbook import list_sheets, peek_sheet, resolve_sheet
+
+
+# Largest |Difference| still counted as a match
+MATCH_TOLERANCE = 0.02
 
 sheet_args = {
     "couture femmes": {
@@ -33,7 +43,10 @@ def get_ateliers():
 
 
 def _find_header_row_by_date(excel_path: str, sheet_name, date_candidates: list[str], max_rows: int = 80) -> int:
-    tmp = pd.read_excel(excel_path, sheet_name=sheet_name, header=None)
+    return _date_header_row_in(peek_sheet(excel_path, sheet_name, nrows=max_rows), date_candidates, max_rows)
+
+
+def _date_header_row_in(tmp: pd.DataFrame, date_candidates: list[str], max_rows: int = 80) -> int:
     scan_rows = min(max_rows, len(tmp))
     for idx in range(scan_rows):
         row = tmp.iloc[idx]
@@ -43,6 +56,11 @@ def _find_header_row_by_date(excel_path: str, sheet_name, date_candidates: list[
     return 0
 
 
+def find_mov_header(atelier_key: str, raw: pd.DataFrame) -> int:
+    """Header row of a movement sheet, given its top rows read with header=None."""
+    return _date_header_row_in(raw, mov_possible_col_names['date'])
+
+
 def _normalize_ref(series: pd.Series) -> pd.Series:
     series = series.astype('string').str.strip()
     return series.str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
@@ -50,11 +68,10 @@ def _normalize_ref(series: pd.Series) -> pd.Series:
 
 def load_stock(stock_file_path: str):
     # Try to read MOUV, fallback to first sheet
-    xl = pd.ExcelFile(stock_file_path)
-    sheet_to_use = 'MOUV' if 'MOUV' in xl.sheet_names else xl.sheet_names[0]
+    sheet_to_use = resolve_sheet(stock_file_path, ['MOUV', 0])
 
     header_idx = _find_header_row_by_date(stock_file_path, sheet_to_use, mov_possible_col_names['date'])
-    stock = pd.read_excel(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
+    stock = read_sheet(stock_file_path, sheet_name=sheet_to_use, header=header_idx)
     stock = stock.dropna(how='all')
 
     # Expect REF/QUANTITE/LOCALISATION, but be a bit tolerant
@@ -64,34 +81,44 @@ def load_stock(stock_file_path: str):
 
     if not ref_col or not qty_col or not loc_col:
         raise KeyError(f"Stock file missing columns. Found ref={ref_col}, qty={qty_col}, loc={loc_col}. Available: {stock.columns.tolist()}")
+    stock = stock[list(dict.fromkeys([ref_col, qty_col, loc_col]))]
 
     for col in stock.select_dtypes(include=['object']).columns:
         stock[col] = stock[col].astype('string').str.strip()
 
     stock[ref_col] = _normalize_ref(stock[ref_col])
-    stock[qty_col] = pd.to_numeric(stock[qty_col], errors='coerce').fillna(0.0).round(2)
+    stock[qty_col], stock[UNREADABLE_COL] = read_quantities(stock[qty_col])
+
+    return as_categories(stock, [ref_col, loc_col]), ref_col, qty_col, loc_col
 
-    return stock, ref_col, qty_col, loc_col
 
+def stock_positions(stock_file_path: str) -> tuple[pd.DataFrame, int]:
+    """Stock per (localisation, reference) for stock deltas, and its unreadable quantity count"""
+    return index_positions(_stock_index(stock_file_path))
 
-def _read_mov(mov_file_path: str, possible_sheets: list):
-    last_error = None
-    for sheet in possible_sheets:
-        try:
-            header_idx = _find_header_row_by_date(mov_file_path, sheet, mov_possible_col_names['date'])
-            mov = pd.read_excel(mov_file_path, sheet_name=sheet, header=header_idx if header_idx else None)
-            return mov, sheet
-        except ValueError as e:
-            last_error = e
-            continue
-        except Exception as e:
-            last_error = e
-            continue
-    raise RuntimeError(f"Could not read any of sheets {possible_sheets} from {mov_file_path}. Last error: {last_error}")
 
+def _stock_index(stock_file_path: str) -> dict:
+    """Stock indexed by localisation"""
+    stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file_path)
+    return build_stock_index(stock_df, stock_loc_col, stock_ref_col, stock_qty_col)
 
-def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str, stock_qty_col: str, stock_loc_col: str,
-                   mov_file_path: str, month: str, overrides: dict | None = None) -> dict:
+
+def _read_mov(mov_file_path: str, possible_sheets: list, layout: dict | None = None):
+    if layout:
+        sheet, header_idx = layout['sheet'], layout['headerRow']
+    else:
+        sheet = resolve_sheet(mov_file_path, possible_sheets)
+        if sheet is None:
+            raise RuntimeError(f"Could not read any of sheets {possible_sheets} from {mov_file_path}. Available: {list_sheets(mov_file_path)}")
+        header_idx = _find_header_row_by_date(mov_file_path, sheet, mov_possible_col_names['date'])
+
+    mov = read_sheet(mov_file_path, sheet_name=sheet, header=header_idx if header_idx else None,
+                        usecols=layout_usecols(layout))
+    return mov, sheet, header_idx
+
+
+def process_atelier(atelier_key: str, stock_index: dict, mov_file_path: str, month: str, overrides: dict | None = None,
+                   layout: dict | None = None) -> dict:
     if atelier_key not in sheet_args:
         return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
 
@@ -108,8 +135,10 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
     if sheet_override:
         possible_sheets = [sheet_override]
 
+    layout = trusted_layout(layout, mov_file_path, sheet_override=sheet_override)
+
     try:
-        mov, _ = _read_mov(mov_file_path, possible_sheets)
+        mov, used_sheet, header_idx = _read_mov(mov_file_path, possible_sheets, layout)
         mov = mov.dropna(how='all')
 
         # Find columns
@@ -131,8 +160,8 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
             return {'error': f"Could not find ref/quantity columns. Available: {mov.columns.tolist()}", 'matches': [], 'discrepancies': []}
 
         # Date filter (months <= target for 2025; keep previous years)
-        if 'date' in found_cols:
-            date_col = found_cols['date']
+        date_col = found_cols.get('date')
+        if date_col:
             mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
             target_month = int(month)
             target_year = 2025
@@ -143,27 +172,26 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
             mov[col] = mov[col].astype('string').str.strip()
 
         mov[ref_col] = _normalize_ref(mov[ref_col])
-        mov[qty_col] = pd.to_numeric(mov[qty_col], errors='coerce').fillna(0.0).round(2)
+        mov[qty_col], unreadable = read_quantities(mov[qty_col])
+        movements = movement_detail(mov, ref_col, qty_col, date_col, used_sheet, header_idx + 2 if header_idx else 1)
 
         mov_agg = mov.groupby(ref_col)[qty_col].sum().reset_index()
         mov_agg.rename(columns={ref_col: 'Ref', qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
 
-        # Filter stock by localisation
+        # Stock of the atelier's localisations
         localisations = args.get('localisation') or []
-        stock_filtered = stock_df[stock_df[stock_loc_col].isin(localisations)].copy()
-
-        stock_agg = stock_filtered.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
-        stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+        stock_agg = stock_aggregate(stock_index, localisations)
 
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = (comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']).round(2)
+        comparison_df = join_quantities(stock_agg, mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
 
-        discrepancies = comparison_df[comparison_df['Difference'].abs() > 0.02].sort_values(by='Difference', ascending=False)
-        matches = comparison_df[comparison_df['Difference'].abs() <= 0.02]
+        discrepancies = comparison_df[comparison_df['Difference'].abs() > fixed(MATCH_TOLERANCE)].sort_values(by='Difference', ascending=False)
+        matches = comparison_df[comparison_df['Difference'].abs() <= fixed(MATCH_TOLERANCE)]
 
-        return {'matches': matches.to_dict('records'), 'discrepancies': discrepancies.to_dict('records')}
+        return {'matches': quantity_records(matches), 'discrepancies': quantity_records(discrepancies),
+                '_summary': comparison_summary(matches, discrepancies),
+                'unparsedQuantities': stock_unreadable(stock_index, localisations) + int(unreadable.sum()),
+                '_movements': movements}
 
     except Exception as e:
         return {'error': str(e), 'matches': [], 'discrepancies': []}
@@ -172,20 +200,18 @@ def process_atelier(atelier_key: str, stock_df: pd.DataFrame, stock_ref_col: str
 def process_all(stock_file, matched_files, month):
     results = {}
     try:
-        stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
 
     for atelier_key, mov_file in matched_files.items():
         results[atelier_key] = process_atelier(
             atelier_key,
-            stock_df,
-            stock_ref_col,
-            stock_qty_col,
-            stock_loc_col,
+            stock_index,
             mov_file['path'],
             month,
             overrides=None,
+            layout=mov_file.get('layout'),
         )
 
     return results
@@ -194,7 +220,7 @@ def process_all(stock_file, matched_files, month):
 def process_all_with_overrides(stock_file, matched_files, month, overrides):
     results = {}
     try:
-        stock_df, stock_ref_col, stock_qty_col, stock_loc_col = load_stock(stock_file['path'])
+        stock_index = retained_index(stock_file['path'], _stock_index)
     except Exception as e:
         return {'_error': f'Failed to load stock file: {str(e)}'}
 
@@ -202,13 +228,11 @@ def process_all_with_overrides(stock_file, matched_files, month, overrides):
         atelier_overrides = overrides.get(atelier_key, {}) if overrides else {}
         results[atelier_key] = process_atelier(
             atelier_key,
-            stock_df,
-            stock_ref_col,
-            stock_qty_col,
-            stock_loc_col,
+            stock_index,
             mov_file['path'],
             month,
             overrides=atelier_overrides,
+            layout=mov_file.get('layout'),
         )
 
     return results
@@ -6,9 +6,17 @@ This processor has:
 """
 
 import pandas as pd
+from pandas.tseries.api import guess_datetime_format
 import os
 import re
 import csv
+import io
+
+from layouts import layout_usecols, trusted_layout
+from movements import movement_detail
+from quantities import comparison_summary, difference, join_quantities, quantity_records, read_quantities
+from sheet_cache import read_sheet
+from workbook import resolve_sheet
 
 
 # Sheet arguments configuration
@@ -25,6 +33,16 @@ mov_possible_col_names = {
     'quantity': ['Q', 'Quantité', 'STOCK PV', 'STOCK FIBRE ', 'STOCK', 'STOCK ', 'STOCKS', 'ST-P', 'STOKS', 'STOCK U', 'المخزون', 'الكمية', 'العدد', 'STOCK/M', 'STOCK POIDS', 'باقي', 'Q-STOCKS', 'Q(U)', 'q(u)', 'Q-REEL', 'Somme de Q(U)', 'U'],
 }
 
+# Movement CSVs: detection reads only the first bytes, then the file is streamed in chunks of rows
+CSV_SAMPLE_BYTES = 65536
+CSV_SNIFF_LINES = 200
+CSV_SEPARATORS = [';', ',', '\t', '|']
+CSV_ENCODINGS = ['utf-8-sig', 'cp1252']
+CSV_CHUNK_ROWS = 200_000
+
+# Drill-down of a CSV read in several chunks would hold every row again, so it is not kept
+STREAMED_MOVEMENTS = f'Movement rows of CSVs over {CSV_CHUNK_ROWS} rows are not kept for drill-down'
+
 stock_qty_priority = ['q-reel', 'somme de q(u)', 'q(u)', 'Q', 'u', 'q-logicial', 'q-logiciale']
 
 
@@ -48,138 +66,119 @@ def _find_col(columns, candidates):
     return None
 
 
-def _read_csv_with_inferred_sep(path, header=None):
-    """Try to detect delimiter and read CSV"""
-    seps = [';', ',', '\t', '|']
-    encodings = ['utf-8-sig', 'utf-8', 'cp1252']
-    last_error = None
-
-    def _sniff_delimiter(sample_text):
-        try:
-            dialect = csv.Sniffer().sniff(sample_text, delimiters=''.join(seps))
-            return dialect.delimiter
-        except Exception:
-            return None
+def _sniff_csv(path):
+    """Encoding, delimiter and first rows of a CSV, detected once from a byte sample"""
+    with open(path, 'rb') as f:
+        sample = f.read(CSV_SAMPLE_BYTES)
+    # Drop the last, possibly cut, line unless the whole file fit in the sample
+    if len(sample) == CSV_SAMPLE_BYTES and b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n') + 1]
 
-    for encoding in encodings:
+    for encoding in CSV_ENCODINGS:
         try:
-            with open(path, 'rb') as f:
-                sample_bytes = f.read(65536)
-            sample_text = sample_bytes.decode(encoding, errors='replace')
-        except Exception as e:
-            last_error = e
+            text = sample.decode(encoding)
+            break
+        except UnicodeDecodeError:
             continue
+    else:
+        encoding = CSV_ENCODINGS[-1]
+        text = sample.decode(encoding, errors='replace')
 
-        sniffed = _sniff_delimiter(sample_text)
-        if sniffed:
-            try:
-                return pd.read_csv(path, sep=sniffed, header=header, encoding=encoding, engine='python')
-            except Exception as e:
-                last_error = e
-
-        best_sep = None
-        best_score = -1
-        for sep in seps:
-            try:
-                preview = pd.read_csv(path, sep=sep, header=header, encoding=encoding, engine='python', nrows=50)
-                score = int(preview.shape[1])
-                if score > best_score:
-                    best_score = score
-                    best_sep = sep
-            except Exception as e:
-                last_error = e
-
-        if best_sep is not None and best_score > 1:
-            try:
-                return pd.read_csv(path, sep=best_sep, header=header, encoding=encoding, engine='python')
-            except Exception as e:
-                last_error = e
-
-        try:
-            return pd.read_csv(path, sep=None, engine='python', header=header, encoding=encoding)
-        except Exception as e:
-            last_error = e
+    lines = [line for line in text.splitlines() if line.strip()]
+    try:
+        sep = csv.Sniffer().sniff('\n'.join(lines[:CSV_SNIFF_LINES]), delimiters=''.join(CSV_SEPARATORS)).delimiter
+    except csv.Error:
+        # Title rows can defeat the sniffer: take the separator splitting most lines into most fields
+        sep = max(CSV_SEPARATORS, key=lambda s: sorted(line.count(s) for line in lines)[len(lines) // 2] if lines else 0)
+
+    # Rows without a value are left out, each kept row labelled by the physical line it starts on
+    rows, lines = [], []
+    reader = csv.reader(io.StringIO(text), delimiter=sep)
+    line = 0
+    for row in reader:
+        if any(cell.strip() for cell in row):
+            rows.append(row)
+            lines.append(line)
+        line = reader.line_num
+    width = max((len(row) for row in rows), default=0)
+    preview = pd.DataFrame([[cell if cell.strip() else None for cell in row] + [None] * (width - len(row)) for row in rows],
+                           index=lines)
+    return encoding, sep, preview
+
+
+def _read_movement_csv(path, encoding=None):
+    """Chunks of a movement CSV and its header line: separator, encoding and header line come from a sample,
+    and only the columns the reconciliation uses are parsed"""
+    sniffed, sep, preview = _sniff_csv(path)
+    header_idx = find_mov_header(None, preview)
+    if header_idx is None:
+        header_idx = preview.notna().sum(axis=1).idxmax() if len(preview) else 0
+
+    wanted = {_norm_label(name) for names in mov_possible_col_names.values() for name in names}
+    labels = preview.loc[header_idx].dropna() if len(preview) else []
+    usecols = (lambda col: _norm_label(col) in wanted) if any(_norm_label(l) in wanted for l in labels) else None
+
+    # The header is found by physical line, so separator-only lines above it (';;;') are skipped too
+    chunks = pd.read_csv(path, sep=sep, skiprows=int(header_idx), header=0, usecols=usecols, engine='c',
+                         encoding=encoding or sniffed, encoding_errors='replace' if encoding else 'strict',
+                         chunksize=CSV_CHUNK_ROWS)
+    return chunks, int(header_idx)
+
+
+def find_mov_header(atelier_key, raw):
+    """Return the first row naming a date column (normalized match) of a header=None frame, or None"""
+    for idx, row in raw.iterrows():
+        row_values = [str(val) for val in row.values if pd.notna(val)]
+        row_values_norm = {_norm_label(v) for v in row_values}
+        if any(_norm_label(name) in row_values_norm for name in mov_possible_col_names['date']):
+            return idx
+    return None
 
-    raise last_error if last_error else Exception("Could not read CSV")
 
+def _read_movement_file(path, possible_sheets, layout=None):
+    """Read an Excel movement file, as (mov, sheet, header row)"""
+    if layout:
+        # Sheet and header row were resolved by verify for this exact file
+        mov = read_sheet(path, sheet_name=layout['sheet'], header=layout['headerRow'], usecols=layout_usecols(layout))
+        return mov, layout['sheet'], layout['headerRow']
 
-def _read_movement_file(path, possible_sheets):
-    """Read movement file (CSV or Excel)"""
-    ext = os.path.splitext(path)[1].lower()
-    
-    if ext == '.csv':
-        temp_df = _read_csv_with_inferred_sep(path, header=None)
-        header_idx = 0
-        found_header = False
-
-        for idx, row in temp_df.iterrows():
-            row_values = [str(val) for val in row.values if pd.notna(val)]
-            row_values_norm = {_norm_label(v) for v in row_values}
-            if any(_norm_label(name) in row_values_norm for name in mov_possible_col_names['date']):
-                header_idx = idx
-                found_header = True
-                break
-
-        if not found_header:
-            header_idx = temp_df.notna().sum(axis=1).idxmax()
-
-        mov = _read_csv_with_inferred_sep(path, header=int(header_idx))
-        return mov, 'CSV'
-
-    # Excel fallback
     if isinstance(possible_sheets, str):
         possible_sheets = [possible_sheets]
 
-    mov = None
-    used_sheet = None
-    for sheet in possible_sheets:
-        try:
-            temp_df = pd.read_excel(path, sheet_name=sheet, header=None)
-            header_idx = 0
-            found_header = False
-
-            for idx, row in temp_df.iterrows():
-                row_values = [str(val) for val in row.values if pd.notna(val)]
-                row_values_norm = {_norm_label(v) for v in row_values}
-                if any(_norm_label(name) in row_values_norm for name in mov_possible_col_names['date']):
-                    header_idx = idx
-                    found_header = True
-                    break
-
-            if found_header:
-                mov = pd.read_excel(path, sheet_name=sheet, header=header_idx)
-            else:
-                header_idx = temp_df.notna().sum(axis=1).idxmax()
-                mov = pd.read_excel(path, sheet_name=sheet, header=header_idx)
-
-            used_sheet = sheet
-            break
-        except ValueError:
-            continue
-        except Exception:
-            continue
-
-    if mov is None:
+    used_sheet = resolve_sheet(path, possible_sheets)
+    if used_sheet is None:
         raise ValueError(f"Could not find any of the sheets {possible_sheets} in {path}")
 
-    return mov, used_sheet
+    temp_df = read_sheet(path, sheet_name=used_sheet, header=None)
+    header_idx = find_mov_header(None, temp_df)
 
+    if header_idx is None:
+        header_idx = temp_df.notna().sum(axis=1).idxmax()
+    mov = read_sheet(path, sheet_name=used_sheet, header=header_idx)
 
-def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
-    """Process a single atelier and return matches/discrepancies"""
-    
-    if atelier_key not in sheet_args:
-        return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
-    
-    args = sheet_args[atelier_key]
-    
-    try:
-        #----------------------------------------------------------
-        # Processing Movement File
-        #----------------------------------------------------------
-        possible_sheets = args['sheet_name']
-        mov, used_sheet = _read_movement_file(mov_file_path, possible_sheets)
-        
+    return mov, used_sheet, header_idx
+
+
+def _date_format(dates):
+    """Format pd.to_datetime would guess from the first date written as text, None if there is none yet"""
+    written = dates.dropna()
+    if written.empty or not isinstance(written.iloc[0], str):
+        return None
+    return guess_datetime_format(written.iloc[0]) or 'mixed'
+
+
+def _aggregate_movement(frames, month, sheet, header_idx):
+    """Movement quantity per reference over frames read in turn (one Excel sheet, or CSV chunks),
+    as (mov_agg, movement rows, unreadable quantity count, error). Only the running per-reference
+    totals and the slim movement rows (see movements.movement_detail) of a single frame are kept:
+    past the first chunk the movement rows are dropped (None), so memory stays bounded by a chunk."""
+    totals = None
+    movements = None
+    chunks = 0
+    unreadable = 0
+    date_format = None
+    for mov in frames:
+        chunks += 1
         mov = mov.dropna(how="all")
         mov.columns = mov.columns.astype(str).str.strip()
         
@@ -191,17 +190,20 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
                 found_cols[col_type] = matched
         
         if 'ref' not in found_cols:
-            return {'error': f'Could not find ref column. Available: {mov.columns.tolist()}', 'matches': [], 'discrepancies': []}
+            return None, None, 0, f'Could not find ref column. Available: {mov.columns.tolist()}'
         if 'quantity' not in found_cols:
-            return {'error': f'Could not find quantity column. Available: {mov.columns.tolist()}', 'matches': [], 'discrepancies': []}
+            return None, None, 0, f'Could not find quantity column. Available: {mov.columns.tolist()}'
         
         mov_ref_col = found_cols['ref']
         mov_qty_col = found_cols['quantity']
         
         # Filter by Date if available
-        if 'date' in found_cols:
-            date_col = found_cols['date']
-            mov[date_col] = pd.to_datetime(mov[date_col], errors='coerce')
+        date_col = found_cols.get('date')
+        if date_col:
+            # Guess the format from the first date of the file, not afresh for every chunk
+            if date_format is None:
+                date_format = _date_format(mov[date_col])
+            mov[date_col] = pd.to_datetime(mov[date_col], format=date_format, errors='coerce')
             target_month = int(month)
             target_year = 2025
             
@@ -217,74 +219,133 @@ def process_atelier(atelier_key, stock_file_path, mov_file_path, month):
         mov[mov_ref_col] = mov[mov_ref_col].astype('string')
         mov[mov_ref_col] = mov[mov_ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
         
-        # Aggregate Movement
-        mov[mov_qty_col] = pd.to_numeric(mov[mov_qty_col], errors='coerce').fillna(0.0)
-        mov_agg = mov.groupby(mov_ref_col)[mov_qty_col].sum().reset_index()
-        mov_agg.rename(columns={mov_ref_col: 'Ref', mov_qty_col: 'Calc_Mov_Qty'}, inplace=True)
-        mov_agg['Calc_Mov_Qty'] = mov_agg['Calc_Mov_Qty'].round(2)
+        # Aggregate Movement, folding this frame into the running totals
+        mov[mov_qty_col], mov_unreadable = read_quantities(mov[mov_qty_col])
+        unreadable += int(mov_unreadable.sum())
+        movements = movement_detail(mov, mov_ref_col, mov_qty_col, date_col, sheet, int(header_idx) + 2) if chunks == 1 else None
+        part = mov.groupby(mov_ref_col)[mov_qty_col].sum()
+        totals = part if totals is None else pd.concat([totals, part]).groupby(level=0).sum()
+    
+    mov_agg = totals.rename_axis('Ref').reset_index(name='Calc_Mov_Qty')
+    return mov_agg, movements, unreadable, None
+
+
+def _movement_agg(path, possible_sheets, layout, month):
+    """(mov_agg, movement rows, unreadable quantity count, error) for a movement file.
+    CSVs are streamed in chunks, so memory is bounded by the chunk size; their movement rows are
+    kept only when the file fits in one chunk, numbered by line, its file name standing for the sheet."""
+    if os.path.splitext(path)[1].lower() != '.csv':
+        mov, used_sheet, header_idx = _read_movement_file(path, possible_sheets, layout)
+        return _aggregate_movement([mov], month, used_sheet, header_idx)
+    
+    try:
+        chunks, header_idx = _read_movement_csv(path)
+        return _aggregate_movement(chunks, month, os.path.basename(path), header_idx)
+    except UnicodeDecodeError:
+        # A byte past the sample did not fit the detected encoding: start over leniently
+        chunks, header_idx = _read_movement_csv(path, encoding=CSV_ENCODINGS[-1])
+        return _aggregate_movement(chunks, month, os.path.basename(path), header_idx)
+
+
+def _stock_agg(stock_file_path, stock_sheet_name):
+    """Stock quantity per reference ('Ref', 'Stock_Qty') of one stock sheet, and its unreadable quantity count"""
+    stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=None)
+    stock = stock.dropna(how="all")
+    
+    # Find header row with most non-empty values
+    header_idx = stock.notna().sum(axis=1).idxmax()
+    stock = read_sheet(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
+    
+    stock.columns = stock.columns.astype(str).str.strip()
+    
+    # Find reference column
+    ref_col_candidates = [c for c in stock.columns if 'référence' in c.lower() or 'reference' in c.lower()]
+    if not ref_col_candidates:
+        ref_col_candidates = [c for c in stock.columns if 'ref' in c.lower()]
+    
+    stock_ref_col = ref_col_candidates[0] if ref_col_candidates else None
+    
+    if not stock_ref_col:
+        raise ValueError(f'Could not find reference column in stock. Available: {stock.columns.tolist()}')
+    
+    # Find quantity column with priority
+    stock_qty_col = None
+    for priority_name in stock_qty_priority:
+        matched = _find_col(stock.columns, [priority_name])
+        if matched:
+            stock_qty_col = matched
+            break
+    
+    if not stock_qty_col:
+        qty_candidates = [c for c in stock.columns if any(q in c.lower() for q in ['quantité', 'quantite', 'qty', 'stock', 'q(u)'])]
+        if qty_candidates:
+            stock_qty_col = qty_candidates[0]
+    
+    if not stock_qty_col:
+        raise ValueError(f'Could not find quantity column in stock. Available: {stock.columns.tolist()}')
+    
+    # Clean stock
+    stock[stock_ref_col] = stock[stock_ref_col].astype('string').str.strip()
+    stock[stock_ref_col] = stock[stock_ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
+    stock[stock_qty_col], unreadable = read_quantities(stock[stock_qty_col])
+    
+    # Aggregate Stock
+    stock_agg = stock.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
+    stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
+    return stock_agg, int(unreadable.sum())
+
+
+def stock_positions(stock_file_path):
+    """Stock per (stock sheet, reference) for stock deltas, and its unreadable quantity count"""
+    parts = []
+    unreadable = 0
+    for stock_sheet_name in dict.fromkeys(args['stock_sheet'] for args in sheet_args.values()):
+        stock_agg, sheet_unreadable = _stock_agg(stock_file_path, stock_sheet_name)
+        parts.append(stock_agg.rename(columns={'Stock_Qty': 'Qty'}).assign(Localisation=stock_sheet_name))
+        unreadable += sheet_unreadable
+    return pd.concat(parts, ignore_index=True)[['Localisation', 'Ref', 'Qty']], unreadable
+
+
+def process_atelier(atelier_key, stock_file_path, mov_file_path, month, layout=None):
+    """Process a single atelier and return matches/discrepancies"""
+    
+    if atelier_key not in sheet_args:
+        return {'error': f'Unknown atelier: {atelier_key}', 'matches': [], 'discrepancies': []}
+    
+    args = sheet_args[atelier_key]
+    
+    try:
+        #----------------------------------------------------------
+        # Processing Movement File
+        #----------------------------------------------------------
+        possible_sheets = args['sheet_name']
+        mov_agg, movements, mov_unreadable, error = _movement_agg(mov_file_path, possible_sheets, trusted_layout(layout, mov_file_path), month)
+        if error:
+            return {'error': error, 'matches': [], 'discrepancies': []}
         
         #----------------------------------------------------------
         # Processing Stock File
         #----------------------------------------------------------
-        stock_sheet_name = args['stock_sheet']
-        
-        stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=None)
-        stock = stock.dropna(how="all")
-        
-        # Find header row with most non-empty values
-        header_idx = stock.notna().sum(axis=1).idxmax()
-        stock = pd.read_excel(stock_file_path, sheet_name=stock_sheet_name, header=header_idx)
-        
-        stock.columns = stock.columns.astype(str).str.strip()
-        
-        # Find reference column
-        ref_col_candidates = [c for c in stock.columns if 'référence' in c.lower() or 'reference' in c.lower()]
-        if not ref_col_candidates:
-            ref_col_candidates = [c for c in stock.columns if 'ref' in c.lower()]
-        
-        stock_ref_col = ref_col_candidates[0] if ref_col_candidates else None
-        
-        if not stock_ref_col:
-            return {'error': f'Could not find reference column in stock. Available: {stock.columns.tolist()}', 'matches': [], 'discrepancies': []}
-        
-        # Find quantity column with priority
-        stock_qty_col = None
-        for priority_name in stock_qty_priority:
-            matched = _find_col(stock.columns, [priority_name])
-            if matched:
-                stock_qty_col = matched
-                break
-        
-        if not stock_qty_col:
-            qty_candidates = [c for c in stock.columns if any(q in c.lower() for q in ['quantité', 'quantite', 'qty', 'stock', 'q(u)'])]
-            if qty_candidates:
-                stock_qty_col = qty_candidates[0]
-        
-        if not stock_qty_col:
-            return {'error': f'Could not find quantity column in stock. Available: {stock.columns.tolist()}', 'matches': [], 'discrepancies': []}
-        
-        # Clean stock
-        stock[stock_ref_col] = stock[stock_ref_col].astype('string').str.strip()
-        stock[stock_ref_col] = stock[stock_ref_col].str.replace(r'(?<=\d)\.(?=\d)', ',', regex=True)
-        stock[stock_qty_col] = pd.to_numeric(stock[stock_qty_col], errors='coerce').fillna(0.0)
-        
-        # Aggregate Stock
-        stock_agg = stock.groupby(stock_ref_col)[stock_qty_col].sum().reset_index()
-        stock_agg.rename(columns={stock_ref_col: 'Ref', stock_qty_col: 'Stock_Qty'}, inplace=True)
-        stock_agg['Stock_Qty'] = stock_agg['Stock_Qty'].round(2)
+        stock_agg, stock_unreadable = _stock_agg(stock_file_path, args['stock_sheet'])
         
         # Comparison
-        comparison_df = pd.merge(stock_agg, mov_agg, on='Ref', how='outer').fillna(0)
-        comparison_df['Difference'] = comparison_df['Stock_Qty'] - comparison_df['Calc_Mov_Qty']
+        comparison_df = join_quantities(stock_agg, mov_agg)
+        comparison_df['Difference'] = difference(comparison_df['Stock_Qty'], comparison_df['Calc_Mov_Qty'])
         
         # Results
         discrepancies = comparison_df[comparison_df['Difference'] != 0].sort_values(by='Difference', ascending=False)
         matches = comparison_df[comparison_df['Difference'] == 0]
         
-        return {
-            'matches': matches.to_dict('records'),
-            'discrepancies': discrepancies.to_dict('records')
+        result = {
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': stock_unreadable + mov_unreadable,
+            '_movements': movements
         }
+        if movements is None:
+            result['movementsNote'] = STREAMED_MOVEMENTS
+        return result
         
     except Exception as e:
         return {'error': str(e), 'matches': [], 'discrepancies': []}
@@ -296,6 +357,6 @@ def process_all(stock_file, matched_files, month):
     
     # Process each atelier
     for atelier_key, mov_file in matched_files.items():
-        results[atelier_key] = process_atelier(atelier_key, stock_file['path'], mov_file['path'], month)
+        results[atelier_key] = process_atelier(atelier_key, stock_file['path'], mov_file['path'], month, layout=mov_file.get('layout'))
     
     return results
@@ -0,0 +1,206 @@
+"""
+Quantities - quantity parsing and fixed-point arithmetic
+
+Sheets from the French and Arabic sites write quantities as text like
+"1 234,50", "12,5" or "3 kg", which pd.to_numeric turns into NaN (and so
+0). parse_quantities() reads them: numbers and plain numeric text go
+through pd.to_numeric, and only the cells left over are parsed in Python,
+once per distinct string. Cells that still cannot be read count as 0 and
+are flagged so processors can report how many there were.
+
+Quantities are then converted into int64 counts of millionths
+(QTY_SCALE), fine enough that cells written with more decimals than the
+units report still add up: a hundred movements of 0.005 total 0.50. Sums
+and merges are plain integer arithmetic with no float noise. Only the
+Difference of a comparison is rounded, once, to the hundredth every unit
+compares at (difference()), so a discrepancy is zero exactly when both
+totals agree to the hundredth. Values turn back into floats only in the
+records and summaries handed to the UI, and stored floats come back with
+to_fixed().
+"""
+
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+
+QTY_SCALE = 1_000_000
+
+# Differences are compared at hundredths, as every unit reports them
+COMPARE_STEP = QTY_SCALE // 100
+
+# Columns of a comparison frame that hold fixed-point quantities
+QTY_COLUMNS = ('Stock_Qty', 'Calc_Mov_Qty', 'Difference', 'Prev_Stock_Qty', 'Expected_End_Qty', 'Delta',
+               'Prev_Difference', 'Change')
+
+# Stock frame column flagging rows whose quantity could not be read (see stock_index)
+UNREADABLE_COL = '_unreadable_qty'
+
+# Text that stands for an empty cell rather than a bad quantity
+_BLANKS = {'', '-', 'nan', 'none', 'nat', '<na>', 'null'}
+
+# Arabic-Indic and Persian digits, Arabic decimal and thousands separators
+_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹٫٬', '01234567890123456789.,')
+
+# Spaces used as thousands separators: plain, no-break, narrow no-break, thin; and 1'234
+_GROUPING = re.compile(r"[\s\u00A0\u202F\u2009']")
+
+# Optional sign, a number with '.'/',' separators, then an optional unit ('kg', 'm2', 'U', ...)
+_QUANTITY = re.compile(r'([+-]?)(\d[\d.,]*|[.,]\d[\d.,]*)(?:[^\W\d_].*)?', re.DOTALL)
+
+
+def _parse_text(text: str) -> float | None:
+    """One quantity written as text; None when it is not a number."""
+    match = _QUANTITY.fullmatch(_GROUPING.sub('', text.translate(_DIGITS)))
+    if not match:
+        return None
+    sign, number = match.groups()
+    if ',' in number and '.' in number:
+        # The separator written last is the decimal one: 1.234,50 or 1,234.50
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif number.count(',') > 1:
+        number = number.replace(',', '')
+    elif ',' in number:
+        number = number.replace(',', '.')
+    elif number.count('.') > 1:
+        number = number.replace('.', '')
+    try:
+        value = float(sign + number)
+    except ValueError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+def parse_quantities(values) -> tuple[pd.Series, pd.Series]:
+    """Quantities as floats (NaN where empty or unreadable) and a mask of the unreadable cells."""
+    values = values if isinstance(values, pd.Series) else pd.Series(values)
+    numbers = pd.to_numeric(values, errors='coerce')
+    if isinstance(numbers.dtype, pd.api.extensions.ExtensionDtype):
+        numbers = numbers.astype('float64')
+    if numbers.dtype.kind == 'f':
+        numbers = numbers.where(~np.isinf(numbers))
+
+    pending = (numbers.isna() & values.notna()).to_numpy()
+    if not pending.any():
+        return numbers, pd.Series(False, index=values.index)
+
+    # Only the text cells pd.to_numeric could not read, each distinct string parsed once
+    text = values[pending].astype(str).str.strip()
+    written = ~text.str.lower().isin(_BLANKS).to_numpy()
+    positions = np.flatnonzero(pending)[written]
+    text = text[written]
+    parsed = {value: _parse_text(value) for value in text.unique()}
+    found = text.map(parsed).to_numpy(dtype='float64', na_value=np.nan)
+
+    result = numbers.to_numpy(dtype='float64', copy=True)
+    result[positions] = found
+    unreadable = np.zeros(len(values), dtype=bool)
+    unreadable[positions] = np.isnan(found)
+    return pd.Series(result, index=values.index, name=values.name), pd.Series(unreadable, index=values.index)
+
+
+def read_quantities(values) -> tuple[pd.Series, pd.Series]:
+    """Quantities as int64 fixed-point (unreadable cells count as 0) and the unreadable mask."""
+    numbers, unreadable = parse_quantities(values)
+    return (numbers * QTY_SCALE).round().fillna(0).astype('int64'), unreadable
+
+
+def fixed(value: float) -> int:
+    """One quantity, e.g. a tolerance, in fixed-point."""
+    return int(round(value * QTY_SCALE))
+
+
+def to_fixed(values) -> np.ndarray:
+    """Stored float quantities (records, run columns) back in fixed-point."""
+    return np.round(np.asarray(values, dtype='float64') * QTY_SCALE).astype('int64')
+
+
+def difference(stock, movement):
+    """stock - movement (fixed-point), rounded half up to the hundredth quantities are compared at."""
+    return (stock - movement + COMPARE_STEP // 2) // COMPARE_STEP * COMPARE_STEP
+
+
+def join_quantities(left: pd.DataFrame, right: pd.DataFrame, on='Ref') -> pd.DataFrame:
+    """Outer merge of two quantity frames on one key column or several; a key missing on one side counts 0 there."""
+    merged = pd.merge(left, right, on=on, how='outer')
+    keys = [on] if isinstance(on, str) else list(on)
+    qty_cols = [col for col in merged.columns if col not in keys]
+    merged[qty_cols] = merged[qty_cols].fillna(0).astype('int64')
+    return merged
+
+
+def quantity_records(frame: pd.DataFrame) -> list[dict]:
+    """frame.to_dict('records') with fixed-point columns turned back into floats."""
+    frame = frame.copy()
+    for col in QTY_COLUMNS:
+        if col in frame.columns:
+            frame[col] = frame[col] / QTY_SCALE
+    return frame.to_dict('records')
+
+
+def largest_difference_records(frames) -> list[dict]:
+    """Records of several comparison frames, largest |Difference| first (ties keep their order)."""
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return []
+    combined = pd.concat(frames, ignore_index=True)
+    order = np.argsort(-np.abs(combined['Difference'].to_numpy(dtype='int64')), kind='stable')
+    return quantity_records(combined.iloc[order])
+
+
+def largest_positions(magnitude: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k largest values, largest first; ties keep their order, as in a stable sort."""
+    top = np.arange(len(magnitude))
+    if len(magnitude) > k:
+        cut = -np.partition(-magnitude, k - 1)[k - 1]
+        ties = np.flatnonzero(magnitude == cut)[:k - int((magnitude > cut).sum())]
+        top = np.sort(np.concatenate([np.flatnonzero(magnitude > cut), ties]))
+    return top[np.argsort(-magnitude[top], kind='stable')]
+
+
+# References listed, largest |Difference| first, in a comparison summary
+SUMMARY_TOP = 10
+
+_SUMMARY_COUNTS = ('matches', 'discrepancies', 'positiveCount', 'negativeCount')
+_SUMMARY_TOTALS = ('totalAbsDifference', 'positiveTotal', 'negativeTotal')
+
+
+def comparison_summary(matches: pd.DataFrame, discrepancies: pd.DataFrame) -> dict:
+    """Counts and totals of one comparison (fixed-point 'Difference'), for the UI and reports.
+
+    totalAbsDifference is the sum of |Difference| over the discrepancies,
+    split into positive and negative; topRefs are the SUMMARY_TOP
+    discrepancies with the largest |Difference|.
+    """
+    diff = discrepancies['Difference'].to_numpy(dtype='int64')
+    positive, negative = diff[diff > 0], diff[diff < 0]
+    magnitude = np.abs(diff)
+    top = np.argpartition(-magnitude, SUMMARY_TOP)[:SUMMARY_TOP] if len(diff) > SUMMARY_TOP else np.arange(len(diff))
+    top = top[np.argsort(-magnitude[top], kind='stable')]
+    refs = discrepancies['Ref'].iloc[top].tolist()
+    return {
+        'matches': int(len(matches)),
+        'discrepancies': int(len(diff)),
+        'totalAbsDifference': int(magnitude.sum()) / QTY_SCALE,
+        'positiveCount': int(len(positive)),
+        'positiveTotal': int(positive.sum()) / QTY_SCALE,
+        'negativeCount': int(len(negative)),
+        'negativeTotal': int(negative.sum()) / QTY_SCALE,
+        'topRefs': [{'Ref': ref, 'Difference': int(d) / QTY_SCALE} for ref, d in zip(refs, diff[top])],
+    }
+
+
+def merge_summaries(summaries) -> dict:
+    """One summary over several (parts of an atelier, or the ateliers of a unit)."""
+    summaries = [s for s in summaries if s]
+    merged = {key: sum(s[key] for s in summaries) for key in _SUMMARY_COUNTS}
+    # Totals are added in fixed-point so the sum carries no float noise
+    merged.update({key: sum(fixed(s[key]) for s in summaries) / QTY_SCALE for key in _SUMMARY_TOTALS})
+    top = sorted((row for s in summaries for row in s['topRefs']), key=lambda row: abs(row['Difference']), reverse=True)
+    merged['topRefs'] = top[:SUMMARY_TOP]
+    return merged
@@ -0,0 +1,75 @@
+"""
+Read Plan - one parse per (workbook, sheet) for ateliers sharing a movement sheet
+
+Several ateliers of a unit read the same sheet of what is often the same
+workbook (Fath5's 'bonda', 'couette fini' and 'semi fini' all use
+'ATELLIER COUATE'), and the movement side of their reconciliation only
+depends on that sheet - the atelier only changes how the stock is filtered.
+
+plan_reads() groups the matched ateliers by the (file, sheet) they will read.
+run_plan() processes one group at a time and hands every atelier of the group
+the same `shared` dict, in which the sheet's header row and movement
+aggregate are computed once (shared_value) and reused. The dict is dropped
+before the next group, so only one group's frames are held at a time.
+"""
+
+import os
+
+from layouts import trusted_layout
+from workbook import resolve_sheet
+
+
+def _planned_sheet(sheet_candidates, file_info: dict, sheet_override=None):
+    """Sheet an atelier will read, or None when it cannot be known up front."""
+    layout = trusted_layout(file_info.get('layout'), file_info['path'], sheet_override=sheet_override)
+    if layout:
+        return layout['sheet']
+
+    candidates = [sheet_override] if sheet_override else sheet_candidates
+    if isinstance(candidates, (str, int)):
+        candidates = [candidates]
+    if not candidates or any(isinstance(c, (list, tuple)) for c in candidates):
+        # Ateliers reading several sheets keep a group of their own
+        return None
+    return resolve_sheet(file_info['path'], candidates)
+
+
+def plan_reads(sheet_args: dict, matched_files: dict, overrides: dict | None = None) -> list[dict]:
+    """Group matched ateliers by the (file, sheet) they read, in first-seen order.
+
+    Each group is {'path', 'sheet', 'ateliers'}. An atelier whose sheet cannot
+    be resolved before processing gets a group of its own with sheet None.
+    """
+    groups = {}
+    for atelier, file_info in matched_files.items():
+        path = file_info.get('path') if isinstance(file_info, dict) else None
+        sheet = None
+        if path:
+            sheet_override = ((overrides or {}).get(atelier) or {}).get('sheetName')
+            try:
+                sheet = _planned_sheet(sheet_args.get(atelier, {}).get('sheet_name'), file_info, sheet_override)
+            except Exception:
+                sheet = None
+
+        key = (os.path.abspath(path), sheet) if path and sheet is not None else (path, None, atelier)
+        groups.setdefault(key, {'path': path, 'sheet': sheet, 'ateliers': []})['ateliers'].append(atelier)
+    return list(groups.values())
+
+
+def shared_value(shared: dict | None, key, compute):
+    """shared[key], computed on first use; without a shared dict it is always computed."""
+    if shared is None:
+        return compute()
+    if key not in shared:
+        shared[key] = compute()
+    return shared[key]
+
+
+def run_plan(sheet_args: dict, matched_files: dict, process, overrides: dict | None = None) -> dict:
+    """Call process(atelier, file_info, shared) group by group; results keep matched_files order."""
+    results = {}
+    for group in plan_reads(sheet_args, matched_files, overrides):
+        shared = {}
+        for atelier in group['ateliers']:
+            results[atelier] = process(atelier, matched_files[atelier], shared)
+    return {atelier: results[atelier] for atelier in matched_files}
@@ -0,0 +1,102 @@
+"""
+Run Diff - what changed between two stored runs of a unit
+
+Reviewers compared two runs (before and after a correction, or a month
+with the month before) by reading two CSV exports side by side. diff_runs()
+compares the discrepancies of two stored runs (see runs) atelier by
+atelier: each side is keyed by its normalized references (spacing collapsed,
+lowercased) with the Difference summed per key in fixed-point (see quantities),
+and one hash join on the key (a single pd.factorize over both runs' keys)
+sorts every reference into
+
+- new: a discrepancy only in the later run,
+- resolved: a discrepancy only in the earlier run,
+- changed: a discrepancy in both, with a different Difference.
+
+'Matched' tells whether a new or resolved reference is among the matches
+of the run in which it is not a discrepancy (rather than missing from it).
+Rows come largest |Change| first.
+"""
+
+import numpy as np
+import pandas as pd
+
+from movements import ref_key
+from quantities import quantity_records, to_fixed
+from runs import load_atelier, load_meta, run_info
+
+
+def _ref_keys(view: dict) -> np.ndarray:
+    """Reference key of each row (see movements.ref_key), from the distinct references of the view's index."""
+    index = view['index']
+    distinct = np.array([ref_key(ref) for ref in index['refs'].tolist()], dtype=object)
+    return distinct[np.asarray(index['row_refs'])]
+
+
+def _largest_change_records(frame: pd.DataFrame) -> list[dict]:
+    order = np.argsort(-np.abs(frame['Change'].to_numpy(dtype='int64')), kind='stable')
+    return quantity_records(frame.iloc[order])
+
+
+def atelier_diff(base: dict, other: dict) -> dict:
+    """New, resolved and changed discrepancies between the views of one atelier in two runs."""
+    sides = (base['discrepancies'], other['discrepancies'])
+    keys = [_ref_keys(view) for view in sides]
+    # The hash join: one code per normalized reference of either run
+    codes, uniques = pd.factorize(np.concatenate(keys))
+    codes = np.split(codes, [len(keys[0])])
+
+    totals, present, first = [], [], []
+    for view, side_codes in zip(sides, codes):
+        difference = to_fixed(view['columns']['Difference'])
+        total = np.zeros(len(uniques), dtype='int64')
+        np.add.at(total, side_codes, difference)
+        rows = np.full(len(uniques), -1, dtype='int64')
+        rows[side_codes[::-1]] = np.arange(len(side_codes))[::-1]
+        totals.append(total)
+        present.append(rows >= 0)
+        first.append(rows)
+
+    change = totals[1] - totals[0]
+    both = present[0] & present[1]
+
+    def frame(selected, matched_view=None):
+        ids = np.flatnonzero(selected)
+        # A reference is shown as the later run wrote it (either run may have no rows)
+        refs = np.empty(len(ids), dtype=object)
+        for view, side_first in zip(sides, first):
+            rows = side_first[ids]
+            seen = rows >= 0
+            refs[seen] = np.asarray(view['columns']['Ref'])[rows[seen]]
+        rows = pd.DataFrame({'Ref': refs.astype(str), 'Prev_Difference': totals[0][ids],
+                             'Difference': totals[1][ids], 'Change': change[ids]})
+        if matched_view is not None:
+            rows['Matched'] = pd.Series(uniques[ids]).isin(_ref_keys(matched_view)).to_numpy()
+        return _largest_change_records(rows)
+
+    return {
+        'new': frame(present[1] & ~present[0], base['matches']),
+        'resolved': frame(present[0] & ~present[1], other['matches']),
+        'changed': frame(both & (change != 0)),
+        'unchanged': int((both & (change == 0)).sum()),
+    }
+
+
+def diff_runs(base_run_id: str, run_id: str, atelier: str | None = None) -> dict:
+    """Discrepancy changes from one stored run (the earlier) to another, per atelier or for one atelier."""
+    base_meta, meta = load_meta(base_run_id), load_meta(run_id)
+    if base_meta['unit'] != meta['unit']:
+        raise ValueError(f"Runs are of different units: {base_meta['unit']} and {meta['unit']}")
+
+    ateliers = [atelier] if atelier else list(dict.fromkeys([*meta['ateliers'], *base_meta['ateliers']]))
+    diffs = {}
+    for name in ateliers:
+        if name not in base_meta['ateliers'] or name not in meta['ateliers']:
+            diffs[name] = {'error': 'Atelier is not in both runs', 'new': [], 'resolved': [], 'changed': []}
+            continue
+        base, other = load_atelier(base_run_id, name, base_meta), load_atelier(run_id, name, meta)
+        if base['error'] or other['error']:
+            diffs[name] = {'error': base['error'] or other['error'], 'new': [], 'resolved': [], 'changed': []}
+            continue
+        diffs[name] = atelier_diff(base['views'], other['views'])
+    return {'base': run_info(base_run_id, base_meta), 'run': run_info(run_id, meta), 'ateliers': diffs}
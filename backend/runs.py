@@ -0,0 +1,418 @@
+"""
+Run History - every process run kept on disk, served a page at a time and restorable later
+
+The results table used to receive every row of every atelier and filter,
+sort and render all of them in the renderer, and closing the app lost the
+results. retain_run() keeps each run under RUN_DIR instead: a meta.json
+with the unit, month, input files (paths, fingerprints and the layouts
+they were read with), timings and summaries, and one directory of .npy
+column files per atelier. Each view ('matches', 'discrepancies') is stored
+as its columns, its reference index (see search_index) and one
+pre-computed sort order per column.
+
+Atelier files are opened with np.load(mmap_mode='r'), so reading a run
+parses nothing: query_results() walks a stored order and touches only the
+rows of the page asked for, and restore_run() reopens a past run from
+list_runs() with its largest discrepancies, the way a process run answers.
+The movement rows each atelier summed are stored with it too (see
+movements), so reference_movements() returns one reference's history.
+
+Edits made in the results view (deleted or renamed references) are applied
+to the run with edit_results(), so later pages agree with what the user
+sees; the atelier's files are written to a new directory rather than over
+files that may still be mapped. An atelier processed again on its own is
+put in place of the run's with replace_atelier(), the same way. Only the
+MAX_RUNS most recent runs are kept.
+"""
+
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from quantities import comparison_summary, largest_positions, merge_summaries, to_fixed
+from movements import MOVEMENT_ARRAYS, movement_index, reference_history
+from search_index import build_index, highlights, match_rows
+from storage import data_path
+
+
+RUN_DIR = 'runs'
+MAX_RUNS = 50
+
+# Runs written before the columnar store (one pickle per atelier) are not listed
+RUN_VERSION = 2
+
+VIEWS = ('matches', 'discrepancies')
+COLUMNS = ('Ref', 'Stock_Qty', 'Calc_Mov_Qty', 'Difference')
+# Arrays of a view, one .npy file each: its columns, reference index and sort orders
+ARRAYS = (tuple(f"columns.{col}" for col in COLUMNS)
+          + tuple(f"index.{key}" for key in ('refs', 'row_refs', 'gram_keys', 'gram_starts', 'postings', 'long'))
+          + tuple(f"order.{col}" for col in COLUMNS))
+
+
+def _runs_root() -> str:
+    return os.path.dirname(data_path(RUN_DIR, 'meta.json'))
+
+
+def _run_dir(run_id: str) -> str:
+    return os.path.join(_runs_root(), os.path.basename(run_id))
+
+
+def _write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_meta(run_id: str, meta: dict) -> None:
+    _write(os.path.join(_run_dir(run_id), 'meta.json'), json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+
+def _number(value) -> float:
+    """Quantity as the table sorts it: anything that is not a number counts as 0."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if np.isnan(number) else number
+
+
+def _view(rows: list[dict]) -> dict:
+    """Columns of one view and a stable ascending order for each of them."""
+    refs = ['' if row.get('Ref') is None else str(row['Ref']) for row in rows]
+    columns = {'Ref': np.array(refs, dtype=str) if refs else np.array([], dtype='U1')}
+    for col in COLUMNS[1:]:
+        columns[col] = np.array([_number(row.get(col)) for row in rows], dtype='float64')
+    index = build_index(refs)
+    keys = {'Ref': index['row_refs']}
+    keys.update({col: columns[col] for col in COLUMNS[1:]})
+    return {
+        'columns': columns,
+        'index': index,
+        'order': {col: np.argsort(key, kind='stable').astype('int32') for col, key in keys.items()},
+    }
+
+
+def _store_arrays(run_id: str, prefix: str, arrays: dict) -> str:
+    """Write arrays as .npy files of a fresh directory of the run; returns its name."""
+    name = f"{prefix}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(_run_dir(run_id), f"{name}.tmp")
+    os.makedirs(tmp_dir)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{key}.npy"), np.ascontiguousarray(array))
+    os.rename(tmp_dir, os.path.join(_run_dir(run_id), name))
+    return name
+
+
+def _open_arrays(run_id: str, name: str, keys) -> dict:
+    """Arrays of a directory of the run, memory-mapped."""
+    return {key: np.load(os.path.join(_run_dir(run_id), name, f"{key}.npy"), mmap_mode='r') for key in keys}
+
+
+def _store_views(run_id: str, prefix: str, views: dict) -> str:
+    arrays = {}
+    for view, data in views.items():
+        for key in ARRAYS:
+            group, field = key.split('.', 1)
+            arrays[f"{view}.{key}"] = data[group][field]
+    return _store_arrays(run_id, prefix, arrays)
+
+
+def _open_views(run_id: str, name: str) -> dict:
+    """An atelier's views with every array memory-mapped."""
+    arrays = _open_arrays(run_id, name, [f"{view}.{key}" for view in VIEWS for key in ARRAYS])
+    views = {view: {'columns': {}, 'index': {}, 'order': {}} for view in VIEWS}
+    for key, array in arrays.items():
+        view, group, field = key.split('.', 2)
+        views[view][group][field] = array
+    return views
+
+
+def _prune() -> None:
+    runs = sorted((entry for entry in os.scandir(_runs_root()) if entry.is_dir()), key=lambda entry: entry.stat().st_mtime)
+    for entry in runs[:-MAX_RUNS]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _store_atelier(run_id: str, prefix: str, data) -> dict:
+    """Store one atelier's result; returns its meta entry."""
+    if not isinstance(data, dict) or data.get('error'):
+        error = data.get('error') if isinstance(data, dict) else str(data)
+        return {'dir': None, 'error': error, 'counts': {view: 0 for view in VIEWS}}
+    views = {view: _view(data.get(view) or []) for view in VIEWS}
+    return {
+        'dir': _store_views(run_id, prefix, views),
+        'error': None,
+        'unparsedQuantities': data.get('unparsedQuantities', 0),
+        'counts': {view: len(v['columns']['Ref']) for view, v in views.items()},
+        'summary': data.get('_summary') or _summary(views),
+        'movementsNote': data.get('movementsNote'),
+    }
+
+
+def retain_run(unit: str, month, results: dict, inputs: dict | None = None, timings: dict | None = None,
+               movements: dict | None = None) -> str:
+    """Store a run's results, inputs, timings and ({atelier: movement_detail frame}) movement rows; returns its run id."""
+    started = time.perf_counter()
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(_run_dir(run_id))
+    meta = {
+        'version': RUN_VERSION,
+        'unit': unit,
+        'month': month,
+        'created': time.time(),
+        'inputs': inputs or {},
+        'error': results.get('_error'),
+        'summary': results.get('_summary'),
+        'ateliers': {},
+    }
+    stored = {}
+    for n, (atelier, data) in enumerate(results.items()):
+        if atelier.startswith('_'):
+            continue
+        meta['ateliers'][atelier] = _store_atelier(run_id, f"atelier-{n:03d}", data)
+        if meta['ateliers'][atelier]['error']:
+            continue
+        # Ateliers reading the same sheet share one frame, stored once
+        detail = (movements or {}).get(atelier)
+        if detail is not None:
+            if id(detail) not in stored:
+                stored[id(detail)] = _store_arrays(run_id, f"movements-{n:03d}", movement_index(detail))
+            meta['ateliers'][atelier]['movements'] = stored[id(detail)]
+    meta['timings'] = {**(timings or {}), 'retain': round(time.perf_counter() - started, 3)}
+    _write_meta(run_id, meta)
+    _prune()
+    return run_id
+
+
+def load_meta(run_id: str) -> dict:
+    with open(os.path.join(_run_dir(run_id), 'meta.json'), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != RUN_VERSION:
+        raise ValueError(f"Run was stored by an older version: {run_id}")
+    return meta
+
+
+def run_exists(run_id: str) -> bool:
+    """Whether the run is still stored, by this version."""
+    try:
+        load_meta(run_id)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def load_atelier(run_id: str, atelier: str, meta: dict | None = None) -> dict:
+    """{'error', 'unparsedQuantities', 'views'} of one atelier of a run, its arrays memory-mapped."""
+    meta = meta or load_meta(run_id)
+    if atelier not in meta['ateliers']:
+        raise KeyError(f"Atelier not in run: {atelier}")
+    info = meta['ateliers'][atelier]
+    if info['error']:
+        return {'error': info['error'], 'views': {}}
+    return {'error': None, 'unparsedQuantities': info.get('unparsedQuantities', 0),
+            'views': _open_views(run_id, info['dir'])}
+
+
+def run_info(run_id: str, meta: dict) -> dict:
+    """A run as listed: its meta without the input details and per-atelier entries."""
+    return {
+        'runId': run_id,
+        'unit': meta['unit'],
+        'month': meta['month'],
+        'created': meta['created'],
+        'timings': meta.get('timings') or {},
+        'summary': meta.get('summary'),
+        'ateliers': len(meta['ateliers']),
+        'errors': sum(1 for info in meta['ateliers'].values() if info['error']),
+    }
+
+
+def list_runs(unit: str | None = None) -> list[dict]:
+    """Stored runs, most recent first, described by their meta (without the input details)."""
+    runs = []
+    for entry in os.scandir(_runs_root()):
+        if not entry.is_dir():
+            continue
+        try:
+            meta = load_meta(entry.name)
+        except (OSError, ValueError):
+            continue
+        if unit and meta['unit'] != unit:
+            continue
+        runs.append(run_info(entry.name, meta))
+    runs.sort(key=lambda run: run['created'], reverse=True)
+    return runs
+
+
+def _records(view: dict, positions) -> list[dict]:
+    columns = view['columns']
+    return [{col: (str(columns[col][i]) if col == 'Ref' else float(columns[col][i])) for col in COLUMNS}
+            for i in positions]
+
+
+def restore_run(run_id: str, top_k: int | None = None) -> dict:
+    """A stored run's results, shaped like a process run's.
+
+    Rows come back in the order they were stored, the order of the run
+    itself. With top_k, each atelier carries only its top_k discrepancies by
+    |Difference| and 'partial' row counts, as keep_top_discrepancies leaves
+    a fresh run; the other rows are queried from the run as needed.
+    """
+    meta = load_meta(run_id)
+    results = {}
+    for atelier, info in meta['ateliers'].items():
+        if info['error']:
+            results[atelier] = {'error': info['error'], 'matches': [], 'discrepancies': []}
+            continue
+        views = _open_views(run_id, info['dir'])
+        data = {'unparsedQuantities': info.get('unparsedQuantities', 0), '_summary': info['summary']}
+        discrepancies = views['discrepancies']
+        if top_k:
+            data['matches'] = []
+            top = largest_positions(np.abs(np.asarray(discrepancies['columns']['Difference'])), int(top_k))
+            data['discrepancies'] = _records(discrepancies, top)
+            data['partial'] = dict(info['counts'])
+        else:
+            data['matches'] = _records(views['matches'], range(info['counts']['matches']))
+            data['discrepancies'] = _records(discrepancies, range(info['counts']['discrepancies']))
+        results[atelier] = data
+    if meta.get('error'):
+        results['_error'] = meta['error']
+    results['_summary'] = meta.get('summary')
+    return {'results': results, 'unit': meta['unit'], 'month': meta['month'], 'created': meta['created'],
+            'inputs': meta.get('inputs') or {}, 'timings': meta.get('timings') or {}}
+
+
+def _rows(view: dict, positions, search: str = '', prefix: bool = False) -> list[dict]:
+    rows = _records(view, positions)
+    for i, row in zip(positions, rows):
+        row['Row'] = int(i)
+        if search:
+            row['Highlight'] = highlights(row['Ref'], search, prefix)
+    return rows
+
+
+def query_results(run_id: str, atelier: str, view: str, search: str = '', sort: str | None = None,
+                  direction: str = 'asc', offset: int = 0, limit: int = 200, prefix: bool = False) -> dict:
+    """One page of a view: rows filtered by a reference substring (or prefix) and sorted by a column."""
+    entry = load_atelier(run_id, atelier)
+    if entry['error']:
+        return {'error': entry['error'], 'rows': [], 'total': 0, 'offset': 0}
+    data = entry['views'][view]
+
+    if sort in data['order']:
+        order = data['order'][sort]
+        if direction == 'desc':
+            order = order[::-1]
+    else:
+        order = np.arange(len(data['columns']['Ref']), dtype='int32')
+    if search:
+        matched = match_rows(data['index'], search, prefix)
+        order = order[matched[order]]
+
+    total = len(order)
+    offset = max(0, min(int(offset), max(total - 1, 0)))
+    return {'rows': _rows(data, order[offset:offset + int(limit)], search, prefix), 'total': total, 'offset': offset}
+
+
+def load_movements(run_id: str, atelier: str, meta: dict | None = None) -> dict | None:
+    """An atelier's movement index (see movements), memory-mapped; None when no movement rows were kept."""
+    meta = meta or load_meta(run_id)
+    if atelier not in meta['ateliers']:
+        raise KeyError(f"Atelier not in run: {atelier}")
+    name = meta['ateliers'][atelier].get('movements')
+    return _open_arrays(run_id, name, MOVEMENT_ARRAYS) if name else None
+
+
+def reference_movements(run_id: str, atelier: str, ref: str) -> dict:
+    """The movement rows of one reference of an atelier, in date order (see movements)."""
+    meta = load_meta(run_id)
+    index = load_movements(run_id, atelier, meta)
+    if index is None:
+        note = meta['ateliers'].get(atelier, {}).get('movementsNote')
+        return {'error': note or 'No movement rows were kept for this atelier', 'ref': ref, 'rows': [], 'total': 0}
+    return reference_history(index, ref)
+
+
+def _summary(views: dict) -> dict:
+    """Comparison summary of an atelier's stored views."""
+    frames = {}
+    for view in VIEWS:
+        columns = views[view]['columns']
+        difference = to_fixed(columns['Difference'])
+        frames[view] = pd.DataFrame({'Ref': np.asarray(columns['Ref']), 'Difference': difference})
+    return comparison_summary(frames['matches'], frames['discrepancies'])
+
+
+def edit_results(run_id: str, atelier: str, view: str, remove=None, rename=None) -> dict:
+    """Delete references from a view and/or rename them ({old: new}); orders are rebuilt.
+
+    Every row of a renamed reference is renamed. Returns the view's new row
+    count, the atelier's updated summary and the references that were renamed.
+    """
+    meta = load_meta(run_id)
+    entry = load_atelier(run_id, atelier, meta)
+    if entry['error']:
+        raise ValueError(entry['error'])
+    views = entry['views']
+    columns = views[view]['columns']
+
+    removed = {str(ref).strip() for ref in remove or []}
+    renamed = {str(old).strip(): new for old, new in (rename or {}).items()}
+    applied = set()
+    rows = []
+    for row in _records(views[view], range(len(columns['Ref']))):
+        ref = row['Ref'].strip()
+        if ref in removed:
+            continue
+        if ref in renamed:
+            row['Ref'] = renamed[ref]
+            applied.add(ref)
+        rows.append(row)
+
+    info = meta['ateliers'][atelier]
+    views = {name: (_view(rows) if name == view else data) for name, data in views.items()}
+    old_dir = info['dir']
+    info['dir'] = _store_views(run_id, old_dir.rsplit('-', 1)[0], views)
+    info['counts'][view] = len(rows)
+    info['summary'] = _summary(views)
+    meta['summary'] = merge_summaries(other['summary'] for other in meta['ateliers'].values() if not other['error'])
+    _write_meta(run_id, meta)
+
+    # The old files may still be mapped (and so not removable on Windows) until the views are released
+    del entry, views, columns
+    shutil.rmtree(os.path.join(_run_dir(run_id), old_dir), ignore_errors=True)
+    return {'total': len(rows), 'summary': info['summary'], 'renamed': sorted(applied)}
+
+
+def replace_atelier(run_id: str, atelier: str, data: dict, movements: pd.DataFrame | None = None,
+                    inputs: dict | None = None, timings: dict | None = None) -> dict:
+    """Put a new result of one atelier (and its movement rows and input file) in place of the run's.
+
+    Returns the atelier's new row counts and the run's updated summary.
+    """
+    meta = load_meta(run_id)
+    old = meta['ateliers'].get(atelier) or {}
+    number = old['dir'].rsplit('-', 2)[1] if old.get('dir') else f"{len(meta['ateliers']):03d}"
+    info = _store_atelier(run_id, f"atelier-{number}", data)
+    if movements is not None and not info['error']:
+        info['movements'] = _store_arrays(run_id, f"movements-{number}", movement_index(movements))
+    meta['ateliers'][atelier] = info
+    if inputs:
+        meta.setdefault('inputs', {}).setdefault('ateliers', {})[atelier] = inputs
+    meta['timings'] = {**(meta.get('timings') or {}), **(timings or {})}
+    meta['summary'] = merge_summaries(other['summary'] for other in meta['ateliers'].values() if not other['error'])
+    _write_meta(run_id, meta)
+
+    # Movement rows may be shared with another atelier of the run
+    in_use = {name for other in meta['ateliers'].values() for name in (other['dir'], other.get('movements')) if name}
+    for name in (old.get('dir'), old.get('movements')):
+        if name and name not in in_use:
+            shutil.rmtree(os.path.join(_run_dir(run_id), name), ignore_errors=True)
+    return {'counts': info['counts'], 'summary': meta['summary']}
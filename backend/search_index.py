@@ -0,0 +1,131 @@
+"""
+Reference Search Index - substring and prefix search over a view's references
+
+Searching the results used to test every row's reference on every
+keystroke. build_index() works on the distinct lowercased references of a
+view instead: kept sorted, they answer prefix queries by binary search, and
+an n-gram index (every 1-, 2- and 3-gram packed into one uint64, with the
+sorted ids of the references containing it) answers substring queries: a
+query of up to three characters is a single posting list, a longer one
+intersects the postings of its trigrams and confirms only those
+candidates. Matches are mapped back to rows through the row -> reference
+table.
+
+Only the first GRAM_CHARS characters of a reference are indexed; longer
+references are always confirmed directly, so no match is missed.
+"""
+
+import numpy as np
+
+
+GRAM_CHARS = 48
+_SHIFT = np.uint64(21)
+
+
+def _gram_keys(codes: np.ndarray, n: int) -> np.ndarray:
+    """uint64 keys of the n-grams (n <= 3) starting at each position of a (rows, width) code point matrix.
+
+    No character is code point 0, so grams of different lengths never share a key.
+    """
+    codes = codes.astype('uint64')
+    width = codes.shape[1] - n + 1
+    keys = codes[:, :width].copy()
+    for i in range(1, n):
+        keys = (keys << _SHIFT) | codes[:, i:i + width]
+    return keys
+
+
+def build_index(refs: list[str]) -> dict:
+    """Index of lowercased references (one per row)."""
+    lowered = np.array([ref.lower() for ref in refs], dtype=str) if refs else np.array([], dtype='U1')
+    distinct, ref_of_row = np.unique(lowered, return_inverse=True)
+    lengths = np.char.str_len(distinct) if len(distinct) else np.array([], dtype='int64')
+
+    width = max(3, min(GRAM_CHARS, int(lengths.max()) if len(lengths) else 0))
+    codes = distinct.astype(f'U{width}').view('uint32').reshape(len(distinct), width)
+    indexed = np.minimum(lengths, width)[:, None]
+    all_ids = np.arange(len(distinct), dtype='int32')[:, None]
+    keys, ids = [], []
+    for n in (1, 2, 3):
+        grams = _gram_keys(codes, n)
+        valid = np.arange(width - n + 1)[None, :] + n <= indexed
+        keys.append(grams[valid])
+        ids.append(np.broadcast_to(all_ids, grams.shape)[valid])
+    keys, ids = np.concatenate(keys), np.concatenate(ids)
+
+    # Ids ascend within each gram's block, so a stable sort on the key keeps postings sorted
+    order = np.argsort(keys, kind='stable')
+    keys, ids = keys[order], ids[order]
+    fresh = np.ones(len(keys), dtype=bool)
+    fresh[1:] = (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])
+    keys, ids = keys[fresh], ids[fresh]
+    gram_keys, starts = np.unique(keys, return_index=True)
+
+    return {
+        'refs': distinct,
+        'row_refs': ref_of_row.astype('int32'),
+        'gram_keys': gram_keys,
+        'gram_starts': np.append(starts, len(ids)).astype('int64'),
+        'postings': ids,
+        'long': np.flatnonzero(lengths > width).astype('int32'),
+    }
+
+
+def _posting(index: dict, key) -> np.ndarray:
+    pos = np.searchsorted(index['gram_keys'], key)
+    if pos == len(index['gram_keys']) or index['gram_keys'][pos] != key:
+        return index['postings'][:0]
+    return index['postings'][index['gram_starts'][pos]:index['gram_starts'][pos + 1]]
+
+
+def _substring_refs(index: dict, query: str) -> np.ndarray:
+    """Ids of the references containing `query` (an id may repeat)."""
+    refs = index['refs']
+    codes = np.array([query], dtype=f'U{len(query)}').view('uint32').reshape(1, len(query))
+    if len(query) <= 3:
+        found = _posting(index, _gram_keys(codes, len(query))[0, 0])
+    else:
+        candidates = None
+        for key in set(_gram_keys(codes, 3)[0].tolist()):
+            posting = _posting(index, key)
+            candidates = posting if candidates is None else np.intersect1d(candidates, posting, assume_unique=True)
+            if not len(candidates):
+                break
+        found = candidates[np.char.find(refs[candidates], query) >= 0]
+
+    # References longer than GRAM_CHARS may match past their indexed part
+    long = index['long']
+    if not len(long):
+        return found
+    return np.concatenate([found, long[np.char.find(refs[long], query) >= 0]])
+
+
+def _prefix_refs(index: dict, query: str) -> np.ndarray:
+    refs = index['refs']
+    lo = np.searchsorted(refs, query, side='left')
+    hi = np.searchsorted(refs, query + '\U0010FFFF', side='left')
+    return np.arange(lo, hi)
+
+
+def match_rows(index: dict, query: str, prefix: bool = False) -> np.ndarray:
+    """Boolean mask of the rows whose reference contains (or starts with) `query`, ignoring case."""
+    query = query.lower()
+    if not query:
+        return np.ones(len(index['row_refs']), dtype=bool)
+    hit = np.zeros(len(index['refs']), dtype=bool)
+    hit[_prefix_refs(index, query) if prefix else _substring_refs(index, query)] = True
+    return hit[index['row_refs']]
+
+
+def highlights(ref: str, query: str, prefix: bool = False) -> list[list[int]]:
+    """[start, end) offsets of `query` in `ref`, ignoring case."""
+    lowered, query = ref.lower(), query.lower()
+    if not query:
+        return []
+    if prefix:
+        return [[0, len(query)]] if lowered.startswith(query) else []
+    spans, start = [], lowered.find(query)
+    while start >= 0:
+        spans.append([start, start + len(query)])
+        start = lowered.find(query, start + len(query))
+    return spans
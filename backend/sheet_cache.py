@@ -0,0 +1,173 @@
+"""
+Sheet Cache - parsed worksheet cells kept on disk between processor runs
+
+Every Electron action starts a fresh Python process, so a workbook parsed
+while the user is still assigning files would be parsed again by Process.
+cache_sheets() stores the raw cell rows of a sheet (what the Excel reader
+hands to pandas) under the file's fingerprint; read_sheet() is a drop-in for
+pd.read_excel(path, sheet_name=..., header=..., usecols=...) that builds the
+frame from those rows and only opens the workbook on a miss. A changed file
+gets a new fingerprint, so stale entries are never read; they are pruned
+oldest-first whenever an entry is written and the cache has grown past
+SHEET_CACHE_BYTES.
+
+The cells come from the reader behind pd.ExcelFile, which is not public
+API: requirements.txt pins the pandas versions it is known to work with,
+and should it change anyway the rows are taken from pd.read_excel instead.
+"""
+
+import hashlib
+import os
+import pickle
+
+import pandas as pd
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from layouts import file_fingerprint
+from storage import data_path
+from workbook import list_sheets
+
+
+SHEET_CACHE_DIR = 'sheet_cache'
+SHEET_CACHE_BYTES = 512 * 1024 * 1024
+
+# Cells of the sheet this process read last: {(fingerprint, sheet): rows}.
+# Only one sheet is kept - enough for a header scan followed by the real read
+# without holding every workbook of a run in memory.
+_memo = {}
+
+
+def _entry_path(fingerprint: str, sheet: str) -> str:
+    sheet_key = hashlib.sha1(sheet.encode('utf-8')).hexdigest()[:16]
+    return data_path(SHEET_CACHE_DIR, f"{fingerprint}-{sheet_key}.pkl")
+
+
+def _sheet_name(path: str, sheet) -> str:
+    if isinstance(sheet, int):
+        return list_sheets(path)[sheet]
+    return sheet
+
+
+def _store(entry: str, rows: list) -> None:
+    tmp_path = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, entry)
+
+
+def _load(entry: str) -> list | None:
+    try:
+        with open(entry, 'rb') as f:
+            rows = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+    return rows
+
+
+def prune(limit: int = SHEET_CACHE_BYTES) -> None:
+    """Drop the least recently used entries until the cache fits in `limit` bytes."""
+    directory = os.path.dirname(data_path(SHEET_CACHE_DIR, 'x'))
+    entries = []
+    for name in os.listdir(directory):
+        full = os.path.join(directory, name)
+        try:
+            st = os.stat(full)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, full))
+    total = sum(size for _, size, _ in entries)
+    for _, size, full in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(full)
+            total -= size
+        except OSError:
+            pass
+
+
+def _pooled(rows: list) -> list:
+    """Rows whose equal cells share one object.
+
+    References, localisations, units, dates and round quantities repeat on
+    most rows of a stock sheet; pickle stores a shared object once, so both
+    the cache file and the rows loaded back from it shrink. Cells are keyed
+    by type as well as value so 1, 1.0 and True stay distinct.
+    """
+    pool = {}
+    return [[v if v is None else pool.setdefault((v.__class__, v), v) for v in row] for row in rows]
+
+
+def _frame_cells(xl: pd.ExcelFile, name: str) -> list:
+    """Cell rows of a sheet as pd.read_excel(header=None) gives them, empty cells as None."""
+    frame = xl.parse(name, header=None).astype(object)
+    return frame.where(frame.notna(), None).values.tolist()
+
+
+def _parse_cells(path: str, sheets: list[str]) -> dict:
+    """Raw cell rows of `sheets`, opening the workbook once."""
+    with pd.ExcelFile(path) as xl:
+        cells = {}
+        for name in sheets:
+            try:
+                reader = xl._reader
+                rows = reader.get_sheet_data(reader.get_sheet_by_name(name), None)
+            except (AttributeError, TypeError):
+                rows = _frame_cells(xl, name)
+            cells[name] = _pooled(rows)
+        return cells
+
+
+def sheet_cells(path: str, sheet) -> list:
+    """Cell rows of a sheet, from this process, the disk cache, or the workbook."""
+    name = _sheet_name(path, sheet)
+    fingerprint = file_fingerprint(path)
+    key = (fingerprint, name)
+    if key in _memo:
+        return _memo[key]
+
+    entry = _entry_path(fingerprint, name)
+    rows = _load(entry) if os.path.exists(entry) else None
+    if rows is None:
+        rows = _parse_cells(path, [name])[name]
+        _store(entry, rows)
+        prune()
+    _memo.clear()
+    _memo[key] = rows
+    return rows
+
+
+def cache_sheets(path: str, sheets=None) -> list[str]:
+    """Parse and store the given sheets (all sheets by default); returns the names now cached."""
+    names = [_sheet_name(path, s) for s in sheets] if sheets is not None else list_sheets(path)
+    fingerprint = file_fingerprint(path)
+    missing = [n for n in dict.fromkeys(names) if not os.path.exists(_entry_path(fingerprint, n))]
+    if missing:
+        for name, rows in _parse_cells(path, missing).items():
+            _store(_entry_path(fingerprint, name), rows)
+        prune()
+    return names
+
+
+def read_sheet(path: str, sheet_name=0, header=0, usecols=None) -> pd.DataFrame:
+    """pd.read_excel(path, sheet_name=..., header=..., usecols=...) served from the sheet cache."""
+    if os.path.splitext(path)[1].lower() not in ('.xlsx', '.xlsm', '.xls'):
+        return pd.read_excel(path, sheet_name=sheet_name, header=header, usecols=usecols)
+
+    rows = sheet_cells(path, sheet_name)
+    if not rows:
+        return pd.DataFrame()
+    try:
+        # The parser reads rows without changing them; only the outer list is its own
+        parser = TextParser(list(rows), header=header, usecols=usecols, skip_blank_lines=False)
+        return parser.read()
+    except EmptyDataError:
+        return pd.DataFrame()
+    except Exception as err:
+        err.args = (f"{err.args[0]} (sheet: {sheet_name})", *err.args[1:])
+        raise err
@@ -0,0 +1,120 @@
+"""
+Stock Snapshots - per-reference stock of past months, keyed by (unit, month, year)
+
+Mags compares a month's stock with the stock of the month before, and
+stock_delta compares any unit's stock between two months. Rather than
+finding those workbooks by scanning folders and parsing them again on
+every run, each stock file is reduced once to its totals per reference (or
+per localisation and reference) and stored under SNAPSHOT_DIR as columns:
+the references, their localisations when the unit has them, and int64
+fixed-point quantities (see quantities). Reading a month back is one small file read, and
+any stored month can be compared with a later one.
+
+A snapshot remembers the fingerprint of the file it came from. It is
+parsed again when that file is still on disk but has changed; once the
+file is gone the snapshot is all that is left of that month and is used
+as-is.
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from layouts import file_fingerprint
+from storage import data_path
+
+
+SNAPSHOT_DIR = 'snapshots'
+
+
+def _snapshot_path(unit: str, month, year: int) -> str:
+    return data_path(SNAPSHOT_DIR, f"{unit}-{int(year):04d}-{int(month):02d}.pkl")
+
+
+def save_snapshot(unit: str, month, year: int, source: str, stock: pd.DataFrame, unreadable: int = 0) -> None:
+    """Store stock totals (columns Ref, Qty in fixed-point, optionally Localisation) read from `source`."""
+    entry = _snapshot_path(unit, month, year)
+    snapshot = {
+        'locs': stock['Localisation'].tolist() if 'Localisation' in stock.columns else None,
+        'refs': stock['Ref'].astype(str).tolist(),
+        'qty': stock['Qty'].to_numpy(dtype='int64'),
+        'unreadable': int(unreadable),
+        'source': os.path.abspath(source),
+        'fingerprint': file_fingerprint(source),
+    }
+    tmp_path = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, entry)
+
+
+def load_snapshot(unit: str, month, year: int) -> dict | None:
+    """The stored snapshot of a month, or None."""
+    try:
+        with open(_snapshot_path(unit, month, year), 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def stored_months(unit: str) -> list[tuple[int, int]]:
+    """(year, month) of every snapshot stored for a unit, oldest first."""
+    months = []
+    prefix = f"{unit}-"
+    for name in os.listdir(os.path.dirname(_snapshot_path(unit, 1, 2000))):
+        stem, ext = os.path.splitext(name)
+        if ext != '.pkl' or not stem.startswith(prefix):
+            continue
+        year, _, month = stem[len(prefix):].partition('-')
+        if year.isdigit() and month.isdigit():
+            months.append((int(year), int(month)))
+    return sorted(months)
+
+
+def snapshot_frame(snapshot: dict) -> pd.DataFrame:
+    columns = {}
+    if snapshot.get('locs') is not None:
+        columns['Localisation'] = pd.Series(snapshot['locs'], dtype='object')
+    columns['Ref'] = pd.Series(snapshot['refs'], dtype='string')
+    columns['Qty'] = np.asarray(snapshot['qty'], dtype='int64')
+    return pd.DataFrame(columns)
+
+
+def _current(snapshot: dict | None, path: str | None = None) -> bool:
+    """Whether a snapshot still describes its month: its file (or `path`) is unchanged or gone."""
+    if snapshot is None:
+        return False
+    path = path or snapshot['source']
+    if os.path.abspath(path) != snapshot['source']:
+        return False
+    if not os.path.exists(path):
+        return True
+    try:
+        return file_fingerprint(path) == snapshot['fingerprint']
+    except OSError:
+        return False
+
+
+def stored_stock(unit: str, month, year: int) -> tuple[pd.DataFrame, int] | None:
+    """Stock totals and unreadable count of a stored month, None when there is no usable snapshot."""
+    snapshot = load_snapshot(unit, month, year)
+    if not _current(snapshot):
+        return None
+    return snapshot_frame(snapshot), snapshot['unreadable']
+
+
+def stock_snapshot(unit: str, month, year: int, path: str, load) -> tuple[pd.DataFrame, int]:
+    """Stock totals of `path` as the (unit, month, year) snapshot.
+
+    load(path) -> (DataFrame with [Localisation,] Ref, Qty, unreadable count) only runs when
+    no snapshot of this exact file is stored yet.
+    """
+    snapshot = load_snapshot(unit, month, year)
+    if _current(snapshot, path):
+        return snapshot_frame(snapshot), snapshot['unreadable']
+    stock, unreadable = load(path)
+    save_snapshot(unit, month, year, path, stock, unreadable)
+    return stock, unreadable
+
@@ -0,0 +1,145 @@
+"""
+Stock Delta - stock-to-stock change between two months, for any unit
+
+Only Mags reconciles a month as previous stock + movements. stock_delta()
+gives every unit the same view: two stock snapshots (see snapshots) are
+joined per (localisation, reference) - or per reference for units whose
+stock has no localisations - and the change is Stock_Qty - Prev_Stock_Qty,
+in fixed-point like the rest of the reconciliation.
+
+cross_check() then compares each atelier's delta with the movement of that
+month: the ledger's rows dated within the month when the atelier's file is
+already ingested, otherwise the movement rows ('_movements') of one pass of
+the unit's processor, summed over the same dates. Undated rows count for the
+month either way, as ledger.movement_totals(only_month=True) counts them.
+Snapshots are far smaller than the movement ledgers, so the delta itself
+costs two small reads once the months are stored.
+"""
+
+import pandas as pd
+
+from ledger import ingested, movement_totals
+from quantities import comparison_summary, difference, fixed, join_quantities, quantity_records
+
+
+def month_before(month, year: int) -> tuple[str, int]:
+    m = int(month)
+    if m == 1:
+        return '12', int(year) - 1
+    return f"{m - 1:02d}", int(year)
+
+
+def _keys(frame: pd.DataFrame) -> list[str]:
+    return ['Localisation', 'Ref'] if 'Localisation' in frame.columns else ['Ref']
+
+
+def stock_delta(prev: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """Prev_Stock_Qty, Stock_Qty and Delta per key of two stock frames ([Localisation,] Ref, Qty)."""
+    keys = _keys(current)
+    if _keys(prev) != keys:
+        raise ValueError("Both stocks must be split by localisation, or neither")
+    prev = prev.rename(columns={'Qty': 'Prev_Stock_Qty'}).astype({key: 'string' for key in keys})
+    current = current.rename(columns={'Qty': 'Stock_Qty'}).astype({key: 'string' for key in keys})
+    delta = join_quantities(prev, current, on=keys)
+    delta['Delta'] = delta['Stock_Qty'] - delta['Prev_Stock_Qty']
+    return delta.sort_values(keys, ignore_index=True)
+
+
+def atelier_localisations(args: dict, localisations) -> list[str] | None:
+    """Localisations (or stock sheets) an atelier's stock is read from.
+
+    An atelier that names none reads the whole stock except its excluded
+    localisations. None when the atelier filters on pairs of columns, which
+    a delta keyed by one localisation cannot express.
+    """
+    spec = args.get('localisation') or args.get('stock_sheet')
+    if isinstance(spec, dict):
+        spec = spec.get('sheets')
+    if not spec:
+        excluded = {str(x).strip() for x in args.get('exclude_localisations') or []}
+        return [loc for loc in localisations if str(loc).strip() not in excluded]
+
+    names = []
+    for item in spec if isinstance(spec, (list, tuple)) else [spec]:
+        if isinstance(item, tuple):
+            return None
+        names.extend(item if isinstance(item, list) else [item])
+    return [str(name) for name in names]
+
+
+def atelier_delta(delta: pd.DataFrame, localisations) -> pd.DataFrame:
+    """Delta per reference ('Ref', 'Prev_Stock_Qty', 'Stock_Qty', 'Delta') over `localisations`."""
+    if 'Localisation' in delta.columns:
+        delta = delta[delta['Localisation'].isin(list(localisations))]
+    return delta.groupby('Ref')[['Prev_Stock_Qty', 'Stock_Qty', 'Delta']].sum().reset_index()
+
+
+def atelier_stock(positions: pd.DataFrame, localisations) -> pd.DataFrame:
+    """Stock per reference ('Ref', 'Stock_Qty') of a stock frame ([Localisation,] Ref, Qty) over `localisations`."""
+    if 'Localisation' in positions.columns:
+        positions = positions[positions['Localisation'].isin(list(localisations))]
+    return positions.groupby('Ref')['Qty'].sum().rename('Stock_Qty').reset_index()
+
+
+def month_movement(movements: pd.DataFrame, month, year: int) -> pd.DataFrame:
+    """Movement per reference ('Ref', 'Calc_Mov_Qty') of the movement rows dated within the month, or undated."""
+    start = pd.Timestamp(int(year), int(month), 1)
+    dates = movements['Date']
+    rows = movements[dates.isna() | ((dates >= start) & (dates < start + pd.offsets.MonthBegin()))]
+    totals = rows.groupby(rows['Ref'].astype('string'))['Qty'].sum().astype('int64')
+    return totals.rename('Calc_Mov_Qty').rename_axis('Ref').reset_index()
+
+
+def cross_check(unit: str, processor, delta: pd.DataFrame, stock_file: dict, matched_files: dict, month, year: int) -> dict:
+    """Compare every matched atelier's stock delta with its movement of `month`.
+
+    Per atelier the rows are 'Ref', 'Delta', 'Calc_Mov_Qty' (the month's
+    movement) and 'Difference' = Delta - Calc_Mov_Qty, split into matches
+    and discrepancies as a reconciliation result is.
+    """
+    sheet_args = getattr(processor, 'sheet_args', {})
+    localisations = delta['Localisation'].dropna().unique().tolist() if 'Localisation' in delta.columns else []
+    tolerance = fixed(getattr(processor, 'MATCH_TOLERANCE', 0.0))
+
+    in_ledger = {atelier for atelier, file_info in matched_files.items() if ingested(unit, atelier, file_info['path'])}
+    to_process = {atelier: file_info for atelier, file_info in matched_files.items() if atelier not in in_ledger}
+    current = processor.process_all(stock_file, to_process, month) if to_process else {}
+
+    checks = {}
+    for atelier in matched_files:
+        keys = atelier_localisations(sheet_args.get(atelier, {}), localisations)
+        if keys is None:
+            checks[atelier] = {'error': 'Stock delta is not split the way this atelier reads its stock',
+                               'matches': [], 'discrepancies': []}
+            continue
+        if atelier in in_ledger:
+            result = {}
+            movement = movement_totals(unit, atelier, month, year, only_month=True)
+        else:
+            result = current.get(atelier) or {}
+            error = result.get('error') or current.get('_error')
+            if not error and result.get('_movements') is None:
+                error = 'The movement rows of this file are not kept, so its month cannot be cross-checked'
+            if error:
+                checks[atelier] = {'error': error, 'matches': [], 'discrepancies': []}
+                continue
+            movement = month_movement(result['_movements'], month, year)
+
+        comparison_df = join_quantities(atelier_delta(delta, keys)[['Ref', 'Delta']], movement)
+        comparison_df['Difference'] = difference(comparison_df['Delta'], comparison_df['Calc_Mov_Qty'])
+
+        discrepancies = comparison_df[comparison_df['Difference'].abs() > tolerance].sort_values(by='Difference', ascending=False)
+        matches = comparison_df[comparison_df['Difference'].abs() <= tolerance]
+        checks[atelier] = {
+            'matches': quantity_records(matches),
+            'discrepancies': quantity_records(discrepancies),
+            '_summary': comparison_summary(matches, discrepancies),
+            'unparsedQuantities': result.get('unparsedQuantities', 0),
+        }
+    return checks
+
+
+def delta_records(delta: pd.DataFrame) -> list[dict]:
+    """Rows whose stock changed, largest change first, for the UI."""
+    changed = delta[delta['Delta'] != 0]
+    return quantity_records(changed.reindex(changed['Delta'].abs().sort_values(ascending=False).index))
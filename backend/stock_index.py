@@ -0,0 +1,148 @@
+"""
+Stock Index - per-localisation stock aggregates built once per stock file
+
+Units that split one stock sheet across ateliers by localisation used to
+filter (and copy) the whole stock frame for every atelier, then group it by
+reference. build_stock_index() groups the stock by (localisation key,
+reference) once; stock_aggregate() then gives an atelier its 'Ref' /
+'Stock_Qty' frame by dictionary lookup, summing the parts only when the
+atelier spans several localisations.
+
+retained_index() keeps a built index on disk under the stock file's
+fingerprint, so a later run on the same stock file (a full run, or one
+atelier processed again) loads it instead of building it from the sheet.
+"""
+
+import os
+import pickle
+
+import pandas as pd
+
+from layouts import file_fingerprint
+from quantities import UNREADABLE_COL
+from storage import data_path
+
+
+STOCK_INDEX_DIR = 'stock_indexes'
+# Indexes kept, the least recently used are dropped first
+STOCK_INDEX_KEEP = 12
+
+
+def build_stock_index(stock_df: pd.DataFrame, key_cols, ref_col, qty_col) -> dict:
+    """Sum `qty_col` per (key, reference) once.
+
+    `key_cols` is one column or a list of columns; keys are compared as
+    strings, so a multi-column key is looked up as a tuple of strings. An
+    empty list indexes the whole stock under the single key None. Keys and
+    references may be categoricals (see as_categories). Rows with
+    a missing key or reference are left out, as a filter on the key followed
+    by a groupby on the reference would leave them out. When the loader
+    flagged unreadable quantities (quantities.UNREADABLE_COL) they are
+    counted per key as well.
+    """
+    key_cols = [key_cols] if isinstance(key_cols, str) else list(key_cols)
+    refs = stock_df[ref_col].astype('string')
+    flags = stock_df[UNREADABLE_COL] if UNREADABLE_COL in stock_df.columns else None
+    if not key_cols:
+        grouped = stock_df[qty_col].groupby(refs).sum()
+        unreadable = {None: int(flags[refs.notna()].sum())} if flags is not None else {}
+        return {'parts': {None: grouped} if not grouped.empty else {}, 'empty': grouped.iloc[:0],
+                'unreadable': unreadable}
+
+    keys = [stock_df[col].astype('string') for col in key_cols]
+    grouped = stock_df[qty_col].groupby(keys + [refs]).sum()
+
+    levels = list(range(len(key_cols)))
+    parts = {}
+    if not grouped.empty:
+        for key, part in grouped.groupby(level=levels if len(levels) > 1 else 0, sort=False):
+            parts[key] = part.droplevel(levels)
+
+    unreadable = {}
+    if flags is not None:
+        counts = flags[refs.notna()].groupby([k[refs.notna()] for k in keys]).sum()
+        unreadable = {key: int(n) for key, n in counts.items() if n}
+    return {'parts': parts, 'empty': grouped.iloc[:0].droplevel(levels), 'unreadable': unreadable}
+
+
+def as_categories(frame: pd.DataFrame, columns) -> pd.DataFrame:
+    """Store `columns` of a loaded frame as categoricals, in place.
+
+    A stock sheet repeats a few hundred localisations and a few thousand
+    references over every row; as categories each row costs a small integer
+    code and each distinct value is held once.
+    """
+    for col in dict.fromkeys(c for c in columns if c is not None):
+        frame[col] = frame[col].astype('category')
+    return frame
+
+
+def stock_aggregate(stock_index: dict, keys) -> pd.DataFrame:
+    """Stock quantity per reference ('Ref', 'Stock_Qty') over `keys`.
+
+    Quantities are summed as given; loaders pass fixed-point quantities
+    (quantities.read_quantities), so the sums are exact.
+    """
+    parts = stock_index['parts']
+    found = [parts[key] for key in dict.fromkeys(keys) if key in parts]
+    if not found:
+        agg = stock_index['empty']
+    elif len(found) == 1:
+        agg = found[0]
+    else:
+        agg = pd.concat(found).groupby(level=0).sum()
+
+    return agg.rename_axis('Ref').reset_index(name='Stock_Qty')
+
+
+def stock_unreadable(stock_index: dict, keys) -> int:
+    """Stock cells over `keys` whose quantity could not be read."""
+    unreadable = stock_index.get('unreadable', {})
+    return sum(unreadable.get(key, 0) for key in dict.fromkeys(keys))
+
+
+def index_positions(stock_index: dict) -> tuple[pd.DataFrame, int]:
+    """Every (key, reference) of an index as 'Localisation' / 'Ref' / 'Qty' rows, and its unreadable count."""
+    parts = stock_index['parts']
+    if parts:
+        positions = pd.concat(parts.values(), keys=list(parts), names=['Localisation', 'Ref'])
+    else:
+        positions = stock_index['empty'].rename_axis('Ref')
+        positions.index = pd.MultiIndex.from_arrays([positions.index[:0].astype('string'), positions.index],
+                                                    names=['Localisation', 'Ref'])
+    return positions.reset_index(name='Qty'), sum(stock_index.get('unreadable', {}).values())
+
+
+def stock_keys(stock_index: dict) -> list:
+    """Every key that has stock."""
+    return list(stock_index['parts'])
+
+
+def retained_index(path: str, build):
+    """build(path), kept on disk under the file's fingerprint and the builder's name.
+
+    A changed file gets a new fingerprint, so a stale index is never read.
+    """
+    entry = data_path(STOCK_INDEX_DIR, f"{build.__module__}.{build.__name__}-{file_fingerprint(path)}.pkl")
+    try:
+        with open(entry, 'rb') as f:
+            index = pickle.load(f)
+        os.utime(entry)
+        return index
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    index = build(path)
+    tmp_path = f"{entry}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, entry)
+
+    directory = os.path.dirname(entry)
+    entries = sorted((e for e in os.scandir(directory) if e.name.endswith('.pkl')), key=lambda e: e.stat().st_mtime)
+    for stale in entries[:-STOCK_INDEX_KEEP]:
+        try:
+            os.remove(stale.path)
+        except OSError:
+            pass
+    return index
@@ -0,0 +1,38 @@
+"""
+Storage - location of the backend's persistent files
+
+Electron sets STOCKAPP_DATA_DIR to the app's userData folder; when the
+processor is run by hand it falls back to ~/.stockapp.
+"""
+
+import json
+import os
+
+
+def data_dir() -> str:
+    path = os.environ.get('STOCKAPP_DATA_DIR') or os.path.join(os.path.expanduser('~'), '.stockapp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_path(*parts: str) -> str:
+    path = os.path.join(data_dir(), *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def load_json(name: str, default):
+    try:
+        with open(data_path(name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(name: str, data) -> None:
+    """Write atomically so a crashed run never leaves a truncated file behind."""
+    path = data_path(name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
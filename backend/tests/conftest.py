@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by name, as processor.py runs them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Every test keeps its runs, caches and ledger in a directory of its own."""
+    path = tmp_path / 'data'
+    monkeypatch.setenv('STOCKAPP_DATA_DIR', str(path))
+    return path
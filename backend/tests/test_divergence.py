@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+from divergence import first_divergence
+from quantities import fixed
+from runs import retain_run
+from snapshots import save_snapshot
+
+
+MOVEMENTS = [
+    ('A', '2025-01-10', 10, 2), ('A', '2025-02-05', 5, 3), ('A', '2025-03-03', 2, 4),
+    ('B', '2025-01-02', 3, 5),
+    ('D', '2025-01-10', 1, 6), ('D', '2025-03-02', 1, 7), ('D', None, 0.5, 8),
+]
+# Month-end stock: A agrees in January only, B never, C (no movement rows) always, D within 0.02
+SNAPSHOTS = {('01', 2025): {'A': 10, 'B': 0, 'C': 4, 'D': 1.01},
+             ('02', 2025): {'A': 12, 'B': 0, 'C': 4, 'D': 1.01}}
+
+
+def _row(ref, mov, difference):
+    return {'Ref': ref, 'Stock_Qty': mov + difference, 'Calc_Mov_Qty': mov, 'Difference': difference}
+
+
+@pytest.fixture
+def run_id(tmp_path):
+    for (month, year), stock in SNAPSHOTS.items():
+        source = tmp_path / f"STOCK {month}-{year}.xlsx"
+        source.write_bytes(b'stock')
+        save_snapshot('Oran', month, year, str(source),
+                      pd.DataFrame({'Ref': list(stock), 'Qty': [fixed(qty) for qty in stock.values()]}))
+    movements = pd.DataFrame({
+        'Ref': pd.Series([ref for ref, *_ in MOVEMENTS], dtype='string'),
+        'Date': pd.to_datetime([date for _, date, *_ in MOVEMENTS]),
+        'Qty': [fixed(qty) for *_, qty, _ in MOVEMENTS],
+        'Sheet': 'MOV',
+        'Row': [row for *_, row in MOVEMENTS],
+    })
+    results = {'magasin': {'matches': [],
+                           'discrepancies': [_row('A', 17, -5), _row('B', 3, -3), _row('D', 2.5, -1.5), _row('C', 4, 1)]}}
+    return retain_run('Oran', '03', results, movements={'magasin': movements})
+
+
+def _by_ref(result):
+    return {row['Ref']: (row['Since'], row['FirstDivergence'], row['Row']) for row in result['ateliers']['magasin']['rows']}
+
+
+def test_first_divergence_after_the_last_agreeing_month_end(run_id):
+    result = first_divergence(run_id, {}, year=2025)
+
+    assert result['checkpoints'] == ['2025-01-31', '2025-02-28']
+    assert [row['Ref'] for row in result['ateliers']['magasin']['rows']] == ['A', 'B', 'D', 'C']
+    assert _by_ref(result) == {
+        'A': ('2025-01-31', '2025-02-05', 3),
+        'B': (None, '2025-01-02', 5),
+        'C': ('2025-02-28', None, None),
+        'D': (None, '2025-01-10', 6),
+    }
+
+
+def test_tolerance_is_the_units_match_tolerance(run_id):
+    rows = _by_ref(first_divergence(run_id, {}, atelier='magasin', year=2025, tolerance=0.02))
+
+    assert rows['D'] == ('2025-02-28', '2025-03-02', 7)
+    assert rows['A'] == ('2025-01-31', '2025-02-05', 3)
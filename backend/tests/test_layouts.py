@@ -0,0 +1,64 @@
+import openpyxl
+
+from layouts import build_layout, needed_columns, recall_layout, remember_layouts, trusted_layout
+
+
+def _stock_book(path, title, header=('Code', 'Désignation', 'Qté', 'Date'), blank_rows=1):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'MOUV'
+    sheet.append([title])
+    for _ in range(blank_rows):
+        sheet.append([])
+    sheet.append(list(header))
+    sheet.append(['A1', 'Farine', 12, '2024-03-04'])
+    book.save(path)
+    return str(path)
+
+
+def _remember(path):
+    layout = build_layout(path, 'MOUV', 2, 'Code', 'Qté', 'Date')
+    remember_layouts('Oran', {'Pâtisserie': (path, layout, ['Code', 'Qté'])})
+
+
+def test_next_month_with_a_new_title_is_recalled(tmp_path):
+    _remember(_stock_book(tmp_path / 'mars.xlsx', 'Etat du stock mars 2024'))
+
+    april = _stock_book(tmp_path / 'avril.xlsx', 'Etat du stock avril 2024')
+    layout = recall_layout('Oran', 'Pâtisserie', april)
+
+    assert layout['remembered']
+    assert layout['sheet'] == 'MOUV'
+    assert layout['headerRow'] == 2
+    assert layout['usecols'] == [0, 2, 3]
+
+
+def test_moved_or_renamed_header_is_detected_again(tmp_path):
+    _remember(_stock_book(tmp_path / 'mars.xlsx', 'Etat du stock mars 2024'))
+
+    moved = _stock_book(tmp_path / 'moved.xlsx', 'Etat du stock avril 2024', blank_rows=2)
+    renamed = _stock_book(tmp_path / 'renamed.xlsx', 'Etat du stock avril 2024',
+                          header=('Code', 'Désignation', 'Quantité', 'Date'))
+
+    assert recall_layout('Oran', 'Pâtisserie', moved) is None
+    assert recall_layout('Oran', 'Pâtisserie', renamed) is None
+    assert recall_layout('Oran', 'Autre atelier', moved) is None
+
+
+def test_verified_layout_is_trusted_until_the_file_changes(tmp_path):
+    path = _stock_book(tmp_path / 'mars.xlsx', 'Etat du stock mars 2024')
+    layout = build_layout(path, 'MOUV', 2, 'Code', 'Qté')
+
+    assert trusted_layout(layout, path) == layout
+    assert trusted_layout(layout, path, sheet_override='MOUV') == layout
+    assert trusted_layout(layout, path, sheet_override='STC') is None
+    assert trusted_layout({**layout, 'headerRow': None}, path) is None
+
+    _stock_book(path, 'Etat du stock mars 2024 (corrigé)')
+    assert trusted_layout(layout, path) is None
+
+
+def test_needed_columns_refuses_a_suffixed_repeated_label():
+    assert needed_columns(['Code', None, 'Qté', 'Date valeur'], ['code', 'QTÉ']) == [0, 2, 3]
+    assert needed_columns(['Code', 'Qté', 'Qté'], ['Qté']) == [1]
+    assert needed_columns(['Code', 'Qté', 'Qté'], ['Qté.1']) is None
@@ -0,0 +1,59 @@
+import pandas as pd
+
+import ledger
+from quantities import fixed
+
+
+def _rows(*rows):
+    return pd.DataFrame([(ref, date, fixed(qty)) for ref, date, qty in rows], columns=['Ref', 'Date', 'Qty'])
+
+
+def _workbook(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _totals(month):
+    totals = ledger.movement_totals('Fath2', 'secondaire', month, 2025)
+    return dict(zip(totals['Ref'], totals['Calc_Mov_Qty']))
+
+
+def test_reingest_after_overlapping_source_keeps_shared_rows(tmp_path):
+    r1, r2, r3 = ('R1', '2025-02-03', 5), ('R2', '2025-02-10', 2), ('R3', '2025-03-04', 1)
+    feb = _workbook(tmp_path, 'feb.xlsx', b'feb')
+    mar = _workbook(tmp_path, 'mar.xlsx', b'mar')
+
+    assert ledger.ingest('Fath2', 'secondaire', feb, _rows(r1, r2)) == (2, 0)
+    assert ledger.ingest('Fath2', 'secondaire', mar, _rows(r1, r2, r3)) == (1, 0)
+
+    # feb.xlsx corrected: R2 is gone from it, but mar.xlsx still has it
+    _workbook(tmp_path, 'feb.xlsx', b'feb, corrected')
+    assert not ledger.ingested('Fath2', 'secondaire', feb)
+    assert ledger.ingest('Fath2', 'secondaire', feb, _rows(r1)) == (0, 0)
+    assert _totals(3) == {'R1': fixed(5), 'R2': fixed(2), 'R3': fixed(1)}
+
+    # Once no source holds R2 it goes
+    assert ledger.ingest('Fath2', 'secondaire', mar, _rows(r1, r3)) == (0, 1)
+    assert _totals(3) == {'R1': fixed(5), 'R3': fixed(1)}
+
+
+def test_same_file_name_in_other_folders_are_separate_sources(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = _workbook(tmp_path, 'a/mov.xlsx', b'a')
+    second = _workbook(tmp_path, 'b/mov.xlsx', b'b')
+
+    ledger.ingest('Fath2', 'secondaire', first, _rows(('R1', '2025-01-02', 1)))
+    ledger.ingest('Fath2', 'secondaire', second, _rows(('R2', '2025-01-02', 2)))
+
+    assert _totals(1) == {'R1': fixed(1), 'R2': fixed(2)}
+    assert ledger.ingested('Fath2', 'secondaire', first)
+
+
+def test_undated_rows_count_in_every_month(tmp_path):
+    path = _workbook(tmp_path, 'mov.xlsx', b'mov')
+    ledger.ingest('Fath2', 'secondaire', path, _rows(('R1', None, 3), ('R1', '2025-04-01', 1)))
+
+    assert _totals(3) == {'R1': fixed(3)}
+    assert _totals(4) == {'R1': fixed(4)}
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from movements import (balances_through, key_positions, movement_detail, movement_index, movement_timeline,
+                       reference_history)
+from quantities import QTY_SCALE, fixed
+
+
+@pytest.fixture
+def detail():
+    rng = np.random.default_rng(11)
+    size = 400
+    dates = pd.Series(pd.to_datetime('2025-01-01') + pd.to_timedelta(rng.integers(0, 90, size), unit='D'))
+    dates[rng.random(size) < 0.1] = pd.NaT
+    return pd.DataFrame({
+        'Ref': pd.Series(rng.choice(['A 1', 'a  1', 'B-2', 'C', 'D 40'], size), dtype='string'),
+        'Date': dates,
+        'Qty': rng.integers(-20, 20, size) * fixed(0.5),
+        'Sheet': rng.choice(['MOV', 'MOV2'], size),
+        'Row': np.arange(size) + 2,
+    })
+
+
+def test_detail_keeps_sheet_row_numbers():
+    mov = pd.DataFrame({'Code': ['A', None, 'B'], 'Qté': [fixed(1), fixed(2), fixed(-3)], 'Date': ['2025-01-03', None, 'x']})
+
+    detail = movement_detail(mov, 'Code', 'Qté', 'Date', 'MOV', first_row=4)
+
+    assert detail['Ref'].tolist() == ['A', 'B']
+    assert detail['Row'].tolist() == [4, 6]
+    assert detail['Date'].isna().tolist() == [False, True]
+
+
+def test_history_lists_a_reference_in_date_order(detail):
+    index = movement_index(detail)
+
+    history = reference_history(index, 'A 1')
+
+    # Sheets are ordered as they first appear
+    rows = detail.assign(SheetOrder=pd.factorize(detail['Sheet'])[0])
+    rows = rows[rows['Ref'].str.split().str.join(' ').str.lower() == 'a 1']
+    dated = rows[rows['Date'].notna()].sort_values(['Date', 'SheetOrder', 'Row'])
+    undated = rows[rows['Date'].isna()].sort_values(['SheetOrder', 'Row'])
+    expected = pd.concat([dated, undated])
+    assert [row['Row'] for row in history['rows']] == expected['Row'].tolist()
+    assert [row['Cumulative'] for row in history['rows']] == (expected['Qty'].cumsum() / QTY_SCALE).tolist()
+    assert history['total'] == rows['Qty'].sum() / QTY_SCALE
+    assert reference_history(index, 'missing')['rows'] == []
+
+
+def test_balances_match_a_filtered_sum(detail):
+    index = movement_index(detail)
+    timeline = movement_timeline(index)
+    refs = ['a 1', 'B-2', 'C', 'D 40', 'missing']
+    positions = key_positions(index, refs)
+
+    for day in pd.to_datetime(['2024-12-31', '2025-01-31', '2025-02-15', '2025-03-31']):
+        balances = balances_through(index, timeline, positions, (day - pd.Timestamp(0)).days)
+        keys = detail['Ref'].str.split().str.join(' ').str.lower()
+        upto = detail[detail['Date'].notna() & (detail['Date'] <= day)]
+        expected = [upto[keys[upto.index] == ref.lower()]['Qty'].sum() for ref in refs]
+        assert balances.tolist() == expected
@@ -0,0 +1,15 @@
+from processor_oran import _movement_agg
+from quantities import fixed
+
+
+def test_csv_header_below_separator_only_line(tmp_path):
+    path = tmp_path / 'movement.csv'
+    path.write_text('Mouvements janvier;;;\n;;;\nDate;REFERENCE;Q;X\n'
+                    '2025-01-02;R1;5;a\n2025-01-03;R1;2,5;b\n2025-01-04;R2;1;c\n', encoding='utf-8')
+
+    mov_agg, movements, unreadable, error = _movement_agg(str(path), [], None, 1)
+
+    assert error is None
+    assert unreadable == 0
+    assert mov_agg.set_index('Ref')['Calc_Mov_Qty'].to_dict() == {'R1': fixed(7.5), 'R2': fixed(1)}
+    assert movements['Row'].tolist() == [4, 5, 6]
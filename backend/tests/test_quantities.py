@@ -0,0 +1,16 @@
+import pandas as pd
+
+from quantities import difference, fixed, read_quantities
+
+
+def test_cells_with_more_decimals_add_up():
+    qty, unreadable = read_quantities(pd.Series([0.005] * 100))
+
+    assert not unreadable.any()
+    assert difference(fixed(0.5), qty.sum()) == 0
+    assert difference(qty.sum(), 0) == fixed(0.5)
+
+
+def test_difference_is_compared_at_hundredths():
+    assert difference(fixed(1.004), fixed(1)) == 0
+    assert difference(fixed(1.006), fixed(1)) == fixed(0.01)
@@ -0,0 +1,63 @@
+import openpyxl
+
+from read_plan import plan_reads, run_plan, shared_value
+
+
+SHEET_ARGS = {
+    'bonda': {'sheet_name': ['ATELLIER COUATE']},
+    'semi fini': {'sheet_name': ['ATELLIER COUATE']},
+    'tissage': {'sheet_name': ['TISSAGE', 0]},
+    'mixte': {'sheet_name': [['ATELLIER COUATE', 'TISSAGE']]},
+}
+
+
+def _workbook(path, *sheets):
+    book = openpyxl.Workbook()
+    book.active.title = sheets[0]
+    for name in sheets[1:]:
+        book.create_sheet(name)
+    book.save(path)
+    return {'path': str(path)}
+
+
+def test_ateliers_reading_one_sheet_share_a_group(tmp_path):
+    shared_file = _workbook(tmp_path / 'mov.xlsx', 'ATELLIER COUATE', 'TISSAGE')
+    matched = {'bonda': shared_file, 'tissage': shared_file, 'semi fini': dict(shared_file), 'mixte': shared_file}
+
+    groups = plan_reads(SHEET_ARGS, matched)
+
+    assert [(group['sheet'], group['ateliers']) for group in groups] == [
+        ('ATELLIER COUATE', ['bonda', 'semi fini']),
+        ('TISSAGE', ['tissage']),
+        (None, ['mixte']),
+    ]
+
+
+def test_sheet_override_and_missing_sheet_get_their_own_group(tmp_path):
+    shared_file = _workbook(tmp_path / 'mov.xlsx', 'ATELLIER COUATE', 'TISSAGE')
+    other_file = _workbook(tmp_path / 'other.xlsx', 'Sheet1')
+    matched = {'bonda': shared_file, 'semi fini': shared_file, 'tissage': other_file}
+
+    groups = plan_reads(SHEET_ARGS, matched, overrides={'semi fini': {'sheetName': 'TISSAGE'}})
+
+    assert [(group['sheet'], group['ateliers']) for group in groups] == [
+        ('ATELLIER COUATE', ['bonda']),
+        ('TISSAGE', ['semi fini']),
+        ('Sheet1', ['tissage']),
+    ]
+
+
+def test_run_plan_computes_a_shared_sheet_once(tmp_path):
+    shared_file = _workbook(tmp_path / 'mov.xlsx', 'ATELLIER COUATE', 'TISSAGE')
+    matched = {'tissage': shared_file, 'bonda': shared_file, 'semi fini': shared_file}
+    parsed = []
+
+    def process(atelier, file_info, shared):
+        sheet = shared_value(shared, 'sheet', lambda: parsed.append(atelier) or len(parsed))
+        return {'sheet': sheet}
+
+    results = run_plan(SHEET_ARGS, matched, process)
+
+    assert list(results) == ['tissage', 'bonda', 'semi fini']
+    assert parsed == ['tissage', 'bonda']
+    assert results['bonda'] == results['semi fini'] == {'sheet': 2}
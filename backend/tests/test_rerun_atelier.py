@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import openpyxl
+
+from processor import process_files, process_run_atelier, run_inputs, take_movements
+from runs import reference_movements, restore_run, retain_run
+
+
+def _stock(path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'MOUV'
+    sheet.append(['DATE', 'REF', 'QUANTITE', 'LOCALISATION'])
+    for ref, qty, localisation in [('A', 10, 'ATELIER COUTURE FEMME'), ('C', 3, "MAGASIN PRINCIPAL UNITE M'DOUKEL"),
+                                   ('A', 1, "MAGASIN PRINCIPAL UNITE M'DOUKEL")]:
+        sheet.append([datetime(2025, 3, 31), ref, qty, localisation])
+    book.save(path)
+    return str(path)
+
+
+def _movements(path, rows):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'MOV'
+    sheet.append([])
+    sheet.append(['DATE', 'REFERENCE', 'STOCK'])
+    for date, ref, qty in rows:
+        sheet.append([date, ref, qty])
+    book.save(path)
+    return str(path)
+
+
+def test_rerun_patches_one_atelier_of_the_run(tmp_path):
+    stock_file = {'path': _stock(tmp_path / 'stock.xlsx')}
+    mov = _movements(tmp_path / 'mov.xlsx', [(datetime(2025, 1, 3), 'C', 3), (datetime(2025, 2, 4), 'A', 2)])
+    matched = {'magasin': {'path': mov}}
+    results = process_files('Mdoukal', stock_file, matched, '03')
+    run_id = retain_run('Mdoukal', '03', results, inputs=run_inputs(stock_file, matched), movements=take_movements(results))
+    assert [row['Ref'] for row in restore_run(run_id)['results']['magasin']['discrepancies']] == ['A']
+
+    # The corrected movement file, at the path the run recorded
+    _movements(tmp_path / 'mov.xlsx', [(datetime(2025, 1, 3), 'C', 3), (datetime(2025, 2, 4), 'A', 1)])
+    rerun = process_run_atelier(run_id, 'magasin')
+
+    fresh = process_files('Mdoukal', stock_file, matched, '03')['magasin']
+    restored = restore_run(run_id)['results']['magasin']
+    assert rerun['result']['discrepancies'] == restored['discrepancies'] == fresh['discrepancies'] == []
+    assert restored['matches'] == fresh['matches']
+    assert rerun['summary']['discrepancies'] == 0
+    assert [row['Qty'] for row in reference_movements(run_id, 'magasin', 'A')['rows']] == [1.0]
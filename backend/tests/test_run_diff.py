@@ -0,0 +1,43 @@
+import pytest
+
+from run_diff import diff_runs
+from runs import retain_run
+
+
+def _row(ref, difference):
+    return {'Ref': ref, 'Stock_Qty': difference, 'Calc_Mov_Qty': 0.0, 'Difference': difference}
+
+
+def _run(unit, ateliers):
+    return retain_run(unit, '01', {atelier: {'matches': [_row(ref, 0.0) for ref in matches],
+                                             'discrepancies': [_row(ref, d) for ref, d in discrepancies]}
+                                   for atelier, (matches, discrepancies) in ateliers.items()})
+
+
+def test_discrepancies_are_sorted_into_new_resolved_and_changed():
+    base = _run('Oran', {'magasin': (['N1'], [('R1', 4.0), ('C1', 1.0), ('c1 ', 0.5), ('U1', 2.0), ('S1', -1.0)])})
+    later = _run('Oran', {'magasin': (['R1'], [('N1', 3.0), ('N2', -0.25), ('C1', -1.5), ('U1', 2.0), ('s1', -1.0)])})
+
+    diff = diff_runs(base, later)['ateliers']['magasin']
+
+    assert diff['new'] == [
+        {'Ref': 'N1', 'Prev_Difference': 0.0, 'Difference': 3.0, 'Change': 3.0, 'Matched': True},
+        {'Ref': 'N2', 'Prev_Difference': 0.0, 'Difference': -0.25, 'Change': -0.25, 'Matched': False},
+    ]
+    assert diff['resolved'] == [{'Ref': 'R1', 'Prev_Difference': 4.0, 'Difference': 0.0, 'Change': -4.0, 'Matched': True}]
+    # Spacing and case are ignored, and the later run's spelling is shown
+    assert diff['changed'] == [{'Ref': 'C1', 'Prev_Difference': 1.5, 'Difference': -1.5, 'Change': -3.0}]
+    assert diff['unchanged'] == 2
+
+
+def test_ateliers_missing_from_a_run_and_other_units():
+    base = _run('Oran', {'magasin': ([], []), 'couture': ([], [('A', 1.0)])})
+    later = _run('Oran', {'magasin': ([], [('A', 1.0)])})
+
+    ateliers = diff_runs(base, later)['ateliers']
+    assert ateliers['couture']['error'] == 'Atelier is not in both runs'
+    assert [row['Ref'] for row in ateliers['magasin']['new']] == ['A']
+    assert list(diff_runs(base, later, atelier='magasin')['ateliers']) == ['magasin']
+
+    with pytest.raises(ValueError):
+        diff_runs(base, _run('Mags', {}))
@@ -0,0 +1,107 @@
+import pandas as pd
+import pytest
+
+from quantities import fixed
+from runs import edit_results, list_runs, query_results, reference_movements, replace_atelier, restore_run, retain_run, run_exists
+
+
+def _row(ref, stock, mov):
+    return {'Ref': ref, 'Stock_Qty': stock, 'Calc_Mov_Qty': mov, 'Difference': stock - mov}
+
+
+# As a processor hands them back: discrepancies by signed Difference, largest first
+RESULTS = {
+    'magasin': {
+        'matches': [_row('M1', 5.0, 5.0), _row('M2', 1.0, 1.0)],
+        'discrepancies': [_row('D1', 9.0, 8.0), _row('D2', 3.0, 3.5), _row('D3', 0.0, 20.0)],
+        'unparsedQuantities': 2,
+    },
+    'couture': {'error': 'Could not find sheet STC', 'matches': [], 'discrepancies': []},
+}
+
+MOVEMENTS = pd.DataFrame({
+    'Ref': pd.Series(['D1', 'D1', 'D3'], dtype='string'),
+    'Date': pd.to_datetime(['2025-01-10', '2025-01-02', None]),
+    'Qty': [fixed(5), fixed(3), fixed(20)],
+    'Sheet': 'MOV',
+    'Row': [4, 2, 3],
+})
+
+
+@pytest.fixture
+def run_id():
+    return retain_run('Mdoukal', '01', RESULTS, inputs={'month': '01'}, movements={'magasin': MOVEMENTS})
+
+
+def test_restore_keeps_the_run_order(run_id):
+    restored = restore_run(run_id)
+    magasin = restored['results']['magasin']
+
+    assert [row['Ref'] for row in magasin['discrepancies']] == ['D1', 'D2', 'D3']
+    assert [row['Ref'] for row in magasin['matches']] == ['M1', 'M2']
+    assert magasin['unparsedQuantities'] == 2
+    assert restored['results']['couture']['error'] == 'Could not find sheet STC'
+    assert restored['unit'] == 'Mdoukal' and restored['inputs'] == {'month': '01'}
+
+
+def test_restore_top_k_keeps_the_largest_differences(run_id):
+    magasin = restore_run(run_id, top_k=2)['results']['magasin']
+
+    assert [row['Ref'] for row in magasin['discrepancies']] == ['D3', 'D1']
+    assert magasin['matches'] == []
+    assert magasin['partial'] == {'matches': 2, 'discrepancies': 3}
+
+
+def test_query_searches_sorts_and_pages(run_id):
+    page = query_results(run_id, 'magasin', 'discrepancies', sort='Difference', direction='asc', limit=2)
+    assert [row['Ref'] for row in page['rows']] == ['D3', 'D2']
+    assert page['total'] == 3
+
+    page = query_results(run_id, 'magasin', 'discrepancies', sort='Difference', direction='asc', offset=2)
+    assert [row['Ref'] for row in page['rows']] == ['D1']
+
+    page = query_results(run_id, 'magasin', 'discrepancies', search='d3')
+    assert [row['Ref'] for row in page['rows']] == ['D3']
+
+
+def test_edit_removes_and_renames_rows(run_id):
+    edited = edit_results(run_id, 'magasin', 'discrepancies', remove=['D2'], rename={'D3': 'D30'})
+
+    assert edited['total'] == 2
+    assert edited['renamed'] == ['D3']
+    assert edited['summary']['discrepancies'] == 2
+    rows = restore_run(run_id)['results']['magasin']['discrepancies']
+    assert [row['Ref'] for row in rows] == ['D1', 'D30']
+
+
+def test_replace_atelier_updates_the_run(run_id):
+    fixed_result = {'matches': [_row('C1', 2.0, 2.0)], 'discrepancies': []}
+
+    replaced = replace_atelier(run_id, 'couture', fixed_result)
+
+    assert replaced['counts'] == {'matches': 1, 'discrepancies': 0}
+    assert replaced['summary']['matches'] == 3
+    assert restore_run(run_id)['results']['couture']['matches'] == [fixed_result['matches'][0]]
+
+
+def test_reference_movements_and_listing(run_id):
+    history = reference_movements(run_id, 'magasin', 'd1')
+
+    assert [row['Date'] for row in history['rows']] == ['2025-01-02', '2025-01-10']
+    assert history['total'] == 8.0
+    assert [run['runId'] for run in list_runs('Mdoukal')] == [run_id]
+    assert run_exists(run_id) and not run_exists('missing')
+
+
+def test_query_clamps_the_offset_and_reports_errors(run_id):
+    page = query_results(run_id, 'magasin', 'matches', offset=50)
+    assert page['offset'] == 1
+    assert [row['Ref'] for row in page['rows']] == ['M2']
+
+    page = query_results(run_id, 'magasin', 'discrepancies', search='d', prefix=True, sort='Ref', direction='desc')
+    assert [row['Ref'] for row in page['rows']] == ['D3', 'D2', 'D1']
+    assert page['rows'][0]['Highlight'] == [[0, 1]]
+
+    assert query_results(run_id, 'couture', 'matches')['error'] == 'Could not find sheet STC'
+    with pytest.raises(KeyError):
+        query_results(run_id, 'tissage', 'matches')
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from search_index import GRAM_CHARS, build_index, highlights, match_rows
+
+
+REFS = ['ABC-100', 'abc-101', 'X 200/B', 'Tissu été', 'ÉTÉ 12,5', 'abc-100', '', 'ZZ' * 40 + 'needle', 'A', 'a.b.c']
+
+
+def _scan(refs, query, prefix=False):
+    query = query.lower()
+    return np.array([ref.lower().startswith(query) if prefix else query in ref.lower() for ref in refs], dtype=bool)
+
+
+@pytest.mark.parametrize('query', ['', 'a', 'AB', 'abc', 'abc-10', 'c-1', '100', ' 2', 'été', 'ÉT', '12,5', '.b.',
+                                   'needle', 'zzzz', 'zneedle', 'missing', 'abc-1000'])
+def test_substring_search_matches_a_scan(query):
+    index = build_index(REFS)
+
+    assert match_rows(index, query).tolist() == _scan(REFS, query).tolist()
+
+
+@pytest.mark.parametrize('query', ['', 'a', 'abc-10', 'ÉTÉ', 'x 2', 'zz', 'b'])
+def test_prefix_search_matches_a_scan(query):
+    index = build_index(REFS)
+
+    assert match_rows(index, query, prefix=True).tolist() == _scan(REFS, query, prefix=True).tolist()
+
+
+def test_random_references_match_a_scan():
+    rng = np.random.default_rng(3)
+    alphabet = list('ab12-/ éX')
+    refs = [''.join(rng.choice(alphabet, rng.integers(1, GRAM_CHARS + 10))) for _ in range(300)]
+    index = build_index(refs)
+
+    for query in [''.join(rng.choice(alphabet, n)) for n in (1, 2, 3, 4, 6) for _ in range(10)]:
+        assert match_rows(index, query).tolist() == _scan(refs, query).tolist()
+        assert match_rows(index, query, prefix=True).tolist() == _scan(refs, query, prefix=True).tolist()
+
+
+def test_highlights():
+    assert highlights('ABC-abc', 'abc') == [[0, 3], [4, 7]]
+    assert highlights('ABC-abc', 'abc', prefix=True) == [[0, 3]]
+    assert highlights('ABC', '') == []
@@ -0,0 +1,67 @@
+import os
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import sheet_cache
+from sheet_cache import SHEET_CACHE_DIR, cache_sheets, prune, read_sheet
+from storage import data_path
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'MOUV'
+    sheet.append(['Mouvements janvier 2025'])
+    sheet.append([])
+    sheet.append(['Code', 'Désignation', 'Qté', 'Date'])
+    sheet.append(['A1', 'Farine', 12, datetime(2025, 1, 4)])
+    sheet.append(['A2', None, 2.5, datetime(2025, 1, 5)])
+    sheet.append(['A1', 'Farine', -3, None])
+    book.create_sheet('STC').append(['Code', 'Stock'])
+    path = tmp_path / 'mov.xlsx'
+    book.save(path)
+    return str(path)
+
+
+def _forget_process_memo(monkeypatch):
+    # As a new process would, and without opening the workbook again
+    sheet_cache._memo.clear()
+    monkeypatch.setattr(sheet_cache, '_parse_cells', lambda *args: pytest.fail('workbook parsed again'))
+
+
+@pytest.mark.parametrize('header, usecols', [(2, None), (2, [0, 2]), (0, None), (None, None)])
+def test_read_sheet_matches_read_excel(workbook_path, monkeypatch, header, usecols):
+    assert cache_sheets(workbook_path) == ['MOUV', 'STC']
+    _forget_process_memo(monkeypatch)
+
+    cached = read_sheet(workbook_path, sheet_name='MOUV', header=header, usecols=usecols)
+    expected = pd.read_excel(workbook_path, sheet_name='MOUV', header=header, usecols=usecols)
+
+    pd.testing.assert_frame_equal(cached, expected)
+
+
+def test_changed_workbook_is_read_again(workbook_path):
+    assert read_sheet(workbook_path, 'MOUV', header=2)['Qté'].sum() == 11.5
+
+    book = openpyxl.load_workbook(workbook_path)
+    book['MOUV'].append(['A3', 'Sel', 100])
+    book.save(workbook_path)
+
+    assert read_sheet(workbook_path, 'MOUV', header=2)['Qté'].sum() == 111.5
+
+
+def test_prune_drops_least_recently_used_entries(workbook_path):
+    cache_sheets(workbook_path)
+    directory = os.path.dirname(data_path(SHEET_CACHE_DIR, 'x'))
+    entries = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    assert len(entries) == 2
+    os.utime(entries[0], (1, 1))
+    os.utime(entries[1], (2, 2))
+
+    prune(limit=os.path.getsize(entries[1]))
+
+    assert sorted(os.listdir(directory)) == [os.path.basename(entries[1])]
@@ -0,0 +1,82 @@
+import os
+
+import pandas as pd
+
+from processor_mags import _prev_stock, prev_month_year
+from quantities import fixed
+from snapshots import save_snapshot, stock_snapshot, stored_months, stored_stock
+
+
+def _stock(rows, localisations=None):
+    frame = pd.DataFrame({'Ref': pd.Series([ref for ref, _ in rows], dtype='string'),
+                          'Qty': [fixed(qty) for _, qty in rows]})
+    if localisations is not None:
+        frame.insert(0, 'Localisation', localisations)
+    return frame
+
+
+def _file(path, content=b'stock'):
+    path.write_bytes(content)
+    return str(path)
+
+
+def _loader(stock, unreadable=0):
+    calls = []
+
+    def load(path):
+        calls.append(path)
+        return stock, unreadable
+    return load, calls
+
+
+def test_snapshot_is_stored_once_per_file(tmp_path):
+    path = _file(tmp_path / 'STOCK 12-2024.xlsx')
+    stock = _stock([('A', 1.25), ('B', -3)], localisations=['MAG', 'MAG'])
+    load, calls = _loader(stock, unreadable=2)
+
+    stock_snapshot('Mags', '12', 2024, path, load)
+    again, unreadable = stock_snapshot('Mags', '12', 2024, path, load)
+
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(again, stock, check_dtype=False)
+    assert unreadable == 2
+    assert again['Qty'].dtype == 'int64'
+
+
+def test_changed_file_is_read_again_and_a_gone_file_keeps_its_month(tmp_path):
+    path = _file(tmp_path / 'STOCK 12-2024.xlsx')
+    load, calls = _loader(_stock([('A', 1)]))
+    stock_snapshot('Mags', '12', 2024, path, load)
+
+    _file(tmp_path / 'STOCK 12-2024.xlsx', b'stock, recounted')
+    assert stored_stock('Mags', '12', 2024) is None
+    stock_snapshot('Mags', '12', 2024, path, load)
+    assert len(calls) == 2
+
+    os.remove(path)
+    stock, _ = stored_stock('Mags', '12', 2024)
+    assert stock['Ref'].tolist() == ['A']
+
+
+def test_months_are_listed_oldest_first(tmp_path):
+    path = _file(tmp_path / 'stock.xlsx')
+    for month, year in [('01', 2025), ('12', 2024), ('02', 2025)]:
+        save_snapshot('Mags', month, year, path, _stock([('A', 1)]))
+    save_snapshot('Oran', '03', 2025, path, _stock([('A', 1)]))
+
+    assert stored_months('Mags') == [(2024, 12), (2025, 1), (2025, 2)]
+
+
+def test_mags_opening_stock_of_january_is_december_of_the_year_before(tmp_path):
+    december = _file(tmp_path / 'STOCK 12-2024.xlsx')
+    january = _file(tmp_path / 'STOCK 01-2025.xlsx')
+    save_snapshot('Mags', '12', 2024, december, _stock([('A', 7)]), unreadable=1)
+    os.remove(december)
+
+    month, year = prev_month_year('01', 2025)
+    stock, unreadable = _prev_stock(january, None, month, year)
+
+    assert (month, year) == ('12', 2024)
+    assert stock['Qty'].tolist() == [fixed(7)]
+    assert unreadable == 1
+    assert _prev_stock(january, None, '11', 2024) is None
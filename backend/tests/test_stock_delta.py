@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from ledger import ingest
+from quantities import fixed
+from stock_delta import cross_check, month_before, month_movement, stock_delta
+
+
+def _stock(rows):
+    return pd.DataFrame({'Ref': pd.Series([ref for ref, _ in rows], dtype='string'),
+                         'Qty': [fixed(qty) for _, qty in rows]})
+
+
+def _movements(rows):
+    return pd.DataFrame({'Ref': pd.Series([ref for ref, _, _ in rows], dtype='string'),
+                         'Date': pd.to_datetime([date for _, date, _ in rows]),
+                         'Qty': [fixed(qty) for _, _, qty in rows]})
+
+
+MOVEMENTS = _movements([
+    ('A', '2024-12-20', 50),
+    ('A', '2025-01-03', 4),
+    ('B', '2025-01-31', -2.5),
+    ('B', None, 1),
+    ('B', '2025-02-01', 9),
+])
+
+
+def _processor(calls):
+    def process_all(stock_file, matched_files, month):
+        calls.append((month, sorted(matched_files)))
+        return {atelier: {'matches': [], 'discrepancies': [], '_movements': MOVEMENTS} for atelier in matched_files}
+    return SimpleNamespace(sheet_args={'magasin': {}}, process_all=process_all)
+
+
+def test_month_before_rolls_over_january():
+    assert month_before('01', 2025) == ('12', 2024)
+    assert month_before('03', 2025) == ('02', 2025)
+
+
+def test_stock_delta_joins_both_months():
+    delta = stock_delta(_stock([('A', 10), ('B', 3)]), _stock([('A', 14), ('C', 1)]))
+
+    assert delta['Ref'].tolist() == ['A', 'B', 'C']
+    assert delta['Delta'].tolist() == [fixed(4), fixed(-3), fixed(1)]
+
+
+def test_month_movement_keeps_the_month_and_undated_rows():
+    movement = month_movement(MOVEMENTS, '01', 2025)
+
+    assert movement['Ref'].tolist() == ['A', 'B']
+    assert movement['Calc_Mov_Qty'].tolist() == [fixed(4), fixed(-1.5)]
+
+
+def test_cross_check_in_january_processes_once():
+    calls = []
+    delta = stock_delta(_stock([('A', 10), ('B', 3)]), _stock([('A', 14), ('B', 1)]))
+
+    checks = cross_check('Mdoukal', _processor(calls), delta, {'path': 'stock.xlsx'},
+                         {'magasin': {'path': __file__}}, '01', 2025)
+
+    assert calls == [('01', ['magasin'])]
+    assert checks['magasin']['matches'] == [{'Ref': 'A', 'Delta': 4.0, 'Calc_Mov_Qty': 4.0, 'Difference': 0.0}]
+    assert checks['magasin']['discrepancies'] == [{'Ref': 'B', 'Delta': -2.0, 'Calc_Mov_Qty': -1.5, 'Difference': -0.5}]
+
+
+def test_cross_check_reads_an_ingested_file_from_the_ledger(tmp_path):
+    path = tmp_path / 'mov.xlsx'
+    path.write_bytes(b'movements')
+    ingest('Mdoukal', 'magasin', str(path), pd.DataFrame({
+        'Ref': ['A', 'A', 'B'], 'Date': ['2024-12-20', '2025-01-03', '2025-01-31'],
+        'Qty': [fixed(50), fixed(4), fixed(-2)]}))
+    calls = []
+    delta = stock_delta(_stock([('A', 10), ('B', 3)]), _stock([('A', 14), ('B', 1)]))
+
+    checks = cross_check('Mdoukal', _processor(calls), delta, {'path': 'stock.xlsx'},
+                         {'magasin': {'path': str(path)}}, '01', 2025)
+
+    assert calls == []
+    assert checks['magasin']['discrepancies'] == []
+    assert len(checks['magasin']['matches']) == 2
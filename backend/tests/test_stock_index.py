@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from quantities import UNREADABLE_COL, fixed
+from stock_index import (as_categories, build_stock_index, index_positions, retained_index, stock_aggregate,
+                         stock_unreadable)
+
+
+@pytest.fixture
+def stock():
+    rng = np.random.default_rng(7)
+    size = 500
+    frame = pd.DataFrame({
+        'Localisation': rng.choice(['MAG A', 'MAG B', 'ATELIER C', None], size),
+        'Zone': rng.choice(['1', '2'], size),
+        'Ref': rng.choice([f"R{i:03d}" for i in range(40)] + [None], size),
+        'Qty': rng.integers(-50, 200, size) * fixed(0.25),
+    })
+    frame[UNREADABLE_COL] = rng.random(size) < 0.05
+    return frame
+
+
+def _baseline(stock, localisations):
+    rows = stock[stock['Localisation'].isin(localisations) & stock['Ref'].notna()]
+    return rows.groupby('Ref')['Qty'].sum().rename_axis('Ref').reset_index(name='Stock_Qty')
+
+
+def _sorted(frame):
+    frame = frame.sort_values('Ref', ignore_index=True)
+    return frame.astype({'Ref': 'string', 'Stock_Qty': 'int64'})
+
+
+@pytest.mark.parametrize('localisations', [['MAG A'], ['MAG A', 'ATELIER C'], ['MAG A', 'MAG B', 'ATELIER C'], ['NOWHERE']])
+def test_aggregate_equals_filter_then_groupby(stock, localisations):
+    index = build_stock_index(stock, 'Localisation', 'Ref', 'Qty')
+
+    pd.testing.assert_frame_equal(_sorted(stock_aggregate(index, localisations)), _sorted(_baseline(stock, localisations)))
+    expected_unreadable = stock[stock['Localisation'].isin(localisations) & stock['Ref'].notna()][UNREADABLE_COL].sum()
+    assert stock_unreadable(index, localisations) == expected_unreadable
+
+
+def test_categorical_and_multi_column_keys(stock):
+    by_pair = build_stock_index(as_categories(stock.copy(), ['Localisation', 'Zone', 'Ref']), ['Localisation', 'Zone'], 'Ref', 'Qty')
+
+    rows = stock[(stock['Localisation'] == 'MAG B') & (stock['Zone'] == '2') & stock['Ref'].notna()]
+    expected = rows.groupby('Ref')['Qty'].sum().rename_axis('Ref').reset_index(name='Stock_Qty')
+    pd.testing.assert_frame_equal(_sorted(stock_aggregate(by_pair, [('MAG B', '2')])), _sorted(expected))
+
+
+def test_whole_stock_and_positions(stock):
+    whole = build_stock_index(stock, [], 'Ref', 'Qty')
+    by_localisation = build_stock_index(stock, 'Localisation', 'Ref', 'Qty')
+
+    expected = stock[stock['Ref'].notna()].groupby('Ref')['Qty'].sum().rename_axis('Ref').reset_index(name='Stock_Qty')
+    pd.testing.assert_frame_equal(_sorted(stock_aggregate(whole, [None])), _sorted(expected))
+
+    positions, unreadable = index_positions(by_localisation)
+    assert positions['Qty'].sum() == stock[stock['Ref'].notna() & stock['Localisation'].notna()]['Qty'].sum()
+    assert unreadable == stock[stock['Ref'].notna() & stock['Localisation'].notna()][UNREADABLE_COL].sum()
+
+
+def test_retained_index_is_built_once_per_file(tmp_path):
+    path = tmp_path / 'stock.xlsx'
+    path.write_bytes(b'stock')
+    built = []
+
+    def build(path):
+        built.append(path)
+        return {'parts': {}, 'empty': pd.Series(dtype='int64'), 'unreadable': {}}
+
+    retained_index(str(path), build)
+    retained_index(str(path), build)
+    path.write_bytes(b'stock, changed')
+    retained_index(str(path), build)
+
+    assert len(built) == 2
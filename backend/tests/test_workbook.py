@@ -0,0 +1,72 @@
+from datetime import datetime, time
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from workbook import list_sheets, peek_sheet, resolve_sheet, sheet_dimensions
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'MOUV'
+    sheet.append(['Etat du stock mars 2024'])
+    sheet.append([])
+    sheet.append(['Code', 'Désignation', 'Qté', 'Date', 'Heure'])
+    sheet.append(['A1', 'Farine', 12, datetime(2024, 3, 4, 12, 30), time(7, 45)])
+    sheet.append(['A2', 'Sucre', 2.5, datetime(2024, 3, 5), time(0, 0, 1)])
+    # Formulas saved without a cached value come back as <v/>
+    sheet.append(['A3', None, '=C4+C5', None, None])
+    sheet.append(['A4', 'Sel', -0.75])
+    book.create_sheet('STC').append(['Code', 'Stock'])
+    path = tmp_path / 'stock.xlsx'
+    book.save(path)
+    return str(path)
+
+
+def _values(frame):
+    return [[None if pd.isna(v) else v for v in row] for row in frame.itertuples(index=False)]
+
+
+@pytest.mark.parametrize('nrows', [1, 3, 5, 7, 20])
+def test_peek_matches_read_excel(workbook_path, nrows):
+    peeked = peek_sheet(workbook_path, 'MOUV', nrows=nrows)
+    expected = pd.read_excel(workbook_path, sheet_name='MOUV', header=None, nrows=nrows)
+
+    assert peeked.shape == expected.shape
+    assert _values(peeked) == _values(expected)
+
+
+def test_dates_and_times_read_as_openpyxl_does(workbook_path):
+    peeked = peek_sheet(workbook_path, 'MOUV', nrows=5)
+
+    assert peeked.iat[3, 3] == datetime(2024, 3, 4, 12, 30)
+    assert peeked.iat[3, 4] == time(7, 45)
+    assert peeked.iat[4, 4] == time(0, 0, 1)
+
+
+def test_resolve_sheet_takes_names_and_positions(workbook_path):
+    assert resolve_sheet(workbook_path, ['MOV', 'MOUV']) == 'MOUV'
+    assert resolve_sheet(workbook_path, 1) == 'STC'
+    assert resolve_sheet(workbook_path, [5, 'STC']) == 'STC'
+    assert resolve_sheet(workbook_path, 'MOV') is None
+    assert peek_sheet(workbook_path, 1).iat[0, 1] == 'Stock'
+    with pytest.raises(ValueError):
+        peek_sheet(workbook_path, 'MOV')
+
+
+def test_sheets_listed_from_the_workbook_index(workbook_path):
+    assert list_sheets(workbook_path) == pd.ExcelFile(workbook_path).sheet_names
+    assert sheet_dimensions(workbook_path) == {'MOUV': (7, 5), 'STC': (1, 2)}
+
+
+def test_listing_follows_a_rewritten_workbook(workbook_path):
+    assert list_sheets(workbook_path) == ['MOUV', 'STC']
+    book = openpyxl.load_workbook(workbook_path)
+    book.create_sheet('MOV', 0)
+    book.save(workbook_path)
+
+    assert list_sheets(workbook_path) == ['MOV', 'MOUV', 'STC']
+    assert resolve_sheet(workbook_path, 0) == 'MOV'
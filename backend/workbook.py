@@ -0,0 +1,441 @@
+"""
+Workbook Index - sheet listing straight from the workbook package
+
+Sheet names (and sheet dimensions) are read from the .xlsx package index
+(xl/workbook.xml and each worksheet's <dimension> element) without loading
+the workbook. Legacy .xls files use xlrd's on-demand mode, which only reads
+the workbook globals. Every sheet-candidate lookup should go through
+resolve_sheet() before anything is parsed.
+
+peek_sheet() returns the first rows of a sheet while parsing only those rows
+(the worksheet XML is streamed and abandoned once enough rows were seen), which
+is all header detection and column listing need.
+"""
+
+import os
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+import math
+
+import pandas as pd
+
+
+ZIP_EXTENSIONS = ('.xlsx', '.xlsm')
+XLS_EXTENSIONS = ('.xls',)
+
+_REL_ID_ATTR = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+_CELL_REF_RE = re.compile(r'([A-Z]+)(\d+)')
+
+# Built-in number formats that Excel renders as dates/times
+_DATE_FORMAT_IDS = set(range(14, 23)) | set(range(45, 48))
+_DATE_CODE_RE = re.compile(r'[dmyhs]', re.IGNORECASE)
+_FORMAT_NOISE_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _file_key(path: str) -> tuple:
+    """Cache key that changes whenever the file is replaced or modified."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _col_number(letters: str) -> int:
+    number = 0
+    for ch in letters:
+        number = number * 26 + (ord(ch) - ord('A') + 1)
+    return number
+
+
+def _zip_sheet_parts(zf: zipfile.ZipFile) -> list[tuple[str, str | None]]:
+    """Return [(sheet name, worksheet part)] from xl/workbook.xml and its rels."""
+    targets = {}
+    try:
+        with zf.open('xl/_rels/workbook.xml.rels') as f:
+            for _, elem in ET.iterparse(f):
+                if _local_name(elem.tag) == 'Relationship':
+                    target = elem.get('Target', '')
+                    if target.startswith('/'):
+                        part = target.lstrip('/')
+                    else:
+                        part = posixpath.normpath(posixpath.join('xl', target))
+                    targets[elem.get('Id')] = part
+    except KeyError:
+        pass
+
+    sheets = []
+    with zf.open('xl/workbook.xml') as f:
+        for _, elem in ET.iterparse(f):
+            name = _local_name(elem.tag)
+            if name == 'sheet':
+                sheets.append((elem.get('name'), targets.get(elem.get(_REL_ID_ATTR))))
+            elif name == 'sheets':
+                break
+    return sheets
+
+
+def _zip_dimension(zf: zipfile.ZipFile, part: str | None) -> tuple[int, int] | None:
+    """Read the <dimension ref="A1:K500"/> element at the top of a worksheet part."""
+    if not part:
+        return None
+    try:
+        with zf.open(part) as f:
+            for _, elem in ET.iterparse(f, events=('start',)):
+                name = _local_name(elem.tag)
+                if name == 'dimension':
+                    last = elem.get('ref', '').split(':')[-1]
+                    m = _CELL_REF_RE.fullmatch(last)
+                    if not m:
+                        return None
+                    return int(m.group(2)), _col_number(m.group(1))
+                if name == 'sheetData':
+                    return None
+    except (KeyError, ET.ParseError):
+        return None
+    return None
+
+
+@lru_cache(maxsize=64)
+def _sheet_index(key: tuple) -> tuple[tuple[str, tuple[int, int] | None], ...]:
+    path = key[0]
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext in ZIP_EXTENSIONS:
+        try:
+            with zipfile.ZipFile(path) as zf:
+                return tuple((name, _zip_dimension(zf, part)) for name, part in _zip_sheet_parts(zf))
+        except (zipfile.BadZipFile, KeyError, ET.ParseError):
+            pass
+
+    if ext in XLS_EXTENSIONS:
+        import xlrd
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            return tuple((name, None) for name in book.sheet_names())
+        finally:
+            book.release_resources()
+
+    # Anything else (.xlsb, .ods, mislabelled files): let pandas work it out
+    with pd.ExcelFile(path) as xl:
+        return tuple((name, None) for name in xl.sheet_names)
+
+
+def list_sheets(path: str) -> list[str]:
+    """Return the workbook's sheet names in tab order."""
+    return [name for name, _ in _sheet_index(_file_key(path))]
+
+
+@lru_cache(maxsize=64)
+def _xls_dimensions(key: tuple) -> dict[str, tuple[int, int]]:
+    # BIFF has no package index: each sheet is loaded on demand and released again
+    import xlrd
+    book = xlrd.open_workbook(key[0], on_demand=True)
+    try:
+        dims = {}
+        for name in book.sheet_names():
+            sheet = book.sheet_by_name(name)
+            dims[name] = (sheet.nrows, sheet.ncols)
+            book.unload_sheet(name)
+        return dims
+    finally:
+        book.release_resources()
+
+
+def sheet_dimensions(path: str) -> dict[str, tuple[int, int] | None]:
+    """Return {sheet name: (rows, columns)} as recorded by the workbook, None when unknown.
+
+    .xls files carry no index, so each sheet is loaded (one at a time) to learn its size.
+    """
+    key = _file_key(path)
+    if os.path.splitext(path)[1].lower() in XLS_EXTENSIONS:
+        return dict(_xls_dimensions(key))
+    return dict(_sheet_index(key))
+
+
+def resolve_sheet(path: str, candidates) -> str | None:
+    """Return the first candidate present in the workbook, or None.
+
+    Integer candidates are sheet positions (as with pandas' sheet_name=0).
+    """
+    if candidates is None:
+        return None
+    if not isinstance(candidates, (list, tuple)):
+        candidates = [candidates]
+
+    names = list_sheets(path)
+    for candidate in candidates:
+        if isinstance(candidate, int) and not isinstance(candidate, bool):
+            if 0 <= candidate < len(names):
+                return names[candidate]
+        elif candidate in names:
+            return candidate
+    return None
+
+
+def _sheet_part(zf: zipfile.ZipFile, sheet: str) -> str | None:
+    for name, part in _zip_sheet_parts(zf):
+        if name == sheet:
+            return part
+    return None
+
+
+def _zip_date_styles(zf: zipfile.ZipFile) -> set[int]:
+    """Indexes into cellXfs whose number format is a date/time format."""
+    try:
+        f = zf.open('xl/styles.xml')
+    except KeyError:
+        return set()
+
+    custom = {}
+    date_styles = set()
+    with f:
+        in_cell_xfs = False
+        xf_index = 0
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            name = _local_name(elem.tag)
+            if event == 'start':
+                if name == 'cellXfs':
+                    in_cell_xfs = True
+                continue
+            if name == 'numFmt':
+                code = _FORMAT_NOISE_RE.sub('', elem.get('formatCode', ''))
+                custom[int(elem.get('numFmtId', 0))] = bool(_DATE_CODE_RE.search(code))
+            elif name == 'xf' and in_cell_xfs:
+                fmt_id = int(elem.get('numFmtId', 0))
+                if custom.get(fmt_id, fmt_id in _DATE_FORMAT_IDS):
+                    date_styles.add(xf_index)
+                xf_index += 1
+            elif name == 'cellXfs':
+                break
+    return date_styles
+
+
+def _zip_date1904(zf: zipfile.ZipFile) -> bool:
+    with zf.open('xl/workbook.xml') as f:
+        for _, elem in ET.iterparse(f):
+            name = _local_name(elem.tag)
+            if name == 'workbookPr':
+                return elem.get('date1904', '0').lower() in ('1', 'true')
+            if name == 'sheets':
+                break
+    return False
+
+
+def _zip_shared_strings(zf: zipfile.ZipFile, needed: set[int]) -> dict[int, str]:
+    """Resolve only the shared-string indexes in `needed`, stopping at the highest one."""
+    if not needed:
+        return {}
+    try:
+        f = zf.open('xl/sharedStrings.xml')
+    except KeyError:
+        return {}
+
+    last = max(needed)
+    strings = {}
+    index = 0
+    with f:
+        for _, elem in ET.iterparse(f):
+            if _local_name(elem.tag) != 'si':
+                continue
+            if index in needed:
+                # Plain <t> or rich-text runs <r><t>; phonetic hints (<rPh>) are skipped
+                parts = [elem.findtext(_qualified(elem, 't')) or '']
+                for run in elem:
+                    if _local_name(run.tag) == 'r':
+                        parts.append(run.findtext(_qualified(run, 't')) or '')
+                strings[index] = ''.join(parts)
+            elem.clear()
+            if index >= last:
+                break
+            index += 1
+    return strings
+
+
+def _qualified(elem, name: str) -> str:
+    tag = elem.tag
+    return tag[:tag.index('}') + 1] + name if tag.startswith('{') else name
+
+
+def _number(text: str):
+    value = float(text)
+    if value.is_integer():
+        return int(value)
+    return value
+
+
+def _excel_datetime(serial: float, date1904: bool) -> datetime | time:
+    """A date serial as openpyxl reads it: rounded to the millisecond, a time of day when below 1."""
+    day, fraction = divmod(serial, 1)
+    diff = timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= serial < 1 and diff.days == 0:
+        minutes, seconds = divmod(diff.seconds, 60)
+        return time(minutes // 60, minutes % 60, seconds, diff.microseconds)
+    if date1904:
+        return datetime(1904, 1, 1) + timedelta(days=day) + diff
+    # 1900 system, including Excel's phantom 1900-02-29
+    if 0 < serial < 60:
+        day += 1
+    return datetime(1899, 12, 30) + timedelta(days=day) + diff
+
+
+def _zip_peek(path: str, sheet: str, nrows: int) -> list[list]:
+    with zipfile.ZipFile(path) as zf:
+        part = _sheet_part(zf, sheet)
+        if part is None:
+            raise ValueError(f"Worksheet named '{sheet}' not found")
+        date_styles = _zip_date_styles(zf)
+        date1904 = _zip_date1904(zf) if date_styles else False
+
+        # (row, col, type, style, raw text); shared strings are resolved afterwards
+        cells = []
+        row_number = 0
+        with zf.open(part) as f:
+            for _, elem in ET.iterparse(f):
+                name = _local_name(elem.tag)
+                if name != 'row':
+                    if name == 'sheetData':
+                        break
+                    continue
+                row_number = int(elem.get('r', row_number + 1))
+                if row_number > nrows:
+                    break
+                col_number = 0
+                for c in elem:
+                    if _local_name(c.tag) != 'c':
+                        continue
+                    ref = _CELL_REF_RE.fullmatch(c.get('r', ''))
+                    col_number = _col_number(ref.group(1)) if ref else col_number + 1
+                    cell_type = c.get('t', 'n')
+                    if cell_type == 'inlineStr':
+                        text = ''.join(t.text or '' for t in c.iter() if _local_name(t.tag) == 't')
+                    else:
+                        text = c.findtext(_qualified(c, 'v'))
+                    # No cached value (<v/>), as formulas saved by openpyxl and others are
+                    if not text:
+                        continue
+                    cells.append((row_number, col_number, cell_type, int(c.get('s', 0)), text))
+                elem.clear()
+
+        shared = _zip_shared_strings(zf, {int(text) for _, _, t, _, text in cells if t == 's'})
+
+    rows = []
+    for row_number, col_number, cell_type, style, text in cells:
+        if cell_type == 's':
+            value = shared.get(int(text))
+        elif cell_type in ('str', 'inlineStr'):
+            value = text
+        elif cell_type == 'b':
+            value = text == '1'
+        elif cell_type == 'e':
+            value = None
+        elif cell_type == 'd':
+            value = pd.Timestamp(text).to_pydatetime()
+        else:
+            value = _number(text)
+            if style in date_styles:
+                value = _excel_datetime(value, date1904)
+        if value is None or value == '':
+            continue
+        while len(rows) < row_number:
+            rows.append([])
+        row = rows[row_number - 1]
+        while len(row) < col_number:
+            row.append(None)
+        row[col_number - 1] = value
+    return rows
+
+
+def _xls_peek(path: str, sheet: str, nrows: int) -> list[list]:
+    import xlrd
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        ws = book.sheet_by_name(sheet)
+        rows = []
+        for r in range(min(nrows, ws.nrows)):
+            row = []
+            for cell in ws.row(r):
+                if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                    value = None
+                elif cell.ctype == xlrd.XL_CELL_NUMBER:
+                    value = _number(repr(cell.value))
+                elif cell.ctype == xlrd.XL_CELL_DATE:
+                    value = xlrd.xldate_as_datetime(cell.value, book.datemode)
+                    # A time of day lands on the epoch's first day; pandas gives it as a time
+                    if value.date() == (datetime(1904, 1, 1) if book.datemode else datetime(1899, 12, 31)).date():
+                        value = value.time()
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(cell.value)
+                else:
+                    value = cell.value if cell.value != '' else None
+                row.append(value)
+            rows.append(row)
+        return rows
+    finally:
+        book.release_resources()
+
+
+def peek_sheet(path: str, sheet, nrows: int = 20) -> pd.DataFrame:
+    """Return the first `nrows` rows of a sheet, like read_excel(header=None, nrows=nrows).
+
+    Only those rows are parsed: the worksheet XML is streamed and abandoned after
+    row `nrows`, and shared strings are resolved up to the highest index used.
+    `sheet` may be a name or a position.
+    """
+    name = resolve_sheet(path, sheet)
+    if name is None:
+        raise ValueError(f"Worksheet '{sheet}' not found in {os.path.basename(path)}")
+
+    ext = os.path.splitext(path)[1].lower()
+    rows = None
+    if ext in ZIP_EXTENSIONS:
+        try:
+            # read_excel looks at one row more than it returns; the extra row still
+            # decides whether trailing blank rows are kept and how wide the frame is
+            rows = [r[:_last_value(r) + 1] for r in _zip_peek(path, name, nrows + 1)]
+            while rows and not rows[-1]:
+                rows.pop()
+        except (zipfile.BadZipFile, KeyError, ET.ParseError):
+            rows = None
+    elif ext in XLS_EXTENSIONS:
+        rows = _xls_peek(path, name, nrows)
+    if rows is None:
+        return pd.read_excel(path, sheet_name=name, header=None, nrows=nrows)
+
+    width = max((len(r) for r in rows), default=0)
+    nan = float('nan')
+    rows = [[nan if v is None else v for v in r] + [nan] * (width - len(r)) for r in rows[:nrows]]
+    return pd.DataFrame(rows, columns=range(width), dtype=object)
+
+
+def _last_value(row: list) -> int:
+    for i in range(len(row) - 1, -1, -1):
+        if row[i] is not None:
+            return i
+    return -1
+
+
+def header_labels(values) -> list:
+    """Column labels read_excel would derive from a header row.
+
+    Blank cells become 'Unnamed: <position>' and repeated labels get '.1', '.2' suffixes.
+    """
+    labels = []
+    seen = {}
+    for i, value in enumerate(values):
+        if value is None or (isinstance(value, float) and math.isnan(value)) or value == '':
+            label = f'Unnamed: {i}'
+        else:
+            label = value
+        base = label
+        while label in seen:
+            seen[base] += 1
+            label = f'{base}.{seen[base]}'
+        seen[label] = 0
+        labels.append(label)
+    return labels
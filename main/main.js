@@ -4,6 +4,10 @@ const { PythonShell } = require('python-shell');
 
 let mainWindow;
 
+// Persistent backend files (remembered layouts, caches) live in the app's userData folder;
+// every spawned processor inherits this variable
+process.env.STOCKAPP_DATA_DIR = path.join(app.getPath('userData'), 'backend');
+
 function createWindow() {
     mainWindow = new BrowserWindow({
         width: 1400,
@@ -157,7 +161,7 @@ ipcMain.handle('match-files', async (event, { unit, files }) => {
 });
 
 // Process files and calculate
-ipcMain.handle('process-files', async (event, { unit, stockFile, matchedFiles, month, overrides }) => {
+ipcMain.handle('process-files', async (event, { unit, stockFile, matchedFiles, month, overrides, topK }) => {
     return new Promise((resolve, reject) => {
         const options = {
             mode: 'json',
@@ -170,7 +174,8 @@ ipcMain.handle('process-files', async (event, { unit, stockFile, matchedFiles, m
                 stockFile,
                 matchedFiles,
                 month,
-                overrides
+                overrides,
+                topK
             })]
         };
 
@@ -281,6 +286,188 @@ ipcMain.handle('verify-files', async (event, { unit, matchedFiles }) => {
     });
 });
 
+// Stock delta between two months, cross-checked against the month's movement files
+ipcMain.handle('stock-delta', async (event, { unit, stockFile, prevStockFile, matchedFiles, month, year, prevMonth, prevYear }) => {
+    return new Promise((resolve, reject) => {
+        const options = {
+            mode: 'json',
+            pythonPath: process.platform === 'win32' ? 'python' : 'python3',
+            pythonOptions: ['-u'],
+            scriptPath: path.join(__dirname, '../backend'),
+            args: [JSON.stringify({
+                action: 'stock_delta',
+                unit,
+                stockFile,
+                prevStockFile,
+                matchedFiles,
+                month,
+                year,
+                prevMonth,
+                prevYear
+            })]
+        };
+
+        const pyshell = new PythonShell('processor.py', options);
+        let results = [];
+
+        pyshell.on('message', function (message) {
+            results.push(message);
+        });
+
+        pyshell.on('stderr', function (stderr) {
+            console.log('Python stderr (debug):', stderr);
+        });
+
+        pyshell.end(function (err, code, signal) {
+            if (err) {
+                console.error('Python error:', err);
+                reject(err.message);
+            } else {
+                resolve(results.length > 0 ? results[results.length - 1] : {});
+            }
+        });
+    });
+});
+
+// Run one backend action and resolve with its JSON response
+function runBackend(request) {
+    return new Promise((resolve, reject) => {
+        const options = {
+            mode: 'json',
+            pythonPath: process.platform === 'win32' ? 'python' : 'python3',
+            pythonOptions: ['-u'],
+            scriptPath: path.join(__dirname, '../backend'),
+            args: [JSON.stringify(request)]
+        };
+
+        PythonShell.run('processor.py', options)
+            .then(results => {
+                resolve(results.length > 0 ? results[results.length - 1] : {});
+            })
+            .catch(err => {
+                reject(err.message);
+            });
+    });
+}
+
+// Process one atelier of a retained run again and put its new result in the run
+ipcMain.handle('process-atelier', async (event, { runId, atelier, stockFile, matchedFile, overrides, topK }) => {
+    return runBackend({ action: 'process_atelier', runId, atelier, stockFile, matchedFile, overrides, topK });
+});
+
+// One page of a retained run's results
+ipcMain.handle('query-results', async (event, query) => {
+    return runBackend({ action: 'query_results', ...query });
+});
+
+// Keep a retained run in step with rows deleted or renamed in the results view
+ipcMain.handle('edit-results', async (event, { runId, atelier, view, edit }) => {
+    return runBackend({ action: 'edit_results', runId, atelier, view, ...edit });
+});
+
+// Past runs kept by the backend, most recent first
+ipcMain.handle('list-runs', async (event, { unit }) => {
+    return runBackend({ action: 'list_runs', unit });
+});
+
+// Reopen a past run without reprocessing its files
+ipcMain.handle('restore-run', async (event, { runId, topK }) => {
+    return runBackend({ action: 'restore_run', runId, topK });
+});
+
+// New, resolved and changed discrepancies from one stored run to another
+ipcMain.handle('diff-runs', async (event, { baseRunId, runId, atelier }) => {
+    return runBackend({ action: 'diff_runs', baseRunId, runId, atelier });
+});
+
+// Earliest date at which each discrepancy of a stored run departs from the stored month-end stocks
+ipcMain.handle('first-divergence', async (event, { runId, atelier, year }) => {
+    return runBackend({ action: 'first_divergence', runId, atelier, year });
+});
+
+// Movement rows of one reference of a stored run's atelier, in date order
+ipcMain.handle('reference-movements', async (event, { runId, atelier, ref }) => {
+    return runBackend({ action: 'reference_movements', runId, atelier, ref });
+});
+
+// Background prefetch: parse dropped workbooks into the backend's sheet cache while
+// the user is still assigning files, so Process mostly reads warm caches.
+// Jobs are keyed by the renderer; a cancelled job is dropped from the queue or killed.
+const PREFETCH_CONCURRENCY = 2;
+const prefetchQueue = [];
+const prefetchJobs = new Map();
+let prefetchRunning = 0;
+
+function runNextPrefetch() {
+    while (prefetchRunning < PREFETCH_CONCURRENCY && prefetchQueue.length > 0) {
+        const job = prefetchQueue.shift();
+        const options = {
+            mode: 'json',
+            pythonPath: process.platform === 'win32' ? 'python' : 'python3',
+            pythonOptions: ['-u'],
+            scriptPath: path.join(__dirname, '../backend'),
+            args: [JSON.stringify({ action: 'prefetch', ...job.request })]
+        };
+
+        prefetchRunning++;
+        job.pyshell = new PythonShell('processor.py', options);
+        let results = [];
+
+        job.pyshell.on('message', function (message) {
+            results.push(message);
+        });
+
+        job.pyshell.on('stderr', function (stderr) {
+            console.log('Prefetch stderr (debug):', stderr);
+        });
+
+        job.pyshell.end(function (err) {
+            prefetchRunning--;
+            prefetchJobs.delete(job.jobId);
+            if (job.cancelled) {
+                job.resolve({ success: false, cancelled: true });
+            } else if (err) {
+                console.error('Prefetch error:', err);
+                job.resolve({ success: false, error: err.message });
+            } else {
+                job.resolve(results.length > 0 ? results[results.length - 1] : {});
+            }
+            runNextPrefetch();
+        });
+    }
+}
+
+ipcMain.handle('prefetch-file', async (event, { jobId, unit, filePath, atelier }) => {
+    const existing = prefetchJobs.get(jobId);
+    if (existing) {
+        return existing.promise;
+    }
+
+    const job = { jobId, request: { unit, path: filePath, atelier }, pyshell: null, cancelled: false };
+    job.promise = new Promise(resolve => { job.resolve = resolve; });
+    prefetchJobs.set(jobId, job);
+    prefetchQueue.push(job);
+    runNextPrefetch();
+    return job.promise;
+});
+
+ipcMain.handle('cancel-prefetch', async (event, jobId) => {
+    const job = prefetchJobs.get(jobId);
+    if (!job) {
+        return false;
+    }
+
+    job.cancelled = true;
+    if (job.pyshell) {
+        job.pyshell.kill();
+    } else {
+        prefetchQueue.splice(prefetchQueue.indexOf(job), 1);
+        prefetchJobs.delete(jobId);
+        job.resolve({ success: false, cancelled: true });
+    }
+    return true;
+});
+
 // Export to Excel
 ipcMain.handle('export-excel', async (event, { data, filePath }) => {
     return new Promise((resolve, reject) => {
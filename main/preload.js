@@ -12,8 +12,22 @@ contextBridge.exposeInMainWorld('electronAPI', {
     runPython: (script, args) => ipcRenderer.invoke('run-python', { script, args }),
     matchFiles: (unit, files) => ipcRenderer.invoke('match-files', { unit, files }),
     verifyFiles: (unit, matchedFiles) => ipcRenderer.invoke('verify-files', { unit, matchedFiles }),
-    processFiles: (unit, stockFile, matchedFiles, month, overrides) =>
-        ipcRenderer.invoke('process-files', { unit, stockFile, matchedFiles, month, overrides }),
+    processFiles: (unit, stockFile, matchedFiles, month, overrides, topK) =>
+        ipcRenderer.invoke('process-files', { unit, stockFile, matchedFiles, month, overrides, topK }),
+    processAtelier: (runId, atelier, stockFile, matchedFile, overrides, topK) =>
+        ipcRenderer.invoke('process-atelier', { runId, atelier, stockFile, matchedFile, overrides, topK }),
+    stockDelta: (unit, stockFile, prevStockFile, matchedFiles, month, year, prevMonth, prevYear) =>
+        ipcRenderer.invoke('stock-delta', { unit, stockFile, prevStockFile, matchedFiles, month, year, prevMonth, prevYear }),
+    queryResults: (query) => ipcRenderer.invoke('query-results', query),
+    editResults: (runId, atelier, view, edit) => ipcRenderer.invoke('edit-results', { runId, atelier, view, edit }),
+    listRuns: (unit) => ipcRenderer.invoke('list-runs', { unit }),
+    restoreRun: (runId, topK) => ipcRenderer.invoke('restore-run', { runId, topK }),
+    diffRuns: (baseRunId, runId, atelier) => ipcRenderer.invoke('diff-runs', { baseRunId, runId, atelier }),
+    firstDivergence: (runId, atelier, year) => ipcRenderer.invoke('first-divergence', { runId, atelier, year }),
+    referenceMovements: (runId, atelier, ref) => ipcRenderer.invoke('reference-movements', { runId, atelier, ref }),
+    prefetchFile: (jobId, unit, filePath, atelier) =>
+        ipcRenderer.invoke('prefetch-file', { jobId, unit, filePath, atelier }),
+    cancelPrefetch: (jobId) => ipcRenderer.invoke('cancel-prefetch', jobId),
 
     // Export
     exportCSV: (data, filePath) => ipcRenderer.invoke('export-csv', { data, filePath }),
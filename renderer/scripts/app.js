@@ -17,13 +17,16 @@ const AppState = {
     ateliers: [],          // List of ateliers for selected unit
     skippedAteliers: new Set(),
     results: null,         // Processing results
+    runId: null,           // Backend-retained copy of the results, queried a block at a time
+    processedInputs: null, // Unit, month, stock and per-atelier file/overrides the run was made from
     verificationResults: null, // Verification results
     fileOverrides: {},     // { atelier: { sheetName, refCol, qtyCol } }
+    prefetchJobs: new Map(), // { jobId: Promise } background parsing of assigned files
     currentSortColumn: null,
     currentSortDirection: 'asc',
     searchQuery: '',
     // Report Generation State
-    reportData: {},           // { atelierName: discrepanciesArray }
+    reportData: {},           // { atelierName: { discrepancies, summary } }
     // Verify ± State
     verifyMode: false,        // true when in "Verify ±" mode
     oppositeMatches: [],      // Array of matched opposite pairs
@@ -61,6 +64,26 @@ function highlightMatchSafe(text, query) {
     return result;
 }
 
+// Marks the [start, end) spans the backend's reference index reported
+function highlightSpans(text, spans) {
+    const raw = (text ?? '').toString();
+    let result = '';
+    let lastIndex = 0;
+    for (const [start, end] of spans) {
+        result += escapeHtml(raw.slice(lastIndex, start));
+        result += '<mark style="background: var(--warning-200); padding: 0 2px; border-radius: 2px;">' + escapeHtml(raw.slice(start, end)) + '</mark>';
+        lastIndex = end;
+    }
+    result += escapeHtml(raw.slice(lastIndex));
+    return result;
+}
+
+// Search box text as a query: a leading ^ searches reference prefixes
+function parseSearchQuery(text) {
+    const prefix = text.startsWith('^');
+    return { query: prefix ? text.slice(1) : text, prefix };
+}
+
 
 // Unit configurations with keywords
 const UnitConfigs = {
@@ -166,6 +189,10 @@ const elements = {
     btnExportExcel: document.getElementById('btn-export-excel'),
     resultsSearch: document.getElementById('results-search'),
     resultsTbody: document.getElementById('results-tbody'),
+    resultsTableContainer: document.getElementById('results-table-container'),
+    resultsRange: document.getElementById('results-range'),
+    totalAbsDifference: document.getElementById('total-abs-difference'),
+    atelierSummary: document.getElementById('atelier-summary'),
     btnNewProcess: document.getElementById('btn-new-process'),
     // Verification Modal
     verificationModal: document.getElementById('verification-modal'),
@@ -191,7 +218,18 @@ const elements = {
     // Context Menu
     contextMenu: document.getElementById('context-menu'),
     ctxEditRow: document.getElementById('ctx-edit-row'),
-    ctxDeleteRow: document.getElementById('ctx-delete-row')
+    ctxDeleteRow: document.getElementById('ctx-delete-row'),
+    ctxShowMovements: document.getElementById('ctx-show-movements'),
+    // Movements Modal
+    movementsModal: document.getElementById('movements-modal'),
+    closeMovementsModal: document.getElementById('close-movements-modal'),
+    movementsTitle: document.getElementById('movements-title'),
+    movementsSummary: document.getElementById('movements-summary'),
+    movementsTbody: document.getElementById('movements-tbody'),
+    // Run History
+    runHistory: document.getElementById('run-history'),
+    runHistoryList: document.getElementById('run-history-list'),
+    runHistoryCount: document.getElementById('run-history-count')
 };
 
 // ============================================
@@ -206,6 +244,7 @@ function navigateTo(pageId) {
     document.getElementById(pageId).classList.add('active');
     AppState.currentPage = pageId;
     updateBreadcrumb();
+    if (pageId === 'page-unit-selection') loadRunHistory();
 }
 
 function updateBreadcrumb() {
@@ -247,6 +286,63 @@ function selectUnit(unit) {
     navigateTo('page-file-upload');
 }
 
+// ============================================
+// Run History
+// ============================================
+// Every process run is kept by the backend; a past run reopens from its stored
+// files (largest discrepancies first, like a fresh run) without reprocessing
+async function loadRunHistory() {
+    if (!elements.runHistory) return;
+    let runs = [];
+    try {
+        const response = await window.electronAPI.listRuns(null);
+        if (response?.success) runs = response.runs;
+    } catch (error) {
+        console.error('Could not list past runs:', error);
+    }
+
+    elements.runHistory.classList.toggle('hidden', runs.length === 0);
+    elements.runHistoryCount.textContent = `${runs.length} run${runs.length === 1 ? '' : 's'}`;
+    elements.runHistoryList.innerHTML = runs.map(run => {
+        const summary = run.summary || { matches: 0, discrepancies: 0 };
+        const created = new Date(run.created * 1000).toLocaleString();
+        const errors = run.errors ? ` · <span class="run-errors">${run.errors} failed</span>` : '';
+        return `
+            <button class="run-history-item" data-run-id="${escapeHtml(run.runId)}">
+                <span class="run-title">${escapeHtml(UnitConfigs[run.unit]?.name || run.unit)} · ${escapeHtml(getMonthName(run.month))}</span>
+                <span class="run-details">${run.ateliers} ateliers · ${summary.matches} matches · ${summary.discrepancies} discrepancies${errors}</span>
+                <span class="run-date">${escapeHtml(created)}</span>
+            </button>
+        `;
+    }).join('');
+    elements.runHistoryList.querySelectorAll('.run-history-item').forEach(item => {
+        item.addEventListener('click', () => openPastRun(item.dataset.runId));
+    });
+}
+
+async function openPastRun(runId) {
+    try {
+        const response = await window.electronAPI.restoreRun(runId, PROCESS_TOP_K);
+        if (!response?.success) throw new Error(response?.error || 'Unknown error');
+
+        AppState.selectedUnit = response.unit;
+        AppState.ateliers = UnitConfigs[response.unit]?.ateliers || [];
+        elements.selectedUnitName.textContent = UnitConfigs[response.unit]?.name || response.unit;
+        resetFileState();
+        renderAteliersList();
+        AppState.selectedMonth = response.month;
+        elements.monthSelect.value = response.month;
+        AppState.reportData = {};
+        updateReportCount();
+
+        AppState.results = response.results;
+        AppState.runId = response.runId;
+        showResults();
+    } catch (error) {
+        showToast(`Could not open run: ${error.message || error}`, 'error');
+    }
+}
+
 // ============================================
 // File Upload & Drop Zone
 // ============================================
@@ -589,6 +685,7 @@ function renderUnmatchedFiles() {
 
 function updateStockFileDisplay() {
     const container = elements.stockFileDisplay;
+    syncPrefetch();
 
     if (AppState.selectedUnit === 'Mags') {
         const current = AppState.stockFile;
@@ -770,6 +867,49 @@ function updateUI() {
     renderUnmatchedFiles();
     updateCounts();
     validateProcessButton();
+    syncPrefetch();
+}
+
+// ============================================
+// Background Prefetch
+// ============================================
+// The backend parses the stock file and every matched movement workbook into
+// its sheet cache while the user is still arranging files. A job is keyed by
+// unit, atelier and path, so removing or re-assigning a file cancels its job.
+function prefetchJobId(atelier, path) {
+    return `${AppState.selectedUnit}|${atelier ?? ''}|${path}`;
+}
+
+function syncPrefetch() {
+    const wanted = new Map();
+    for (const stock of [AppState.stockFile, AppState.prevStockFile]) {
+        if (stock?.path) {
+            wanted.set(prefetchJobId(null, stock.path), { atelier: null, path: stock.path });
+        }
+    }
+    for (const [atelier, file] of Object.entries(AppState.matchedFiles)) {
+        if (file?.path) {
+            wanted.set(prefetchJobId(atelier, file.path), { atelier, path: file.path });
+        }
+    }
+
+    for (const jobId of AppState.prefetchJobs.keys()) {
+        if (!wanted.has(jobId)) {
+            AppState.prefetchJobs.delete(jobId);
+            window.electronAPI.cancelPrefetch(jobId);
+        }
+    }
+    for (const [jobId, { atelier, path }] of wanted) {
+        if (!AppState.prefetchJobs.has(jobId)) {
+            const job = window.electronAPI.prefetchFile(jobId, AppState.selectedUnit, path, atelier)
+                .catch(err => console.warn('Prefetch failed:', err));
+            AppState.prefetchJobs.set(jobId, job);
+        }
+    }
+}
+
+async function waitForPrefetch() {
+    await Promise.allSettled([...AppState.prefetchJobs.values()]);
 }
 
 function updateCounts() {
@@ -1014,20 +1154,48 @@ function closeVerificationModal() {
 // ============================================
 // File Processing
 // ============================================
+function processInputs(files, overrides, stockPayload) {
+    return {
+        runId: AppState.runId,
+        unit: AppState.selectedUnit,
+        month: AppState.selectedMonth,
+        stock: JSON.stringify([stockPayload?.path || null, stockPayload?.prevPath || null]),
+        files: Object.fromEntries(Object.entries(files).map(([atelier, file]) =>
+            [atelier, JSON.stringify([file.path, overrides?.[atelier] || null])]))
+    };
+}
+
+// The one atelier whose file or overrides changed since the retained run was processed,
+// or null when anything else changed (or nothing did) and the whole unit is processed
+function changedAtelier(inputs) {
+    const last = AppState.processedInputs;
+    if (!last || !AppState.runId || !AppState.results || last.runId !== AppState.runId) return null;
+    if (last.unit !== inputs.unit || last.month !== inputs.month || last.stock !== inputs.stock) return null;
+    const ateliers = Object.keys(inputs.files);
+    if (ateliers.length !== Object.keys(last.files).length || ateliers.some(atelier => !(atelier in last.files))) return null;
+    const changed = ateliers.filter(atelier => last.files[atelier] !== inputs.files[atelier]);
+    return changed.length === 1 ? changed[0] : null;
+}
+
 async function processFiles() {
     navigateTo('page-processing');
 
     try {
-        // Prepare matched files (exclude skipped)
+        // Prepare matched files (exclude skipped), passing along the layout
+        // verification resolved so the backend can skip header detection
         const filesToProcess = {};
         for (const [atelier, file] of Object.entries(AppState.matchedFiles)) {
             if (!AppState.skippedAteliers.has(atelier)) {
-                filesToProcess[atelier] = file;
+                const layout = AppState.verificationResults?.[atelier]?.layout;
+                filesToProcess[atelier] = layout ? { ...file, layout } : file;
             }
         }
 
         updateProgress(10, 'Loading files...');
 
+        // Let background parsing of the assigned files finish so the backend reads its cache
+        await waitForPrefetch();
+
         // Prepare overrides if any
         const overrides = Object.keys(AppState.fileOverrides).length > 0 ? AppState.fileOverrides : null;
 
@@ -1040,12 +1208,37 @@ async function processFiles() {
             }
             : AppState.stockFile;
 
+        // Only one atelier changed: process it again against the retained run
+        const inputs = processInputs(filesToProcess, overrides, stockPayload);
+        const atelier = changedAtelier(inputs);
+        if (atelier) {
+            updateProgress(30, `Processing ${atelier}...`);
+            const result = await window.electronAPI.processAtelier(
+                AppState.runId,
+                atelier,
+                stockPayload,
+                filesToProcess[atelier],
+                overrides?.[atelier] || null,
+                PROCESS_TOP_K
+            );
+            if (!result || !result.success) throw new Error(result?.error || 'Unknown processing error');
+            AppState.results[atelier] = result.result;
+            AppState.results._summary = result.summary;
+            AppState.processedInputs = inputs;
+            updateProgress(100, 'Complete!');
+            setTimeout(() => {
+                showResults();
+            }, 500);
+            return;
+        }
+
         const result = await window.electronAPI.processFiles(
             AppState.selectedUnit,
             stockPayload,
             filesToProcess,
             AppState.selectedMonth,
-            overrides
+            overrides,
+            PROCESS_TOP_K
         );
 
         updateProgress(100, 'Complete!');
@@ -1054,6 +1247,8 @@ async function processFiles() {
         console.log('Raw processor result:', result);
         if (result && result.success && result.results) {
             AppState.results = result.results;
+            AppState.runId = result.runId || null;
+            AppState.processedInputs = { ...inputs, runId: AppState.runId };
         } else if (result && !result.success) {
             throw new Error(result.error || 'Unknown processing error');
         } else {
@@ -1093,171 +1288,350 @@ function showResults() {
     const results = AppState.results;
 
     // Check for errors in results
-    for (const [atelier, data] of Object.entries(results)) {
-        if (data.error) {
-            console.error(`Error in ${atelier}:`, data.error);
+    if (results._error) {
+        showToast(results._error, 'error');
+    }
+    for (const atelier of atelierNames(results)) {
+        if (results[atelier].error) {
+            console.error(`Error in ${atelier}:`, results[atelier].error);
         }
     }
 
-    // Update summary
-    let totalMatches = 0;
-    let totalDiscrepancies = 0;
+    // Quantities that could not be read were counted as 0
+    const unparsed = atelierNames(results)
+        .filter(atelier => results[atelier].unparsedQuantities > 0)
+        .map(atelier => `${atelier} (${results[atelier].unparsedQuantities})`);
+    if (unparsed.length > 0) {
+        showToast(`Unreadable quantities counted as 0: ${unparsed.join(', ')}`, 'warning');
+    }
 
-    for (const atelier of Object.keys(results)) {
-        const matchCount = results[atelier].matches?.length || 0;
-        const discCount = results[atelier].discrepancies?.length || 0;
-        console.log(`${atelier}: ${matchCount} matches, ${discCount} discrepancies`);
-        totalMatches += matchCount;
-        totalDiscrepancies += discCount;
+    // Movement rows that were not kept for drill-down (e.g. large CSVs)
+    for (const atelier of atelierNames(results)) {
+        if (results[atelier].movementsNote) {
+            showToast(`${atelier}: ${results[atelier].movementsNote}`, 'info');
+        }
     }
 
-    elements.totalMatches.textContent = totalMatches;
-    elements.totalDiscrepancies.textContent = totalDiscrepancies;
-    elements.totalAteliers.textContent = Object.keys(results).length;
+    // Update summary
+    updateResultsSummary();
+    elements.totalAteliers.textContent = atelierNames(results).length;
 
     // Populate atelier dropdown
     elements.atelierSelect.innerHTML = '<option value="">Select an atelier...</option>';
-    for (const atelier of Object.keys(results)) {
+    for (const atelier of atelierNames(results)) {
         const option = document.createElement('option');
         option.value = atelier;
-        const matchCount = results[atelier].matches?.length || 0;
-        const discCount = results[atelier].discrepancies?.length || 0;
-        option.textContent = `${atelier} (${matchCount} / ${discCount})`;
+        const summary = atelierSummary(atelier);
+        option.textContent = `${atelier} (${summary.matches} / ${summary.discrepancies})`;
         elements.atelierSelect.appendChild(option);
     }
 
     // Auto-select first atelier
-    if (Object.keys(results).length > 0) {
-        elements.atelierSelect.value = Object.keys(results)[0];
+    if (atelierNames(results).length > 0) {
+        elements.atelierSelect.value = atelierNames(results)[0];
         renderResultsTable();
     }
 }
 
-function renderResultsTable() {
-    const atelier = elements.atelierSelect.value;
-    const viewType = document.querySelector('.toggle-btn.active').dataset.view;
+// A process run returns only each atelier's largest discrepancies; the table reads the
+// retained run, and features that need every row fetch the rest with ensureFullResults()
+const PROCESS_TOP_K = 1000;
 
-    if (!atelier || !AppState.results || !AppState.results[atelier]) {
-        elements.resultsTbody.innerHTML = `
-            <tr class="empty-row">
-                <td colspan="4">Select an atelier to view results</td>
-            </tr>
-        `;
-        return;
+async function ensureFullResults(atelier) {
+    const data = AppState.results?.[atelier];
+    if (!data?.partial) return true;
+    if (!AppState.runId) {
+        showToast('All rows of this atelier are no longer available', 'error');
+        return false;
     }
+    try {
+        const rows = {};
+        for (const view of ['matches', 'discrepancies']) {
+            const response = await window.electronAPI.queryResults({
+                runId: AppState.runId,
+                atelier,
+                view,
+                offset: 0,
+                limit: data.partial[view] + 1
+            });
+            if (!response || !response.success) throw new Error(response?.error || 'Could not load results');
+            rows[view] = response.rows.map(({ Row, ...row }) => row);
+        }
+        Object.assign(data, rows);
+        delete data.partial;
+        return true;
+    } catch (error) {
+        console.error('Could not load all rows:', error);
+        showToast('Could not load all rows of this atelier', 'error');
+        return false;
+    }
+}
+
+// Rows are fetched in blocks from the retained run (or sliced from the rows held
+// in the renderer) and only the rows scrolled into view, plus a buffer, are in the DOM
+const RESULTS_BLOCK_SIZE = 200;
+const RESULTS_BUFFER_ROWS = 20;
+const RESULTS_DEFAULT_ROW_HEIGHT = 45;
+
+const ResultsWindow = {
+    key: null,             // View the cached blocks belong to (run, atelier, view, search, sort)
+    generation: 0,         // Bumped whenever cached blocks are dropped; late blocks are ignored
+    total: 0,
+    blocks: new Map(),     // { blockIndex: rows }
+    loading: new Map(),    // { blockIndex: Promise }
+    localRows: null,       // Filtered and sorted rows when no run is retained
+    highlighted: new Map(), // ref -> 'high' | 'low' in verify mode
+    rowHeight: 0,
+    first: -1,
+    last: -1,
+    framePending: false
+};
 
-    const atelierData = AppState.results[atelier];
+function currentResultsView() {
+    return {
+        atelier: elements.atelierSelect.value,
+        viewType: document.querySelector('.toggle-btn.active').dataset.view
+    };
+}
 
-    // Check for error
-    if (atelierData.error) {
-        elements.resultsTbody.innerHTML = `
-            <tr class="empty-row error-row">
-                <td colspan="4" style="color: var(--error-600);">
-                    <strong>Error:</strong> ${atelierData.error}
-                </td>
-            </tr>
-        `;
-        return;
+// One block of the current view from the retained run
+async function fetchResultsPage(atelier, viewType, offset) {
+    const { query, prefix } = parseSearchQuery(AppState.searchQuery);
+    const response = await window.electronAPI.queryResults({
+        runId: AppState.runId,
+        atelier,
+        view: viewType,
+        search: query,
+        prefix,
+        sortColumn: AppState.currentSortColumn,
+        sortDirection: AppState.currentSortDirection,
+        offset,
+        limit: RESULTS_BLOCK_SIZE
+    });
+    if (!response || !response.success) {
+        const error = new Error(response?.error || 'Could not load results page');
+        error.runMissing = Boolean(response?.runMissing);
+        throw error;
     }
+    return response;
+}
 
+// The whole view computed from the rows held in the renderer (used when no run was retained)
+function localResultsRows(atelierData, viewType) {
     let data = [...(atelierData[viewType] || [])];
 
     // Apply search filter
-    if (AppState.searchQuery) {
-        const query = AppState.searchQuery.toLowerCase();
+    const { query, prefix } = parseSearchQuery(AppState.searchQuery);
+    if (query) {
+        const lowered = query.toLowerCase();
         data = data.filter(row => {
             const ref = (row.Ref || '').toString().toLowerCase();
-            return ref.includes(query);
+            return prefix ? ref.startsWith(lowered) : ref.includes(lowered);
         });
     }
 
     // Apply sorting
     if (AppState.currentSortColumn) {
-        data.sort((a, b) => {
-            let aVal = a[AppState.currentSortColumn];
-            let bVal = b[AppState.currentSortColumn];
-
-            // Handle numeric values
-            if (typeof aVal === 'number' || typeof bVal === 'number') {
-                aVal = parseFloat(aVal) || 0;
-                bVal = parseFloat(bVal) || 0;
-            } else {
-                aVal = (aVal || '').toString().toLowerCase();
-                bVal = (bVal || '').toString().toLowerCase();
+        const column = AppState.currentSortColumn;
+        const numeric = column !== 'Ref';
+        const keyed = data.map(row => ({
+            row,
+            key: numeric ? (parseFloat(row[column]) || 0) : (row[column] || '').toString().toLowerCase()
+        }));
+        const sign = AppState.currentSortDirection === 'asc' ? 1 : -1;
+        keyed.sort((a, b) => (a.key < b.key ? -sign : a.key > b.key ? sign : 0));
+        data = keyed.map(item => item.row);
+    }
+    return data;
+}
+
+// Loads a block of the current view once; resolves to its rows (or null if the view changed meanwhile).
+// A failed block is not kept, so the next render asks for it again.
+function loadResultsBlock(block) {
+    if (ResultsWindow.blocks.has(block)) return Promise.resolve(ResultsWindow.blocks.get(block));
+    if (ResultsWindow.loading.has(block)) return ResultsWindow.loading.get(block);
+
+    const generation = ResultsWindow.generation;
+    const { atelier, viewType } = currentResultsView();
+    const offset = block * RESULTS_BLOCK_SIZE;
+    const request = (async () => {
+        let page;
+        if (AppState.runId) {
+            try {
+                page = await fetchResultsPage(atelier, viewType, offset);
+            } catch (error) {
+                console.error('Results page failed:', error);
+                if (!error.runMissing) throw error;
+                AppState.runId = null;
             }
+        }
+        if (!page) {
+            // A process run hands back only the largest discrepancies; the rest were in the run
+            if (AppState.results[atelier]?.partial) {
+                throw new Error('The full results of this run are no longer available, process the files again');
+            }
+            if (!ResultsWindow.localRows) {
+                ResultsWindow.localRows = localResultsRows(AppState.results[atelier], viewType);
+            }
+            const rows = ResultsWindow.localRows;
+            page = { rows: rows.slice(offset, offset + RESULTS_BLOCK_SIZE), total: rows.length };
+        }
+        if (generation !== ResultsWindow.generation) return null;
+        ResultsWindow.loading.delete(block);
+        // The backend clamps an offset past the end to the last row
+        ResultsWindow.blocks.set(block, page.offset === undefined || page.offset === offset ? page.rows : []);
+        ResultsWindow.total = page.total;
+        return page.rows;
+    })();
+    ResultsWindow.loading.set(block, request);
+    request.catch(() => {
+        if (ResultsWindow.loading.get(block) === request) ResultsWindow.loading.delete(block);
+    });
+    return request;
+}
 
-            if (aVal < bVal) return AppState.currentSortDirection === 'asc' ? -1 : 1;
-            if (aVal > bVal) return AppState.currentSortDirection === 'asc' ? 1 : -1;
-            return 0;
-        });
+function resultsColumnCount(viewType) {
+    return AppState.verifyMode && viewType === 'discrepancies' ? 5 : 4;
+}
+
+function resultsRowHtml(row, viewType) {
+    const diff = parseFloat(row.Difference) || 0;
+    let rowClass = diff > 0 ? 'positive' : diff < 0 ? 'negative' : '';
+    const refHighlight = row.Highlight
+        ? highlightSpans(row.Ref, row.Highlight)
+        : highlightMatchSafe(row.Ref || '', parseSearchQuery(AppState.searchQuery).query);
+
+    // Add highlighting classes in verify mode
+    const highlightLevel = ResultsWindow.highlighted.get(row.Ref);
+    if (highlightLevel === 'high') {
+        rowClass += ' opposite-high-similarity';
+    } else if (highlightLevel === 'low') {
+        rowClass += ' opposite-low-similarity';
     }
 
-    if (data.length === 0) {
-        const message = AppState.searchQuery
-            ? `No results matching "${AppState.searchQuery}"`
-            : `No ${viewType} found for this atelier`;
-        elements.resultsTbody.innerHTML = `
-            <tr class="empty-row">
-                <td colspan="${AppState.verifyMode ? 5 : 4}">${message}</td>
-            </tr>
-        `;
-        return;
+    // Check if selected for elimination
+    const isSelected = AppState.selectedForElimination.has(row.Ref);
+    if (isSelected) {
+        rowClass += ' marked-for-deletion';
     }
 
-    // Build highlighted refs set for verify mode
-    const highlightedRefs = new Map(); // ref -> 'high' or 'low'
+    // Checkbox column for verify mode
+    let checkboxCell = '';
     if (AppState.verifyMode && viewType === 'discrepancies') {
-        AppState.oppositeMatches.forEach(match => {
-            const level = match.highSimilarity ? 'high' : 'low';
-            highlightedRefs.set(match.ref1, level);
-            highlightedRefs.set(match.ref2, level);
-        });
+        if (highlightLevel) {
+            const checked = isSelected ? 'checked' : '';
+            checkboxCell = `<td class="checkbox-cell">
+                <input class="row-select-checkbox" type="checkbox" ${checked}>
+            </td>`;
+        } else {
+            checkboxCell = '<td class="checkbox-cell"></td>';
+        }
     }
 
-    elements.resultsTbody.innerHTML = data.map(row => {
-        const diff = parseFloat(row.Difference) || 0;
-        let rowClass = diff > 0 ? 'positive' : diff < 0 ? 'negative' : '';
-        const refHighlight = highlightMatchSafe(row.Ref || '', AppState.searchQuery);
-
-        // Add highlighting classes in verify mode
-        const highlightLevel = highlightedRefs.get(row.Ref);
-        if (highlightLevel === 'high') {
-            rowClass += ' opposite-high-similarity';
-        } else if (highlightLevel === 'low') {
-            rowClass += ' opposite-low-similarity';
-        }
+    const rowRefAttr = escapeHtml(row.Ref || '');
 
-        // Check if selected for elimination
-        const isSelected = AppState.selectedForElimination.has(row.Ref);
-        if (isSelected) {
-            rowClass += ' marked-for-deletion';
+    return `
+        <tr class="${rowClass}" data-ref="${rowRefAttr}">
+            ${checkboxCell}
+            <td>${refHighlight}</td>
+            <td>${formatNumber(row.Stock_Qty)}</td>
+            <td>${formatNumber(row.Calc_Mov_Qty)}</td>
+            <td>${formatNumber(row.Difference)}</td>
+        </tr>
+    `;
+}
+
+function updateResultsRange() {
+    if (!elements.resultsRange) return;
+    const total = ResultsWindow.total;
+    elements.resultsRange.classList.toggle('hidden', total === 0);
+    const first = Math.min(ResultsWindow.first + 1, total);
+    const last = Math.min(ResultsWindow.last, total);
+    elements.resultsRange.textContent = `${first}–${last} of ${total}`;
+}
+
+// Renders the rows in view; missing blocks are shown as placeholders and rendered once loaded
+function renderResultsWindow(force = false) {
+    const container = elements.resultsTableContainer;
+    const { viewType } = currentResultsView();
+    const total = ResultsWindow.total;
+    const rowHeight = ResultsWindow.rowHeight || RESULTS_DEFAULT_ROW_HEIGHT;
+    const visible = Math.ceil(container.clientHeight / rowHeight) || 1;
+    const top = Math.min(Math.floor(container.scrollTop / rowHeight), Math.max(0, total - visible));
+    const first = Math.max(0, top - RESULTS_BUFFER_ROWS);
+    const last = Math.min(total, first + visible + 2 * RESULTS_BUFFER_ROWS);
+    if (!force && first === ResultsWindow.first && last === ResultsWindow.last) return;
+    ResultsWindow.first = first;
+    ResultsWindow.last = last;
+
+    const columns = resultsColumnCount(viewType);
+    const html = [];
+    const missing = new Set();
+    for (let i = first; i < last; i++) {
+        const block = Math.floor(i / RESULTS_BLOCK_SIZE);
+        const row = ResultsWindow.blocks.get(block)?.[i - block * RESULTS_BLOCK_SIZE];
+        if (row) {
+            html.push(resultsRowHtml(row, viewType));
+        } else {
+            missing.add(block);
+            html.push(`<tr class="loading-row" style="height: ${rowHeight}px"><td colspan="${columns}"></td></tr>`);
         }
+    }
+    const spacer = height => `<tr class="spacer-row" style="height: ${height}px"><td colspan="${columns}"></td></tr>`;
+    elements.resultsTbody.innerHTML = spacer(first * rowHeight) + html.join('') + spacer((total - last) * rowHeight);
 
-        // Checkbox column for verify mode
-        let checkboxCell = '';
-        if (AppState.verifyMode && viewType === 'discrepancies') {
-            if (highlightLevel) {
-                const checked = isSelected ? 'checked' : '';
-                checkboxCell = `<td class="checkbox-cell">
-                    <input class="row-select-checkbox" type="checkbox" ${checked}>
-                </td>`;
-            } else {
-                checkboxCell = '<td class="checkbox-cell"></td>';
-            }
+    if (!ResultsWindow.rowHeight) {
+        const measured = elements.resultsTbody.querySelector('tr[data-ref]')?.offsetHeight;
+        if (measured) {
+            ResultsWindow.rowHeight = measured;
+            renderResultsWindow(true);
+            return;
         }
+    }
+    updateResultsRange();
 
-        const rowRefAttr = escapeHtml(row.Ref || '');
+    const generation = ResultsWindow.generation;
+    missing.forEach(block => loadResultsBlock(block).then(rows => {
+        if (rows && generation === ResultsWindow.generation) renderResultsWindow(true);
+    }, error => {
+        if (generation === ResultsWindow.generation) showToast(error.message, 'error');
+    }));
+}
 
-        return `
-            <tr class="${rowClass}" data-ref="${rowRefAttr}">
-                ${checkboxCell}
-                <td>${refHighlight}</td>
-                <td>${formatNumber(row.Stock_Qty)}</td>
-                <td>${formatNumber(row.Calc_Mov_Qty)}</td>
-                <td>${formatNumber(row.Difference)}</td>
-            </tr>
-        `;
-    }).join('');
+function scheduleResultsWindow() {
+    if (ResultsWindow.framePending) return;
+    ResultsWindow.framePending = true;
+    requestAnimationFrame(() => {
+        ResultsWindow.framePending = false;
+        if (ResultsWindow.total > 0) renderResultsWindow();
+    });
+}
+
+function showResultsMessage(html, { columns = 4, error = false } = {}) {
+    ResultsWindow.total = 0;
+    updateResultsRange();
+    elements.resultsTbody.innerHTML = error ? `
+        <tr class="empty-row error-row">
+            <td colspan="${columns}" style="color: var(--error-600);">${html}</td>
+        </tr>
+    ` : `
+        <tr class="empty-row">
+            <td colspan="${columns}">${html}</td>
+        </tr>
+    `;
+}
+
+// Verify-mode highlights, checkbox column and sort indicators of the current view
+function prepareResultsHeader(viewType) {
+    // Build highlighted refs set for verify mode
+    ResultsWindow.highlighted = new Map();
+    if (AppState.verifyMode && viewType === 'discrepancies') {
+        AppState.oppositeMatches.forEach(match => {
+            const level = match.highSimilarity ? 'high' : 'low';
+            ResultsWindow.highlighted.set(match.ref1, level);
+            ResultsWindow.highlighted.set(match.ref2, level);
+        });
+    }
 
     // Update table header for checkbox column
     const thead = document.querySelector('.results-table thead tr');
@@ -1267,13 +1641,95 @@ function renderResultsTable() {
     } else if ((!AppState.verifyMode || viewType !== 'discrepancies') && hasCheckboxHeader) {
         hasCheckboxHeader.remove();
     }
-
     updateVerifySelectAllCheckboxState();
 
     // Update sort indicators
     updateSortIndicators();
 }
 
+// Re-renders the rows in view from the cached blocks (verify mode changes rows, not data)
+function redrawResultsTable() {
+    if (ResultsWindow.key === null || ResultsWindow.total === 0) {
+        renderResultsTable();
+        return;
+    }
+    prepareResultsHeader(currentResultsView().viewType);
+    renderResultsWindow(true);
+}
+
+// Re-reads the current view: cached blocks are dropped (rows may have been edited),
+// and the table scrolls back to the top when the view itself changed
+async function renderResultsTable() {
+    const { atelier, viewType } = currentResultsView();
+    updateAtelierSummary(atelier);
+    ResultsWindow.generation++;
+    ResultsWindow.blocks.clear();
+    ResultsWindow.loading.clear();
+    ResultsWindow.localRows = null;
+    ResultsWindow.first = ResultsWindow.last = -1;
+
+    if (!atelier || !AppState.results || !AppState.results[atelier]) {
+        ResultsWindow.key = null;
+        showResultsMessage('Select an atelier to view results');
+        return;
+    }
+
+    const atelierData = AppState.results[atelier];
+
+    // Check for error
+    if (atelierData.error) {
+        ResultsWindow.key = null;
+        showResultsMessage(`<strong>Error:</strong> ${atelierData.error}`, { error: true });
+        return;
+    }
+
+    const key = JSON.stringify([AppState.runId, atelier, viewType, AppState.searchQuery,
+        AppState.currentSortColumn, AppState.currentSortDirection]);
+    if (key !== ResultsWindow.key) {
+        ResultsWindow.key = key;
+        elements.resultsTableContainer.scrollTop = 0;
+    }
+
+    prepareResultsHeader(viewType);
+
+    // The first block gives the row count the scroll height is laid out for
+    const generation = ResultsWindow.generation;
+    const firstBlock = Math.floor(elements.resultsTableContainer.scrollTop
+        / (ResultsWindow.rowHeight || RESULTS_DEFAULT_ROW_HEIGHT) / RESULTS_BLOCK_SIZE);
+    let rows;
+    try {
+        rows = await loadResultsBlock(firstBlock);
+    } catch (error) {
+        if (generation !== ResultsWindow.generation) return;
+        ResultsWindow.key = null;
+        showResultsMessage(`<strong>Error:</strong> ${escapeHtml(error.message)}`, { error: true });
+        return;
+    }
+    if (rows === null || generation !== ResultsWindow.generation) return;
+    if (ResultsWindow.total === 0) {
+        const message = AppState.searchQuery
+            ? `No results matching "${escapeHtml(AppState.searchQuery)}"`
+            : `No ${viewType} found for this atelier`;
+        showResultsMessage(message, { columns: resultsColumnCount(viewType) });
+        return;
+    }
+    renderResultsWindow(true);
+}
+
+// Reflects selection changes on the rows in view without re-rendering them
+function updateRowSelection(refs) {
+    const wanted = new Set(refs);
+    elements.resultsTbody.querySelectorAll('tr[data-ref]').forEach(tr => {
+        const ref = tr.dataset.ref;
+        if (!wanted.has(ref)) return;
+        const selected = AppState.selectedForElimination.has(ref);
+        tr.classList.toggle('marked-for-deletion', selected);
+        const checkbox = tr.querySelector('.row-select-checkbox');
+        if (checkbox) checkbox.checked = selected;
+    });
+    updateVerifySelectAllCheckboxState();
+}
+
 function updateVerifySelectAllCheckboxState() {
     const selectAll = document.getElementById('verify-select-all');
     if (!selectAll) return;
@@ -1348,6 +1804,7 @@ async function exportResults() {
         showToast('Please select an atelier first', 'warning');
         return;
     }
+    if (!(await ensureFullResults(atelier))) return;
 
     const data = AppState.results[atelier][viewType] || [];
 
@@ -1377,6 +1834,7 @@ async function exportResultsExcel() {
         showToast('Please select an atelier first', 'warning');
         return;
     }
+    if (!(await ensureFullResults(atelier))) return;
 
     const data = AppState.results[atelier][viewType] || [];
 
@@ -1409,6 +1867,8 @@ function resetFileState() {
     AppState.unmatchedFiles = [];
     AppState.skippedAteliers.clear();
     AppState.results = null;
+    AppState.runId = null;
+    AppState.processedInputs = null;
     AppState.verificationResults = null;
     AppState.fileOverrides = {};
     AppState.currentSortColumn = null;
@@ -1508,7 +1968,7 @@ function findOppositeDiscrepancies() {
     return matches;
 }
 
-function toggleVerifyMode() {
+async function toggleVerifyMode() {
     const viewType = document.querySelector('.toggle-btn.active').dataset.view;
     if (viewType !== 'discrepancies') {
         showToast('Switch to Discrepancies view first', 'warning');
@@ -1516,6 +1976,8 @@ function toggleVerifyMode() {
     }
 
     if (!AppState.verifyMode) {
+        if (!(await ensureFullResults(elements.atelierSelect.value))) return;
+
         // Enter verify mode
         AppState.oppositeMatches = findOppositeDiscrepancies();
 
@@ -1551,7 +2013,7 @@ function toggleVerifyMode() {
         eliminateSelectedOpposites();
     }
 
-    renderResultsTable();
+    redrawResultsTable();
 }
 
 function eliminateSelectedOpposites() {
@@ -1570,9 +2032,7 @@ function eliminateSelectedOpposites() {
     AppState.results[atelier].discrepancies = AppState.results[atelier].discrepancies.filter(
         row => !toRemoveNormalized.has((row.Ref ?? '').toString().trim())
     );
-
-    // Update totals
-    updateResultsSummary();
+    syncRunEdit(atelier, 'discrepancies', { remove: Array.from(toRemoveNormalized) }).then(renderResultsTable);
 
     showToast(`Eliminated ${toRemove.size} items`, 'success');
     exitVerifyMode();
@@ -1592,7 +2052,7 @@ function exitVerifyMode() {
     elements.btnVerifyOpposite.classList.remove('btn-danger');
     elements.btnVerifyOpposite.classList.add('btn-warning');
 
-    renderResultsTable();
+    redrawResultsTable();
 }
 
 function toggleRowSelection(ref) {
@@ -1601,22 +2061,124 @@ function toggleRowSelection(ref) {
     } else {
         AppState.selectedForElimination.add(ref);
     }
-    renderResultsTable();
+    updateRowSelection([ref]);
+}
+
+// Apply a row edit to the retained run too, so later pages agree with the edited rows,
+// and take the atelier's updated summary from it.
+// If that fails the table and the summary fall back to the rows held in the renderer.
+async function syncRunEdit(atelier, viewType, edit) {
+    let summary = null;
+    if (AppState.runId) {
+        const runId = AppState.runId;
+        try {
+            const response = await window.electronAPI.editResults(runId, atelier, viewType, edit);
+            if (!response || !response.success) throw new Error(response?.error || 'edit failed');
+            summary = response.summary;
+        } catch (error) {
+            console.error('Could not edit retained run:', error);
+            if (AppState.runId === runId) AppState.runId = null;
+        }
+    }
+    if (!AppState.results?.[atelier]) return;
+    AppState.results[atelier]._summary = summary || rowsSummary(AppState.results[atelier]);
+    AppState.results._summary = null;
+    updateResultsSummary();
+}
+
+// Result keys that are ateliers (the backend adds '_summary', and '_error' when the stock could not be read)
+function atelierNames(results) {
+    return Object.keys(results || {}).filter(key => !key.startsWith('_'));
+}
+
+const SUMMARY_TOP_REFS = 10;
+
+// Counts and totals of an atelier's rows, as the backend computes them with the comparison.
+// Only used when an atelier has no backend summary for its current rows.
+function rowsSummary(data) {
+    const discrepancies = data.discrepancies || [];
+    const summary = {
+        matches: (data.matches || []).length,
+        discrepancies: discrepancies.length,
+        totalAbsDifference: 0, positiveCount: 0, positiveTotal: 0, negativeCount: 0, negativeTotal: 0
+    };
+    for (const row of discrepancies) {
+        const diff = parseFloat(row.Difference) || 0;
+        summary.totalAbsDifference += Math.abs(diff);
+        if (diff > 0) {
+            summary.positiveCount++;
+            summary.positiveTotal += diff;
+        } else if (diff < 0) {
+            summary.negativeCount++;
+            summary.negativeTotal += diff;
+        }
+    }
+    summary.topRefs = [...discrepancies]
+        .sort((a, b) => Math.abs(b.Difference) - Math.abs(a.Difference))
+        .slice(0, SUMMARY_TOP_REFS)
+        .map(row => ({ Ref: row.Ref, Difference: row.Difference }));
+    return summary;
+}
+
+function atelierSummary(atelier) {
+    const data = AppState.results?.[atelier];
+    if (!data || data.error) return rowsSummary({});
+    if (!data._summary) data._summary = rowsSummary(data);
+    return data._summary;
+}
+
+// Unit totals over the atelier summaries (a few numbers per atelier, no rows)
+function mergeSummaries(summaries) {
+    const merged = {
+        matches: 0, discrepancies: 0, totalAbsDifference: 0,
+        positiveCount: 0, positiveTotal: 0, negativeCount: 0, negativeTotal: 0, topRefs: []
+    };
+    for (const summary of summaries) {
+        for (const key of Object.keys(merged)) {
+            if (key !== 'topRefs') merged[key] += summary[key] || 0;
+        }
+        merged.topRefs.push(...(summary.topRefs || []));
+    }
+    merged.topRefs = merged.topRefs
+        .sort((a, b) => Math.abs(b.Difference) - Math.abs(a.Difference))
+        .slice(0, SUMMARY_TOP_REFS);
+    return merged;
+}
+
+function formatSummaryLine(summary) {
+    if (!summary.discrepancies) return `${summary.matches} matches, no discrepancies`;
+    const top = summary.topRefs.slice(0, 3)
+        .map(row => `${escapeHtml(row.Ref)} (${formatNumber(row.Difference)})`).join(', ');
+    return `Σ |Difference| <strong>${formatNumber(summary.totalAbsDifference)}</strong>`
+        + ` · +${summary.positiveCount} (${formatNumber(summary.positiveTotal)})`
+        + ` · −${summary.negativeCount} (${formatNumber(summary.negativeTotal)})`
+        + (top ? ` · Largest: ${top}` : '');
+}
+
+function updateAtelierSummary(atelier) {
+    if (!elements.atelierSummary) return;
+    const data = AppState.results?.[atelier];
+    elements.atelierSummary.classList.toggle('hidden', !data || !!data.error);
+    if (data && !data.error) {
+        elements.atelierSummary.innerHTML = formatSummaryLine(atelierSummary(atelier));
+    }
 }
 
 function updateResultsSummary() {
     if (!AppState.results) return;
 
-    let totalMatches = 0;
-    let totalDiscrepancies = 0;
-
-    for (const atelier of Object.keys(AppState.results)) {
-        totalMatches += AppState.results[atelier].matches?.length || 0;
-        totalDiscrepancies += AppState.results[atelier].discrepancies?.length || 0;
+    // The backend's unit summary holds until an atelier's rows are edited
+    if (!AppState.results._summary) {
+        AppState.results._summary = mergeSummaries(atelierNames(AppState.results).map(atelierSummary));
     }
+    const summary = AppState.results._summary;
 
-    elements.totalMatches.textContent = totalMatches;
-    elements.totalDiscrepancies.textContent = totalDiscrepancies;
+    elements.totalMatches.textContent = summary.matches;
+    elements.totalDiscrepancies.textContent = summary.discrepancies;
+    if (elements.totalAbsDifference) {
+        elements.totalAbsDifference.textContent = formatNumber(summary.totalAbsDifference);
+    }
+    updateAtelierSummary(elements.atelierSelect.value);
 }
 
 // ============================================
@@ -1656,8 +2218,7 @@ function deleteRowFromContext() {
         row => (row.Ref ?? '').toString().trim() !== refNorm
     );
 
-    updateResultsSummary();
-    renderResultsTable();
+    syncRunEdit(atelier, viewType, { remove: [refNorm] }).then(renderResultsTable);
     hideContextMenu();
     showToast('Row deleted', 'success');
 }
@@ -1687,12 +2248,14 @@ function editRowFromContext() {
     // Update first matching row in the selected table
     const rows = AppState.results[atelier][viewType];
     const rowToEdit = rows.find(r => (r.Ref ?? '').toString().trim() === oldRefNorm);
-    if (!rowToEdit) {
+    if (rowToEdit) {
+        rowToEdit.Ref = newRef;
+    } else if (!AppState.results[atelier].partial) {
+        // Rows past the first look are only in the retained run, which is edited below
         showToast('Row not found', 'warning');
         hideContextMenu();
         return;
     }
-    rowToEdit.Ref = newRef;
 
     // Keep verify-mode selection consistent
     if (AppState.verifyMode) {
@@ -1710,16 +2273,57 @@ function editRowFromContext() {
         });
     }
 
-    updateResultsSummary();
-    renderResultsTable();
+    syncRunEdit(atelier, viewType, { rename: { [oldRefNorm]: newRef } }).then(renderResultsTable);
     hideContextMenu();
     showToast('Reference updated', 'success');
 }
 
+// The movement rows a reference's quantity was summed from, kept with the retained run
+async function showMovementsFromContext() {
+    const ref = AppState.contextMenuRowRef;
+    const atelier = AppState.contextMenuAtelier;
+    hideContextMenu();
+    if (!ref || !atelier) return;
+    if (!AppState.runId) {
+        showToast('Movements are only available for a retained run', 'warning');
+        return;
+    }
+
+    try {
+        const response = await window.electronAPI.referenceMovements(AppState.runId, atelier, ref);
+        if (!response || !response.success) throw new Error(response?.error || 'Could not load movements');
+        if (response.error) {
+            showToast(response.error, 'warning');
+            return;
+        }
+
+        elements.movementsTitle.textContent = `Movements of ${ref}`;
+        elements.movementsSummary.textContent =
+            `${response.rows.length} movement row${response.rows.length === 1 ? '' : 's'}, total ${formatNumber(response.total)}`;
+        elements.movementsTbody.innerHTML = response.rows.length === 0
+            ? '<tr class="empty-row"><td colspan="5">No movement rows for this reference</td></tr>'
+            : response.rows.map(row => `
+                <tr>
+                    <td>${escapeHtml(row.Date ?? '—')}</td>
+                    <td>${escapeHtml(row.Sheet)}</td>
+                    <td>${row.Row}</td>
+                    <td>${formatNumber(row.Qty)}</td>
+                    <td>${formatNumber(row.Cumulative)}</td>
+                </tr>`).join('');
+        elements.movementsModal.classList.remove('hidden');
+    } catch (error) {
+        showToast(`Error: ${error.message}`, 'error');
+    }
+}
+
+function closeMovementsModal() {
+    elements.movementsModal.classList.add('hidden');
+}
+
 // ============================================
 // Report Generation
 // ============================================
-function addToReport() {
+async function addToReport() {
     const atelier = elements.atelierSelect.value;
     const viewType = document.querySelector('.toggle-btn.active').dataset.view;
 
@@ -1727,6 +2331,7 @@ function addToReport() {
         showToast('Select an atelier and switch to Discrepancies view', 'warning');
         return;
     }
+    if (!(await ensureFullResults(atelier))) return;
 
     const discrepancies = AppState.results[atelier]?.discrepancies || [];
     if (discrepancies.length === 0) {
@@ -1735,7 +2340,10 @@ function addToReport() {
     }
 
     // Deep copy the discrepancies
-    AppState.reportData[atelier] = JSON.parse(JSON.stringify(discrepancies));
+    AppState.reportData[atelier] = {
+        discrepancies: JSON.parse(JSON.stringify(discrepancies)),
+        summary: { ...atelierSummary(atelier) }
+    };
 
     updateReportCount();
     showToast(`Added ${atelier} to report`, 'success');
@@ -1797,7 +2405,7 @@ FABRICATION DE MOUSSE ET DE LITERIE
 `;
 
     // Add each atelier table
-    for (const [atelierName, discrepancies] of Object.entries(AppState.reportData)) {
+    for (const [atelierName, { discrepancies, summary }] of Object.entries(AppState.reportData)) {
         markdown += `## ${atelierName}\n\n`;
         markdown += `| REFERENCE | ETAT STOCKS | FICHIER DE MOV | ECARTS |\n`;
         markdown += `|-----------|-------------|----------------|--------|\n`;
@@ -1808,6 +2416,8 @@ FABRICATION DE MOUSSE ET DE LITERIE
             const diff = parseFloat(row.Difference || 0).toFixed(2);
             markdown += `| ${row.Ref} | ${stockQty} | ${movQty} | ${diff} |\n`;
         }
+        markdown += `| **(+) ${summary.positiveCount}** | | | **${summary.positiveTotal.toFixed(2)}** |\n`;
+        markdown += `| **(−) ${summary.negativeCount}** | | | **${summary.negativeTotal.toFixed(2)}** |\n`;
         markdown += `\n---\n\n`;
     }
 
@@ -1876,7 +2486,7 @@ async function exportReportPdf() {
 
         // Build atelier tables HTML
         let ateliersHtml = '';
-        for (const [atelierName, discrepancies] of Object.entries(AppState.reportData)) {
+        for (const [atelierName, { discrepancies, summary }] of Object.entries(AppState.reportData)) {
             let rowsHtml = '';
             for (const row of discrepancies) {
                 const stockQty = parseFloat(row.Stock_Qty || 0).toFixed(2);
@@ -1891,6 +2501,16 @@ async function exportReportPdf() {
                         <td class="border border-gray-400 px-4 py-2 text-right ${diffClass}">${diff}</td>
                     </tr>`;
             }
+            for (const [label, count, total] of [['(+)', summary.positiveCount, summary.positiveTotal],
+                ['(−)', summary.negativeCount, summary.negativeTotal]]) {
+                rowsHtml += `
+                    <tr class="bg-gray-100 font-bold">
+                        <td class="border border-gray-400 px-4 py-2">${label} ${count}</td>
+                        <td class="border border-gray-400 px-4 py-2"></td>
+                        <td class="border border-gray-400 px-4 py-2"></td>
+                        <td class="border border-gray-400 px-4 py-2 text-right">${total.toFixed(2)}</td>
+                    </tr>`;
+            }
 
             ateliersHtml += `
             <div class="mb-8" dir="ltr">
@@ -2072,6 +2692,12 @@ function initEventListeners() {
         });
     }
 
+    // Results rows are rendered as they scroll into view
+    if (elements.resultsTableContainer) {
+        elements.resultsTableContainer.addEventListener('scroll', scheduleResultsWindow, { passive: true });
+        window.addEventListener('resize', scheduleResultsWindow);
+    }
+
     // Sortable headers
     document.querySelectorAll('.results-table th.sortable').forEach(th => {
         th.addEventListener('click', () => {
@@ -2115,7 +2741,7 @@ function initEventListeners() {
         } else {
             all.forEach(ref => AppState.selectedForElimination.delete(ref));
         }
-        renderResultsTable();
+        updateRowSelection(all);
     });
 
     elements.btnExport.addEventListener('click', exportResults);
@@ -2175,6 +2801,15 @@ function initEventListeners() {
     if (elements.ctxEditRow) {
         elements.ctxEditRow.addEventListener('click', editRowFromContext);
     }
+    if (elements.ctxShowMovements) {
+        elements.ctxShowMovements.addEventListener('click', showMovementsFromContext);
+    }
+
+    // Movements Modal
+    if (elements.movementsModal) {
+        elements.closeMovementsModal.addEventListener('click', closeMovementsModal);
+        elements.movementsModal.querySelector('.modal-overlay').addEventListener('click', closeMovementsModal);
+    }
 }
 
 // ============================================
@@ -2184,17 +2819,11 @@ document.addEventListener('DOMContentLoaded', () => {
     initUnitSelection();
     initDropZone();
     initEventListeners();
+    loadRunHistory();
 });
 
 // Expose functions to global scope for inline event handlers
-window.toggleRowSelection = function (ref) {
-    if (AppState.selectedForElimination.has(ref)) {
-        AppState.selectedForElimination.delete(ref);
-    } else {
-        AppState.selectedForElimination.add(ref);
-    }
-    renderResultsTable();
-};
+window.toggleRowSelection = toggleRowSelection;
 
 window.showContextMenu = function (event, ref) {
     showContextMenu(event, ref, { atelier: elements.atelierSelect.value, viewType: document.querySelector('.toggle-btn.active')?.dataset?.view });